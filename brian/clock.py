@@ -46,6 +46,7 @@ from units import *
 from globalprefs import *
 import magic
 from time import time
+from heapq import heapify, heappop, heappush
 from numpy import ceil
 
 
@@ -222,6 +223,15 @@ class Clock(magic.InstanceTracker):
         if abs(selft-othert)<=self.epsilon*abs(selft):
             return self.order<other.order
         return selft<othert
+
+    def same_time(self, other):
+        '''
+        Returns ``True`` if the two clocks have the same time, using the same
+        approximate equality test as the ordering of clocks.
+        '''
+        selft = self._t
+        othert = other._t
+        return selft==othert or abs(selft-othert)<=self.epsilon*abs(selft)
     
     
 class RegularClock(Clock):
@@ -333,6 +343,9 @@ class NaiveClock(FloatClock):
             return self.order<other.order
         return selft<othert
 
+    def same_time(self, other):
+        return self._t==other._t
+
 
 def guess_clock(clock=None):
     '''
@@ -369,6 +382,56 @@ class EventClock(Clock):
     def _track_instances(): return False
 
 
+class ClockScheduler(object):
+    '''
+    Priority queue of clocks used by :meth:`Network.run` for simulations with
+    multiple clocks.
+    
+    The clocks are kept in a binary heap ordered by ``(t, order)`` (using the
+    comparison operator of the clocks, so that the approximate equality test
+    for times is respected), so that finding the next clock to update costs
+    ``O(log n)`` rather than a linear scan over all clocks.
+    
+    **Methods**
+    
+    .. method:: pop_due()
+    
+        Removes and returns the list of all clocks that are due at the
+        earliest time, sorted by their ``order`` attribute.
+        
+    .. method:: push(clocks)
+    
+        Puts the given clocks (typically after they have been ticked) back
+        into the queue.
+    
+    .. method:: next_clock()
+    
+        Returns the next clock to be updated, without removing it.
+    '''
+    def __init__(self, clocks):
+        self.heap = list(clocks)
+        heapify(self.heap)
+
+    def pop_due(self):
+        heap = self.heap
+        clock = heappop(heap)
+        due = [clock]
+        while heap and clock.same_time(heap[0]):
+            due.append(heappop(heap))
+        return due
+
+    def push(self, clocks):
+        heap = self.heap
+        for clock in clocks:
+            heappush(heap, clock)
+
+    def next_clock(self):
+        return self.heap[0]
+
+    def __len__(self):
+        return len(self.heap)
+
+
 # Do not track the default clock    
 class DefaultClock(Clock):
     @staticmethod
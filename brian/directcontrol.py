@@ -47,7 +47,9 @@ from stateupdater import *
 from units import *
 import random as pyrandom
 from numpy import where, array, zeros, ones, inf, nonzero, tile, sum, isscalar,\
-                  cumsum, hstack, bincount,  ceil, ndarray, ascontiguousarray
+                  cumsum, hstack, bincount,  ceil, ndarray, ascontiguousarray,\
+                  asarray, empty, arange, searchsorted, diff, repeat, issubdtype,\
+                  integer, roll, log2
 from copy import copy
 from clock import guess_clock
 from utils.approximatecomparisons import *
@@ -57,6 +59,7 @@ from log import *
 import numpy
 from numpy.random import exponential, randint, binomial
 from connections import Connection
+from synapses.spikequeue import group_offsets
 from itertools import izip
 
 
@@ -82,6 +85,9 @@ class SpikeGeneratorGroup(NeuronGroup):
         ``spiketimes`` where the first column of the array
         is the neuron indices, and the second column is the times in
         seconds. Alternatively you can pass a tuple with two arrays, the first one being the neuron indices and the second one times. WARNING: units are not checked in this case, the time array should be in seconds.
+        Finally, ``spiketimes`` can be a record array with fields ``i`` (neuron
+        indices) and ``t`` (times in seconds), or the name of a ``.npy`` file
+        containing such an array, which is then memory-mapped (see below).
     ``clock``
         An optional clock to update with (omit to use the default clock).
     ``period``
@@ -92,7 +98,12 @@ class SpikeGeneratorGroup(NeuronGroup):
         Set to True if you want to gather spike events that fall in the same
         timestep. (Deprecated since Brian 1.3.1)
     ``sort=True``
-        Set to False if your spike events are already sorted.
+        Set to False if your spike events are already sorted. Arrays of spikes
+        are sorted by time and then by neuron index, unless they are already
+        sorted in this order, in which case they are not copied. With
+        ``sort=False``, arrays are never copied and the spikes of a time step
+        are produced in the given order, but a ``ValueError`` is raised if the
+        times are not sorted.
     
     Has an attribute:
     
@@ -127,6 +138,19 @@ class SpikeGeneratorGroup(NeuronGroup):
     is detected.
 
     Also, if you want to use a SpikeGeneratorGroup with many spikes and/or neurons, please use an initialization with arrays.
+    Before the run, the position of the spikes of every time step in the array
+    of neuron indices is computed, and at every time step the spikes are a
+    slice of that array. With ``sort=False`` (or if the spikes are already
+    sorted by time step and neuron index), the arrays are only read block by
+    block, so that very long spike trains can be replayed from a file that
+    does not fit in memory, for example::
+    
+        spikes = zeros(n, dtype=[('i', int32), ('t', float64)])
+        ... # fill in the spikes, sorted by time
+        numpy.save('spikes.npy', spikes)
+        P = SpikeGeneratorGroup(N, 'spikes.npy', sort=False)
+    
+    With a ``period``, the period is rounded to a whole number of time steps.
     
     Also note that if you pass a generator, then reinitialising the group will not have the
     expected effect because a generator object cannot be reinitialised. Instead, you should
@@ -181,6 +205,15 @@ class SpikeGeneratorGroup(NeuronGroup):
             # spike times is a tuple with idx, times in arrays
             idx = spiketimes[0]
             times = spiketimes[1]
+        elif isinstance(spiketimes, str):
+            # spiketimes is the name of a .npy file with a record array
+            spiketimes = numpy.load(spiketimes, mmap_mode='r')
+            idx = spiketimes['i']
+            times = spiketimes['t']
+        elif isinstance(spiketimes, ndarray) and spiketimes.dtype.names:
+            # spiketimes is a record array with fields i and t
+            idx = spiketimes['i']
+            times = spiketimes['t']
         elif isinstance(spiketimes, ndarray):
             # spiketimes is a ndarray, with first col is index and second time
             idx = spiketimes[:,0]
@@ -191,7 +224,8 @@ class SpikeGeneratorGroup(NeuronGroup):
             fallback = True
 
         if not fallback:
-            thresh = FastSpikeGeneratorThreshold(N, idx, times, dt=clock.dt, period=period)
+            thresh = FastSpikeGeneratorThreshold(N, idx, times, dt=clock.dt, period=period,
+                                                 sort=sort)
         else:
             thresh = SpikeGeneratorThreshold(N, spiketimes, period=period, sort=sort)
         
@@ -216,69 +250,120 @@ class SpikeGeneratorGroup(NeuronGroup):
 
 
 
+def spike_offsets(T, dt, blocksize=2**20):
+    '''
+    Returns the array ``offsets`` such that the spikes of time step ``k``
+    are ``offsets[k]:offsets[k+1]``, where ``T`` is the array of spike times
+    in seconds, sorted, and the time step of a spike is ``ceil(T/dt)``.
+    ``T`` is read in blocks of ``blocksize`` spikes, so that it can be a
+    memory-mapped array that does not fit in memory.
+    '''
+    n = len(T)
+    if n == 0:
+        return array([], dtype=int)
+    offsets = empty(int(ceil(T[n - 1] / dt)) + 2, dtype=int)
+    k = 0 # offsets[:k] are computed
+    for start in xrange(0, n, blocksize):
+        steps = array(ceil(asarray(T[start:start + blocksize]) / dt), dtype=int)
+        if steps[0] < max(k - 1, 0) or (steps[1:] < steps[:-1]).any():
+            raise ValueError('Spike times must be positive and sorted.')
+        # the spikes before step j in the block are the first ones
+        last = steps[-1] + 1
+        offsets[k:last] = start + searchsorted(steps, arange(k, last))
+        k = last
+    offsets[k:] = n
+    return offsets
+
+
+def is_sorted(I, T, dt, blocksize=2**20):
+    '''
+    Returns True if the spikes of neurons ``I`` at times ``T`` are sorted by
+    time step (``ceil(T/dt)``) and then by neuron index (read in blocks of
+    ``blocksize`` spikes).
+    '''
+    for start in xrange(0, len(T), blocksize):
+        steps = diff(ceil(asarray(T[start:start + blocksize + 1]) / dt))
+        indices = diff(asarray(I[start:start + blocksize + 1]))
+        if (steps < 0).any() or ((steps == 0) & (indices < 0)).any():
+            return False
+    return True
+
+
 class FastSpikeGeneratorThreshold(Threshold):
     '''
     A faster version of the SpikeGeneratorThreshold where spikes are processed prior to the run (offline). It replaces the SpikeGeneratorThreshold as of 1.3.1.
+    
+    The spikes are sorted by time and then by neuron index if they are not
+    already sorted (and if ``sort`` is True), and the positions of the spikes
+    of every time step in the array of neuron indices are computed (see
+    :func:`spike_offsets`), so that the spikes of a time step are a slice of
+    that array. With ``sort=False``, the arrays are used as they are: the
+    spikes of a time step are in the given order, and a ``ValueError`` is
+    raised if the times are not sorted.
     '''
     ## Notes:
     #  - N is ignored (should it not?)
-    def __init__(self, N, addr, timestamps, dt = None, period=None):
-        self.set_offsets(addr, timestamps, dt = dt)
+    def __init__(self, N, addr, timestamps, dt = None, period=None, sort=True):
+        self.set_offsets(addr, timestamps, dt = dt, sort = sort)
         self.period = period
         self.dt = dt
+        if period is not None:
+            self.period_steps = int(round(float(period) / float(dt)))
         self.reinit()
         
-    def set_offsets(self, I, T, dt = 1000):
-        # Convert times into integers
-        T = array(ceil(T/dt), dtype=int)
-        # Put them into order
-        # We use a field array to sort first by time and then by neuron index
-        spikes = zeros(len(I), dtype=[('t', int), ('i', int)])
-        spikes['t'] = T
-        spikes['i'] = I
-        spikes.sort(order=('t', 'i'))
-        T = ascontiguousarray(spikes['t'])
-        self.I = ascontiguousarray(spikes['i'])
-        # Now for each timestep, we find the corresponding segment of I with
-        # the spike indices for that timestep.
-        # The idea of offsets is that the segment offsets[t]:offsets[t+1]
-        # should give the spikes with time t, i.e. T[offsets[t]:offsets[t+1]]
-        # should all be equal to t, and so then later we can return
-        # I[offsets[t]:offsets[t+1]] at time t. It might take a bit of thinking
-        # to see why this works. Since T is sorted, and bincount[i] returns the
-        # number of elements of T equal to i, then j=cumsum(bincount(T))[t]
-        # gives the first index in T where T[j]=t.
-        if len(T):
-            self.offsets = hstack((0, cumsum(bincount(T))))
+    def set_offsets(self, I, T, dt = 1000, sort = True):
+        dt = float(dt)
+        if sort and not is_sorted(I, T, dt):
+            # Convert times into integers
+            T = array(ceil(asarray(T) / dt), dtype=int)
+            # Put them into order
+            # We use a field array to sort first by time and then by neuron index
+            spikes = zeros(len(I), dtype=[('t', int), ('i', int)])
+            spikes['t'] = T
+            spikes['i'] = I
+            spikes.sort(order=('t', 'i'))
+            T = ascontiguousarray(spikes['t'])
+            self.I = ascontiguousarray(spikes['i'])
+            # Now for each timestep, we find the corresponding segment of I with
+            # the spike indices for that timestep.
+            # The idea of offsets is that the segment offsets[t]:offsets[t+1]
+            # should give the spikes with time t, i.e. T[offsets[t]:offsets[t+1]]
+            # should all be equal to t, and so then later we can return
+            # I[offsets[t]:offsets[t+1]] at time t. It might take a bit of thinking
+            # to see why this works. Since T is sorted, and bincount[i] returns the
+            # number of elements of T equal to i, then j=cumsum(bincount(T))[t]
+            # gives the first index in T where T[j]=t.
+            if len(T):
+                self.offsets = hstack((0, cumsum(bincount(T))))
+            else:
+                self.offsets = array([], dtype=int)
         else:
-            self.offsets = array([])
+            # The spikes are sorted (by time only if sort is False): the arrays
+            # are not copied (they can be memory-mapped), and the offsets are
+            # computed block by block
+            if isinstance(I, ndarray) and issubdtype(I.dtype, integer):
+                self.I = I
+            else:
+                self.I = asarray(I, dtype=int)
+            self.offsets = spike_offsets(T, dt)
+        self._empty = self.I[:0]
     
     def __call__(self, P):
-        t = P.clock.t
+        t = int(round(P.clock._t / P.clock._dt))
         if self.period is not None:
-            cp = int(t / self.period)
-            if cp > self.curperiod:
-                self.reinit()
-                self.curperiod = cp
-            t = t - cp * self.period
-        dt = P.clock.dt
-        t = int(round(t/dt))
+            t %= self.period_steps
         if t+1>=len(self.offsets):
-            return array([], dtype=int)
+            return self._empty
         return self.I[self.offsets[t]:self.offsets[t+1]]
     
     def reinit(self):
-        self.curperiod = -1
+        pass
         
     @property
     def spiketimes(self):
-        # this is a pain to do! retrieve spike times from offsets
-        res = []
-        for k in range(len(self.offsets)-1):
-            idx = self.I[self.offsets[k]:self.offsets[k+1]]
-            ts = [k*self.dt]*len(idx)
-            res += zip(idx, ts)
-        return res
+        # retrieve spike times from offsets
+        steps = repeat(arange(len(self.offsets)-1), diff(self.offsets))
+        return zip(self.I[:len(steps)], steps*self.dt)
 
     def __repr__(self):
         return '<FastSpikeGeneratorThreshold>'
@@ -498,7 +583,10 @@ class PoissonInput(Connection):
     ``jitter``
         is ``None`` by default. There is the possibility to consider ``copies`` presynaptic
         spikes at each Poisson event, randomly shifted according to an exponential law
-        with parameter ``jitter=taujitter`` (in second).
+        with parameter ``jitter=taujitter`` (in second). The shifted spikes are
+        scheduled in a circular buffer of future time steps when the Poisson
+        event occurs, so that the cost of a time step is proportional to
+        the number of events rather than to ``copies`` times the number of neurons.
     ``reliability`` 
         is ``None`` by default. There is the possibility to consider ``copies`` presynaptic
         spikes at each Poisson event, where each of these spikes is unreliable, i.e. it occurs
@@ -524,8 +612,6 @@ class PoissonInput(Connection):
         self.clock = target.clock
         self.delay = None
         self.iscompressed = True
-        self.delays = None # delay to wait for the j-th synchronous spike to occur after the last sync event, for target neuron i
-        self.lastevent = -inf * ones(self.N) # time of the last event for target neuron i
         self.events = []
         self.recorded_events = []
 
@@ -533,13 +619,10 @@ class PoissonInput(Connection):
         self.rate = rate
         self.w = weight
         self.var = state
-        self._jitter = jitter
-        
-        if jitter is not None:
-            self.delays = zeros((copies, self.N))
+        self.copies = copies
+        self.jitter = jitter
         
         self.reliability = reliability
-        self.copies = copies
         self.record = record
         self.frozen = freeze
         
@@ -556,12 +639,61 @@ class PoissonInput(Connection):
     
     def set_jitter(self, value):
         self._jitter = value
-        if value is not None:
-            self.delays = zeros((self.copies, self.N))
+        self.reinit()
     
     # changed due to the 2.5 issue
     jitter = property(get_jitter, set_jitter)
     
+    def reinit(self):
+        '''
+        Removes the scheduled (jittered) events.
+        '''
+        # Circular buffer of the scheduled events, as in SpikeQueue: row
+        # (currentstep+k)%nsteps holds the target neurons of the events
+        # occurring in k time steps
+        self._X = zeros((1, 1), dtype=int)
+        self._n = zeros(1, dtype=int) # number of events in each time step
+        self._currentstep = 0
+
+    def schedule(self, targets, steps):
+        '''
+        Schedules events for the neurons ``targets`` in ``steps`` time steps
+        (arrays, ``steps=0`` is the current time step).
+        '''
+        nsteps, maxevents = self._X.shape
+        if steps.max() >= nsteps: # the buffer is too short
+            nsteps = int(2**ceil(log2(steps.max()+1)))
+            X = zeros((nsteps, maxevents), dtype=int)
+            # the current time step becomes the first row
+            X[:len(self._n)] = roll(self._X, -self._currentstep, axis=0)
+            self._n = hstack((roll(self._n, -self._currentstep),
+                              zeros(nsteps-len(self._n), dtype=int)))
+            self._X = X
+            self._currentstep = 0
+        rows = (self._currentstep+steps) % nsteps
+        counts = bincount(rows, minlength=nsteps)
+        m = (self._n+counts).max()
+        if m > maxevents: # overflow
+            maxevents = int(2**ceil(log2(m)))
+            X = zeros((nsteps, maxevents), dtype=int)
+            X[:, :self._X.shape[1]] = self._X
+            self._X = X
+        positions = rows*maxevents+self._n[rows]+group_offsets(rows)
+        self._X.reshape(nsteps*maxevents).put(positions, targets)
+        self._n += counts
+
+    def deliver(self, state, w):
+        '''
+        Adds ``w`` to the variable ``state`` of the neurons of the events of
+        the current time step, and advances to the next time step.
+        '''
+        n = self._n[self._currentstep]
+        if n > 0:
+            targets = self._X[self._currentstep, :n]
+            self.target._S[state, :] += w * bincount(targets, minlength=self.N)
+            self._n[self._currentstep] = 0
+        self._currentstep = (self._currentstep+1) % len(self._n)
+
 
     def propagate(self, spikes):
         i = 0
@@ -593,17 +725,17 @@ class PoissonInput(Connection):
             taujitter = jitter
             if (p > 0) & (f > 0):
                 k = binomial(n=n, p=f * self.clock.dt, size=(self.N)) # number of synchronous events here, for every target neuron
-                syncneurons = (k > 0) # neurons with a syncronous event here
-                self.lastevent[syncneurons] = self.clock.t
-                if taujitter == 0.0:
-                    self.delays[:, syncneurons] = zeros((p, sum(syncneurons)))
-                else:
-                    self.delays[:, syncneurons] = exponential(scale=taujitter, size=(p, sum(syncneurons)))
-                # Delayed spikes occur now
-                lastevent = tile(self.lastevent, (p, 1))
-                b = (abs(self.clock.t - (lastevent + self.delays)) <= (self.clock.dt / 2) * ones((p, self.N))) # delayed spikes occurring now
-                weff = sum(b, axis=0) * w
-                self.target._S[state, :] += weff
+                syncneurons = nonzero(k)[0] # neurons with synchronous events here
+                if len(syncneurons):
+                    targets = repeat(syncneurons, p * k[syncneurons]) # p copies of each event
+                    if taujitter == 0.0:
+                        steps = zeros(len(targets), dtype=int)
+                    else:
+                        delays = exponential(scale=float(taujitter), size=len(targets))
+                        steps = array(numpy.rint(delays / self.clock._dt), dtype=int)
+                    self.schedule(targets, steps)
+            # Delayed spikes occurring now
+            self.deliver(state, w)
         elif (reliability is not None):
             p = self.copies
             alpha = reliability
@@ -922,6 +922,34 @@ class Equations(object):
             self._namespace[name2] = self._namespace[name1]
             del self._namespace[name1]
 
+    def vectorize_parameters(self, **values):
+        """
+        Turns external constants into parameters of the model, so that they
+        can take a different value for each neuron, e.g.
+        ``eqs.vectorize_parameters(tau=[5*ms, 10*ms])`` for
+        ``dv/dt=-v/tau : volt``. The keywords give the name of the constants
+        and a value (or sequence of values) from which the unit is taken.
+        Must be called before the equations are prepared. Note that linear
+        equations become nonlinear (the parameters multiply the variables),
+        and are therefore integrated with a nonlinear method, unless they are
+        vectorized by :class:`NeuronGroup` (``vectorize_parameters``
+        keyword), which keeps exact updates.
+        """
+        if self._prepared:
+            raise AttributeError("Parameters must be vectorized before the equations are prepared.")
+        for name, value in values.iteritems():
+            if name in self._units:
+                raise ValueError(name + " is already a variable of the equations.")
+            if isSequenceType(value):
+                value = value[0]
+            self.add_param(name, get_unit(value))
+            # Namespaces can be shared with other Equations objects (see __iadd__)
+            for var, namespace in self._namespace.items():
+                if name in namespace and var != name:
+                    namespace = namespace.copy()
+                    del namespace[name]
+                    self._namespace[var] = namespace
+
     def __getattr__(self, name):
         '''
         Returns the corresponding function.
@@ -1,7 +1,7 @@
 '''
 The Bufferable class serves as a base for all the other Brian.hears classes
 '''
-from numpy import zeros, empty, hstack, vstack, arange, diff
+from numpy import zeros, empty
 
 class Bufferable(object):
     '''
@@ -57,6 +57,16 @@ class Bufferable(object):
         An array of shape ``((cached_buffer_end-cached_buffer_start, nchannels)``
         with the current cached segment of the buffer. Note that this array can
         change size.
+    
+    To avoid allocating a new array for each segment, ``buffer_fetch_next``
+    can write its output into the array returned by
+    ``self.buffer_output(samples)``. When the object is the source of a
+    filterbank (which sets its attribute ``shared_buffer_output`` to ``True``
+    in :meth:`Filterbank.buffer_init`), the arrays returned by this method are
+    taken alternately from two preallocated arrays, so that the segments
+    returned by ``buffer_fetch`` are only valid until two more segments have
+    been computed. Otherwise, it returns a new array, so that the segments
+    fetched by the user can be kept.
     '''
     def buffer_fetch(self, start, end):
         if not hasattr(self, 'cached_buffer_start'):
@@ -115,9 +125,33 @@ class Bufferable(object):
         if not hasattr(self, 'maximum_buffer_size'):
             return self.buffer_fetch_next(samples)
         bufsize = self.maximum_buffer_size
-        endpoints = hstack((arange(0, samples, bufsize), samples))
-        sizes = diff(endpoints)
-        return vstack(tuple(self.buffer_fetch_next(size) for size in sizes))
+        if samples<=bufsize:
+            return self.buffer_fetch_next(samples)
+        # the pieces are copied as soon as they are computed, because they
+        # can be in the arrays of buffer_output
+        output = empty((samples, self.nchannels))
+        for start in xrange(0, samples, bufsize):
+            end = min(start+bufsize, samples)
+            output[start:end, :] = self.buffer_fetch_next(end-start)
+        return output
+    
+    def buffer_output(self, samples):
+        '''
+        Returns an array of shape ``(samples, nchannels)`` to store the output
+        of ``buffer_fetch_next``, preallocated if ``shared_buffer_output`` is
+        set.
+        '''
+        if not getattr(self, 'shared_buffer_output', False):
+            return empty((samples, self.nchannels))
+        if not hasattr(self, 'output_buffers'):
+            self.output_buffers = [None, None]
+            self.output_buffer_index = 0
+        i = self.output_buffer_index = 1-self.output_buffer_index
+        output = self.output_buffers[i]
+        if (output is None or output.shape[0]<samples or
+                output.shape[1]!=self.nchannels):
+            output = self.output_buffers[i] = empty((samples, self.nchannels))
+        return output[:samples]
     
     def buffer_init(self):
         self.cached_buffer_output = zeros((0, self.nchannels))
@@ -6,5 +6,6 @@ from filterbankgroup import *
 from drnl import DRNL
 from dcgc import DCGC
 from fractionaldelay import *
+from resamplefilterbank import *
 #from zilany import ZILANY
 from tan_carney import *
\ No newline at end of file
@@ -70,12 +70,31 @@ class AsymCompUpdate:
          level2 = maximum(maximum(value2,0),self.level2_prev*self.exp_deca_val)
          self.level1_prev=level1
          self.level2_prev=level2
+         fr2 = self.cutoff_frequencies(level1, level2)
+         self.iteration+=1
+         self.target.filt_b, self.target.filt_a=asymmetric_compensation_coeffs(self.samplerate,fr2,self.target.filt_b,self.target.filt_a,self.b,self.c,self.p0,self.p1,self.p2,self.p3,self.p4)
+    def batch(self,ends,*input):
+         # the levels decay from one update to the next, the rest of the
+         # computation is done for all the updates at once
+         value1=maximum(input[0][ends-1,:],0)
+         value2=maximum(input[1][ends-1,:],0)
+         level1=empty(value1.shape)
+         level2=empty(value2.shape)
+         for i in xrange(len(ends)):
+             level1[i] = maximum(value1[i],self.level1_prev*self.exp_deca_val)
+             level2[i] = maximum(value2[i],self.level2_prev*self.exp_deca_val)
+             self.level1_prev=level1[i]
+             self.level2_prev=level2[i]
+         fr2 = self.cutoff_frequencies(level1, level2)
+         self.iteration+=len(ends)
+         filt_b = zeros(fr2.shape+self.target.filt_b.shape[1:])
+         filt_a = zeros(fr2.shape+self.target.filt_a.shape[1:])
+         return asymmetric_compensation_coeffs(self.samplerate,fr2,filt_b,filt_a,self.b,self.c,self.p0,self.p1,self.p2,self.p3,self.p4)
+    def cutoff_frequencies(self,level1,level2):
          level_total=self.lev_weight*self.level_ref*(level1/self.level_ref)**self.level_pwr1+(1-self.lev_weight)*self.level_ref*(level2/self.level_ref)**self.level_pwr2
          level_dB=20*log10(maximum(level_total,self.level_min))+self.RMStoSPL                                       
          frat = self.frat0 + self.frat1*level_dB
-         fr2 = self.fp1*frat
-         self.iteration+=1
-         self.target.filt_b, self.target.filt_a=asymmetric_compensation_coeffs(self.samplerate,fr2,self.target.filt_b,self.target.filt_a,self.b,self.c,self.p0,self.p1,self.p2,self.p3,self.p4)
+         return self.fp1*frat
  
 class DCGC(CombinedFilterbank):
     '''
@@ -138,6 +157,8 @@ class DCGC(CombinedFilterbank):
       param['ERBwidth']= 24.7*(4.37*cf/1000 + 1)
     '''
     
+    channel_arguments = dict(cf=1, param=1)
+
     def __init__(self, source,cf,update_interval=1,param={}):
         
         CombinedFilterbank.__init__(self, source)
@@ -138,6 +138,8 @@ class DRNL(CombinedFilterbank):
       param['lp_nl_cutoff_m']=1.016   
     '''
     
+    channel_arguments = dict(cf=1, param=1)
+
     def __init__(self, source, cf, type='human', param={}):
 
         CombinedFilterbank.__init__(self, source)
@@ -2,7 +2,15 @@ from brian import *
 from scipy import signal, weave, random
 from ..bufferable import Bufferable
 from operator import isSequenceType
-from __builtin__ import all
+from __builtin__ import all, any
+from inspect import getargspec
+from threading import Thread, Event
+from Queue import Queue, Empty, Full
+from multiprocessing import Process
+from multiprocessing import Queue as ProcessQueue
+from multiprocessing.sharedctypes import RawArray
+import sys
+import traceback
 
 __all__ = ['Filterbank',
            'RestructureFilterbank',
@@ -38,6 +46,8 @@ class Filterbank(Bufferable):
     
     .. automethod:: process
     
+    .. automethod:: select_channels
+    
     Alternatively, the buffer interface can be used, which is described in
     more detail below.
     
@@ -56,7 +66,13 @@ class Filterbank(Bufferable):
     that fetches the next input, and calls the ``buffer_apply(input)``
     method on it, which can be overridden by a derived class. This is typically
     the easiest way to implement a new filterbank. Filterbanks with multiple
-    sources will need to override this default implementation.
+    sources will need to override this default implementation. If
+    ``buffer_apply`` has an ``out`` argument, as in
+    ``buffer_apply(input, out)``, it is passed a preallocated array of shape
+    ``(bufsize, nchannels)`` (see :class:`Bufferable`) in which it can write
+    its output, and it should return this array. The input of
+    ``buffer_apply`` can be overwritten when the next inputs are fetched, and
+    should be copied if it needs to be kept.
     
     There is a default ``__init__`` method that can be called by a derived class
     that sets the ``source``, ``nchannels`` and ``samplerate`` from that of the
@@ -87,8 +103,30 @@ class Filterbank(Bufferable):
     and sums over the channels (``axis=1``). It's important to reshape the
     output so that it has shape ``(bufsize, outputnchannels)`` so that it can
     be used as the input to subsequent filterbanks.
+    
+    To be used with :meth:`select_channels` (and ``process(processes=n)``),
+    a class declares in its own body the class attribute
+    ``channel_arguments``, a dictionary whose keys are the names of the
+    initialisation arguments that can have one value per channel, and whose
+    values are the (minimum) number of dimensions of such an argument, e.g.
+    ``channel_arguments = dict(cf=1)`` for an array ``cf`` of one frequency
+    per channel, or ``dict(impulse_response=2)`` for an array of shape
+    ``(nchannels, ir_length)`` (a 1D impulse response is then shared by all
+    channels). For a dictionary of parameters, the number of dimensions
+    applies to each of its values. A class without per-channel arguments
+    declares an empty dictionary. Classes which do not declare it, or whose
+    output channels do not each depend on the same input channel only, cannot
+    be restricted to some of their channels.
     '''
-       
+    channel_arguments = None
+
+    def __new__(cls, *args, **kwds):
+        # the arguments are kept so that select_channels can create the same
+        # filterbank for a subset of the channels
+        obj = Bufferable.__new__(cls)
+        obj._init_arguments = (args, kwds)
+        return obj
+
     def __init__(self, source):
         if isinstance(source, Bufferable):
             self.source = source
@@ -162,7 +200,8 @@ class Filterbank(Bufferable):
         :class:`OnlineSound` as a source).
         ''')
 
-    def process(self, func=None, duration=None, buffersize=32):
+    def process(self, func=None, duration=None, buffersize=32, pipeline=False,
+                processes=1):
         '''
         Returns the output of the filterbank for the given duration.
         
@@ -174,7 +213,8 @@ class Filterbank(Bufferable):
             two arguments, the second argument is the value returned by the
             previous application of the function (or 0 for the first
             application). In this case, the method will return the final
-            value returned by the function. See example below.
+            value returned by the function. See example below. Each segment
+            is a new array, which the function can keep.
         ``duration=None``
             The length of time (in seconds) or number of samples to process.
             If no ``func`` is specified, the method will return an array of shape
@@ -189,6 +229,27 @@ class Filterbank(Bufferable):
             The size of the buffered segments to fetch, as a length of time or
             number of samples. 32 samples typically gives reasonably good
             performance.
+        ``pipeline=False``
+            If True, each stage of the chain of filterbanks (including the
+            stages inside a :class:`CombinedFilterbank`) runs in its own thread,
+            so that a stage works on the next buffer while the following stage
+            works on the current one. The stages are connected by queues of at
+            most two buffers. Only the stages whose output is used by a single
+            filterbank are separated, and a :class:`ControlFilterbank` runs in
+            a single thread with all the filterbanks it depends on, so that the
+            output is exactly the same as without pipelining. Since numpy
+            releases the GIL for operations on large arrays, this can use
+            several cores for models with many channels.
+        ``processes=1``
+            The number of processes to use. If it is larger than one, the
+            channels are split into ``processes`` groups, and each group is
+            computed in a separate process by the filterbank returned by
+            :meth:`select_channels` (an error is raised for the filterbanks
+            which do not declare their per-channel arguments). The
+            processes write their output directly into an array in shared
+            memory. The whole output is
+            computed before ``func`` is called on its buffered segments. This
+            uses ``fork`` and is therefore not available on Windows.
             
         For example, to compute the RMS of each channel in a filterbank, you
         would do::
@@ -203,30 +264,116 @@ class Filterbank(Bufferable):
             duration = int(duration*self.samplerate)
         if not isinstance(buffersize, int):
             buffersize = int(buffersize*self.samplerate)
-        self.buffer_init()
         endpoints = hstack((arange(0, duration, buffersize), duration))
         zendpoints = zip(endpoints[:-1], endpoints[1:])
         #sizes = diff(endpoints)
-        if func is None:
-            return vstack(tuple(self.buffer_fetch(start, end) for start, end in zendpoints))
+        processes = min(processes, self.nchannels)
+        if processes>1:
+            output = process_channels(self, duration, buffersize, pipeline,
+                                      processes)
+            if func is None:
+                return output
+            buffer_fetch = lambda start, end: output[start:end]
+            pipeline = False
         else:
-            if func.func_code.co_argcount==1:
+            # the segments can be taken from the preallocated buffers (see
+            # Bufferable.buffer_output) only if they are copied to the output
+            shared_buffer_output = getattr(self, 'shared_buffer_output', False)
+            self.shared_buffer_output = func is None
+            self.buffer_init()
+            buffer_fetch = self.buffer_fetch
+        if pipeline:
+            pipeline = FilterbankPipeline(self, buffersize)
+            pipeline.start()
+        try:
+            if func is None:
+                output = empty((duration, self.nchannels))
                 for start, end in zendpoints:
-                    func(self.buffer_fetch(start, end))
+                    output[start:end] = buffer_fetch(start, end)
+                return output
             else:
-                runningval = 0
-                for start, end in zendpoints:
-                    runningval = func(self.buffer_fetch(start, end), runningval)
-                return runningval
+                if func.func_code.co_argcount==1:
+                    for start, end in zendpoints:
+                        func(buffer_fetch(start, end))
+                else:
+                    runningval = 0
+                    for start, end in zendpoints:
+                        runningval = func(buffer_fetch(start, end), runningval)
+                    return runningval
+        finally:
+            if pipeline:
+                pipeline.stop()
+            if processes<=1:
+                self.shared_buffer_output = shared_buffer_output
+
+    def select_channels(self, indices):
+        '''
+        Returns a new filterbank of the same class for the given channels only
+        
+        The filterbank is created again with the arguments it was initialised
+        with, where the arguments declared in the ``channel_arguments``
+        attribute of its class (see :class:`Filterbank`) that have one value
+        per channel, e.g. the ``cf`` array of a cochlear model or the
+        coefficients ``b`` and ``a`` of a :class:`LinearFilterbank`, are
+        replaced by their values for the given ``indices``. This includes the
+        arrays in dictionaries of parameters (``param``). Other arguments are
+        passed unchanged. A :class:`ValueError` is raised if the class does
+        not declare its per-channel arguments.
+        
+        A source filterbank with the same number of channels is itself
+        restricted with ``select_channels``, so that the whole chain only
+        computes the selected channels. Other sources with the same number of
+        channels, or filterbanks that cannot be selected, are restricted with a
+        :class:`RestructureFilterbank`, and a mono source is kept.
+        
+        This assumes that the channels are independent and that their
+        parameters are given to the initialiser, as is the case for the
+        cochlear models (e.g. :class:`DRNL`, :class:`DCGC`,
+        :class:`TanCarney`). A :class:`ValueError` is raised if the new
+        filterbank does not have ``len(indices)`` channels.
+        '''
+        return self._select_channels(asarray(indices, dtype=int), {})
+
+    def _select_channels(self, indices, selected):
+        # selected maps the id of the sources already restricted to
+        # (source, restricted source), so that shared sources stay shared
+        # the declaration is not inherited, a subclass can have other
+        # arguments
+        channel_arguments = self.__class__.__dict__.get('channel_arguments')
+        if channel_arguments is None:
+            raise ValueError('Cannot select channels of '+
+                             self.__class__.__name__+', it does not declare '
+                             'its per-channel arguments (channel_arguments)')
+        args, kwds = self._init_arguments
+        n = self.nchannels
+        names = getargspec(self.__init__)[0][1:]
+        names = names+[None]*(len(args)-len(names))
+        args = [select_channel_values(arg, indices, n,
+                                      channel_arguments.get(name), selected)
+                for name, arg in zip(names, args)]
+        kwds = dict((k, select_channel_values(v, indices, n,
+                                              channel_arguments.get(k),
+                                              selected))
+                    for k, v in kwds.iteritems())
+        fb = self.__class__(*args, **kwds)
+        if fb.nchannels!=len(indices):
+            raise ValueError('Cannot select channels of '+self.__class__.__name__+
+                             ', the channel parameters were not found in the '
+                             'initialisation arguments.')
+        return fb
 
     def buffer_init(self):
         Bufferable.buffer_init(self)
         if isinstance(self.source, Bufferable):
-            self.source.buffer_init()
+            sources = [self.source]
         else:
-            for s in self.source:
-                s.buffer_init()
+            sources = self.source
+        for s in sources:
+            # their output is only used by filterbanks (see buffer_output)
+            s.shared_buffer_output = True
+            s.buffer_init()
         self.next_sample = 0
+        self.buffer_apply_out = 'out' in getargspec(self.buffer_apply)[0]
 
     def buffer_apply(self, input):
         raise NotImplementedError
@@ -236,6 +383,8 @@ class Filterbank(Bufferable):
         self.next_sample += samples
         end = start+samples
         input = self.source.buffer_fetch(start, end)
+        if getattr(self, 'buffer_apply_out', False):
+            return self.buffer_apply(input, out=self.buffer_output(samples))
         return self.buffer_apply(input)
     
     def __add__ (self, other):
@@ -358,6 +507,9 @@ class RestructureFilterbank(Filterbank):
         swap the left and right of each source, but leave the order of the
         sources the same, i.e. the output would be ``BADC``.        
     '''
+    # the output channels can depend on any input channel
+    channel_arguments = None
+
     def __init__(self, source, numrepeat=1, type='serial', numtile=1,
                  indexmapping=None):
         self._has_been_optimised = False
@@ -432,10 +584,16 @@ class RestructureFilterbank(Filterbank):
         start = self.next_sample
         self.next_sample += samples
         end = start+samples
-        inputs = tuple(s.buffer_fetch(start, end) for s in self.source)
-        input = hstack(inputs)
-        input = input[:, self.indexmapping]
-        return input
+        if len(self.source)==1:
+            input = self.source[0].buffer_fetch(start, end)
+        else:
+            inputs = tuple(s.buffer_fetch(start, end) for s in self.source)
+            input = hstack(inputs)
+        # the indices are valid, so that mode='clip' does not change them but
+        # avoids an intermediate copy
+        output = self.buffer_output(samples)
+        input.take(self.indexmapping, axis=1, out=output, mode='clip')
+        return output
 
     def change_source(self, source):
         if not hasattr(self, '_source') or self._source is None:
@@ -523,6 +681,9 @@ class FunctionFilterbank(Filterbank):
     the number of channels), set the ``nchannels`` keyword argument to the
     number of output channels.
     '''
+    # the keyword arguments are passed to func
+    channel_arguments = {}
+
     def __init__(self, source, func, nchannels=None,**params):
         if isinstance(source, Bufferable):
             source = (source,)
@@ -552,6 +713,9 @@ class SumFilterbank(FunctionFilterbank):
     
         SumFilterbank((fb1, fb2), (1, -1))
     '''
+    # the weights are those of the sources
+    channel_arguments = {}
+
     def __init__(self, source, weights=None):
         if weights is None:
             weights = ones(len(source))
@@ -579,6 +743,8 @@ class DoNothingFilterbank(Filterbank):
     However, a more general way of writing compound filterbanks is to use
     :class:`CombinedFilterbank`.
     '''
+    channel_arguments = {}
+
     def buffer_apply(self, input):
         return input
 
@@ -646,6 +812,23 @@ class ControlFilterbank(Filterbank):
     the ``buffer_init()`` method is called on the filterbank, although this is
     entirely optional.
     
+    **Batched updates**
+    
+    Calling the updater every few samples is slow, because the filterbanks
+    then process very small buffers. If the updater sets the coefficients of
+    a :class:`LinearFilterbank` which is the ``source`` and the only target,
+    and whose output is not used by the inputs (there is no feedback), the
+    updates of a whole buffer can be computed at once. The updater should
+    then define a method ``batch(ends, *inputs)``, where each ``input`` has
+    the values of an input for the whole buffer and ``ends`` is the array of
+    the ends of the update intervals in the buffer (the updater would be
+    called with ``input[ends[j-1]:ends[j]]`` for each ``j`` otherwise). It
+    should return the arrays ``filt_b`` and ``filt_a`` that the target would
+    have after each of these updates, with shape
+    ``(len(ends), nchannels, m, p)``. The target then filters the buffer with
+    the coefficients changing at the ends of the update intervals, with the
+    same result as the updates at every interval.
+    
     **Example**
     
     The following will do a simple form of gain control, where the gain
@@ -686,6 +869,9 @@ class ControlFilterbank(Filterbank):
         updater = GainController(gain_fb, 0.2, 50*ms)
         control = ControlFilterbank(gain_fb, source, gain_fb, updater, 10*ms)            
     '''
+    # the updater changes the targets, which cannot be created again
+    channel_arguments = None
+
     def __init__(self, source, inputs, targets, updater, max_interval=None):
         Filterbank.__init__(self, source)
         if not isinstance(inputs, (list, tuple)):
@@ -693,16 +879,49 @@ class ControlFilterbank(Filterbank):
         if not isinstance(targets, (list, tuple)):
             targets = [targets]
         self.inputs = inputs
+        self.targets = targets
         self.updater = updater
         if max_interval is not None:
             if not isinstance(max_interval, int):
                 max_interval = int(max_interval*source.samplerate)
+        self.update_interval = max_interval
+        self.batched = self.can_batch()
+        if max_interval is not None and not self.batched:
             for x in inputs+targets:
                 x.maximum_buffer_size = max_interval
             self.maximum_buffer_size = max_interval
+
+    def can_batch(self):
+        '''
+        Returns True if the updates can be computed for whole buffers (see
+        "Batched updates" above).
+        '''
+        if not hasattr(self.updater, 'batch'):
+            return False
+        if len(self.targets)!=1 or self.targets[0] is not self.source:
+            return False
+        if not hasattr(self.source, 'time_varying_coefficients'):
+            return False
+        # check that the inputs do not depend on the target
+        upstream = list(self.inputs)
+        found = set()
+        while upstream:
+            fb = upstream.pop()
+            if fb is self.source:
+                return False
+            if id(fb) not in found:
+                found.add(id(fb))
+                upstream.extend(x for slot, x in pipeline_inputs(fb))
+        return True
             
     def buffer_init(self):
         Filterbank.buffer_init(self)
+        # the inputs are not sources of the filterbank, they would otherwise
+        # only be initialised when they are first fetched, resetting the
+        # filterbanks they share with the source
+        for x in self.inputs:
+            x.shared_buffer_output = True
+            x.buffer_init()
         if hasattr(self.updater, 'reinit'):
             self.updater.reinit()
     
@@ -710,11 +929,35 @@ class ControlFilterbank(Filterbank):
         start = self.next_sample
         self.next_sample += samples
         end = start+samples
+        if self.batched:
+            return self.batch_fetch(start, end)
         source_input = self.source.buffer_fetch(start, end)
         input_buffers = [x.buffer_fetch(start, end) for x in self.inputs]
         self.updater(*input_buffers)
         return source_input
 
+    def batch_fetch(self, start, end):
+        samples = end-start
+        interval = self.update_interval or samples
+        ends = minimum(arange(interval, samples+interval, interval), samples)
+        # the input of the target is computed first, so that the filterbanks
+        # it shares with the inputs keep the whole buffer when the inputs
+        # fetch it in update intervals
+        target = self.source
+        target.source.buffer_fetch(start, end)
+        input_buffers = [x.buffer_fetch(start, end) for x in self.inputs]
+        filt_b, filt_a = self.updater.batch(ends, *input_buffers)
+        # the coefficients of an update interval are the ones set at the end
+        # of the previous one
+        b = concatenate((target.filt_b[newaxis], filt_b[:-1]))
+        a = concatenate((target.filt_a[newaxis], filt_a[:-1]))
+        target.time_varying_coefficients = (ends, b, a)
+        source_input = target.buffer_fetch(start, end)
+        target.time_varying_coefficients = None
+        target.filt_b = array(filt_b[-1], order='F')
+        target.filt_a = array(filt_a[-1], order='F')
+        return source_input
+
 
 class CombinedFilterbank(Filterbank):
     '''
@@ -783,7 +1026,309 @@ class CombinedFilterbank(Filterbank):
                     
     def buffer_init(self):
         Filterbank.buffer_init(self)
+        # the output is fetched by the users of this filterbank
+        self.output.shared_buffer_output = getattr(self, 'shared_buffer_output', False)
         self.output.buffer_init()
             
     def buffer_fetch(self, start, end):
         return self.output.buffer_fetch(start, end)
+
+
+class PipelineBuffer(Bufferable):
+    '''
+    Output of a filterbank computed in a separate thread
+    
+    Takes the place of the source ``stage`` of a filterbank when it is
+    processed with a :class:`FilterbankPipeline`. A thread fetches consecutive
+    segments of ``buffersize`` samples from ``stage`` and puts them in a queue
+    of at most ``queuesize`` segments, from which the
+    ``buffer_fetch_next(samples)`` method takes its samples.
+    '''
+    def __init__(self, stage, buffersize, queuesize=2):
+        self.stage = stage
+        self.nchannels = stage.nchannels
+        self.samplerate = stage.samplerate
+        try:
+            self.duration = stage.duration
+        except KeyError:
+            pass
+        self.buffersize = buffersize
+        self.queue = Queue(queuesize)
+        self.stopped = Event()
+        self.thread = Thread(target=self.run)
+        self.thread.daemon = True
+        self.buffer_init()
+
+    def buffer_init(self):
+        Bufferable.buffer_init(self)
+        self.pending = []
+        self.pending_samples = 0
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        # free the thread if it is waiting to put a segment in the queue
+        while not self.queue.empty():
+            self.queue.get()
+        if self.thread.ident is not None:
+            self.thread.join()
+
+    def put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except Full:
+                pass
+
+    def run(self):
+        start = 0
+        try:
+            while not self.stopped.is_set():
+                end = start+self.buffersize
+                # the stage can reuse its output array for the next segment
+                self.put((array(self.stage.buffer_fetch(start, end)), None))
+                start = end
+        except Exception:
+            self.put((None, sys.exc_info()))
+
+    def get(self):
+        while True:
+            try:
+                return self.queue.get(timeout=0.1)
+            except Empty:
+                # the pipeline has been stopped while a downstream stage was
+                # still computing
+                if self.stopped.is_set():
+                    raise RuntimeError('The filterbank pipeline was stopped.')
+
+    def buffer_fetch_next(self, samples):
+        while self.pending_samples<samples:
+            output, exc_info = self.get()
+            if exc_info is not None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            self.pending.append(output)
+            self.pending_samples += output.shape[0]
+        if len(self.pending)==1:
+            output = self.pending[0]
+        else:
+            output = vstack(self.pending)
+        self.pending = [output[samples:]]
+        self.pending_samples -= samples
+        return output[:samples]
+
+
+class FilterbankPipeline(object):
+    '''
+    Runs the stages of a chain of filterbanks in separate threads
+    
+    Used by ``Filterbank.process(pipeline=True)``. The filterbanks that
+    ``filterbank`` depends on are found by following the ``source`` (or
+    ``output`` for a :class:`CombinedFilterbank`) attributes. Each filterbank
+    whose output is used by a single other filterbank is replaced, in that
+    filterbank, by a :class:`PipelineBuffer`. A :class:`ControlFilterbank`
+    and the filterbanks it depends on are never separated, because the
+    updater has to modify its targets before they compute the next segment.
+    
+    The filterbanks should have been initialised with ``buffer_init()``, and
+    are restored when :meth:`stop` is called.
+    '''
+    def __init__(self, filterbank, buffersize, queuesize=2):
+        self.filterbank = filterbank
+        edges = []
+        consumers = {}
+        controls = []
+        def visit(fb):
+            if isinstance(fb, ControlFilterbank):
+                controls.append(fb)
+            for slot, upstream in pipeline_inputs(fb):
+                edges.append((fb, slot, upstream))
+                if id(upstream) not in consumers:
+                    consumers[id(upstream)] = []
+                    visit(upstream)
+                consumers[id(upstream)].append(id(fb))
+        visit(filterbank)
+        def ancestors(fb, found=None):
+            if found is None:
+                found = set()
+            if id(fb) not in found:
+                found.add(id(fb))
+                for slot, upstream in pipeline_inputs(fb):
+                    ancestors(upstream, found)
+            return found
+        # the filterbanks that a ControlFilterbank depends on or modifies
+        frozen = set()
+        for control in controls:
+            for slot, upstream in pipeline_inputs(control):
+                ancestors(upstream, frozen)
+            for target in getattr(control, 'targets', []):
+                ancestors(target, frozen)
+        self.buffers = []
+        self.cuts = []
+        for fb, slot, upstream in edges:
+            if (not isinstance(upstream, Filterbank) or
+                    isinstance(upstream, DoNothingFilterbank) or
+                    isinstance(fb, ControlFilterbank) or
+                    id(fb) in frozen or id(upstream) in frozen or
+                    consumers[id(upstream)]!=[id(fb)]):
+                continue
+            # upstream and the filterbanks it depends on will run in their own
+            # thread, so that none of them should be used by other filterbanks
+            inside = ancestors(upstream)
+            if all(c in inside for v in inside if v!=id(upstream)
+                                for c in consumers[v]):
+                buf = PipelineBuffer(upstream, buffersize, queuesize)
+                self.buffers.append(buf)
+                if slot=='output':
+                    self.cuts.append((fb, 'output', fb.output))
+                else:
+                    self.cuts.append((fb, '_source', fb._source))
+                set_pipeline_input(fb, slot, buf)
+
+    def start(self):
+        for buf in self.buffers:
+            buf.start()
+
+    def stop(self):
+        for buf in self.buffers:
+            buf.stopped.set()
+        for buf in self.buffers:
+            buf.stop()
+        for fb, name, value in reversed(self.cuts):
+            setattr(fb, name, value)
+
+
+def pipeline_inputs(fb):
+    '''
+    Returns a list of pairs ``(slot, upstream)`` of the filterbanks or sounds
+    that ``fb`` fetches its input from, where ``slot`` is ``'output'`` for
+    the output of a :class:`CombinedFilterbank`, ``'source'`` for a single
+    source or the index of the source in a tuple of sources.
+    '''
+    if isinstance(fb, CombinedFilterbank):
+        return [('output', fb.output)]
+    if not isinstance(fb, Filterbank):
+        return []
+    inputs = []
+    if isinstance(fb.source, Bufferable):
+        inputs.append(('source', fb.source))
+    else:
+        inputs.extend(enumerate(fb.source))
+    if isinstance(fb, ControlFilterbank):
+        inputs.extend(('input', x) for x in fb.inputs)
+    return inputs
+
+
+def set_pipeline_input(fb, slot, upstream):
+    if slot=='output':
+        fb.output = upstream
+    elif slot=='source':
+        fb._source = upstream
+    else:
+        source = list(fb._source)
+        source[slot] = upstream
+        fb._source = tuple(source)
+
+
+def select_channel_values(value, indices, nchannels, ndim, selected):
+    '''
+    Returns the values of ``value`` for the channels ``indices`` if it is a
+    source or if it is a per-channel argument (with ``ndim`` dimensions, or
+    ``None`` for other arguments) with one value per channel (see
+    ``Filterbank.select_channels``).
+    '''
+    if isinstance(value, Bufferable):
+        return select_source_channels(value, indices, nchannels, selected)
+    if (isinstance(value, (tuple, list)) and len(value) and
+            all(isinstance(v, Bufferable) for v in value)):
+        return value.__class__(select_source_channels(v, indices, nchannels,
+                                                      selected)
+                               for v in value)
+    if ndim is None:
+        return value
+    if isinstance(value, dict):
+        return dict((k, select_channel_values(v, indices, nchannels, ndim,
+                                              selected))
+                    for k, v in value.iteritems())
+    if (not isinstance(value, (ndarray, list, tuple)) or
+            asarray(value).ndim<ndim or len(value)!=nchannels):
+        return value
+    if isinstance(value, ndarray):
+        return value[indices]
+    return [value[i] for i in indices]
+
+
+def select_source_channels(source, indices, nchannels, selected):
+    '''
+    Returns the source ``source`` restricted to the channels ``indices`` if it
+    has ``nchannels`` channels (see ``Filterbank.select_channels``).
+    '''
+    if source.nchannels!=nchannels or nchannels<=1:
+        return source
+    if id(source) in selected:
+        return selected[id(source)][1]
+    fb = None
+    if isinstance(source, Filterbank):
+        try:
+            fb = source._select_channels(indices, selected)
+        except (ValueError, TypeError, IndexError):
+            pass
+    if fb is None:
+        fb = RestructureFilterbank(source, indexmapping=indices)
+    selected[id(source)] = (source, fb)
+    return fb
+
+
+def process_channel_group(fb, indices, duration, buffersize, pipeline, output,
+                          errors):
+    # puts None in the errors queue if the channels were computed, and the
+    # traceback otherwise
+    try:
+        output = frombuffer(output).reshape((duration, fb.nchannels))
+        fb = fb.select_channels(indices)
+        output[:, indices] = fb.process(duration=duration,
+                                        buffersize=buffersize,
+                                        pipeline=pipeline)
+    except Exception:
+        errors.put(traceback.format_exc())
+    else:
+        errors.put(None)
+
+
+def process_channels(fb, duration, buffersize, pipeline, processes):
+    '''
+    Computes the output of ``fb`` with its channels split across
+    ``processes`` processes (see ``Filterbank.process``).
+    '''
+    shared_output = RawArray('d', duration*fb.nchannels)
+    errors = ProcessQueue()
+    workers = [Process(target=process_channel_group,
+                       args=(fb, indices, duration, buffersize, pipeline,
+                             shared_output, errors))
+               for indices in array_split(arange(fb.nchannels), processes)]
+    for worker in workers:
+        worker.start()
+    # the queue is read before the processes are joined, since a process
+    # does not exit before the data it put in the queue is read
+    messages = []
+    while len(messages)<len(workers):
+        try:
+            messages.append(errors.get(timeout=0.1))
+        except Empty:
+            if not any(worker.is_alive() for worker in workers):
+                break
+    for worker in workers:
+        worker.join()
+    while not errors.empty():
+        messages.append(errors.get())
+    for message in messages:
+        if message is not None:
+            raise RuntimeError('Error while processing channels in a separate '
+                               'process:\n'+message)
+    for worker in workers:
+        if worker.exitcode!=0:
+            raise RuntimeError('A process computing channels of the '
+                               'filterbank exited with code %d'%worker.exitcode)
+    return frombuffer(shared_output).reshape((duration, fb.nchannels))
@@ -66,6 +66,8 @@ class Gammatone(LinearFilterbank):
         induce numerical stability issues.
     '''
 
+    channel_arguments = dict(cf=1, b=1, erb_order=1, ear_Q=1, min_bw=1)
+
     def __init__(self, source, cf, b=1.019, erb_order=1, ear_Q=9.26449,
                  min_bw=24.7, cascade=None):
         cf = atleast_1d(cf)
@@ -159,6 +161,8 @@ class ApproximateGammatone(LinearFilterbank):
         the order the resulting gammatone filters.
      '''
    
+    channel_arguments = dict(cf=1, bandwidth=1)
+
     def __init__(self, source, cf,  bandwidth,order=4):
         cf = atleast_1d(cf)
         bandwidth = atleast_1d(bandwidth)
@@ -227,6 +231,8 @@ class LogGammachirp(LinearFilterbank):
         The default value comes from Unoki et al. 2001. 
     '''
       
+    channel_arguments = dict(f=1, b=1, c=1)
+
     def __init__(self, source, f,b=1.019,c=1,ncascades=4):
         f = atleast_1d(f)
         self.f = f
@@ -310,6 +316,8 @@ class LinearGammachirp(FIRFilterbank):
         Array of shape ``(nchannels, length_impulse_response)`` with each row
         being an impulse response for the corresponding channel.
     '''
+    channel_arguments = dict(f=1, time_constant=1, c=1, phase=1)
+
     def __init__(self,source, f, time_constant, c, phase=0): 
         
         self.f=f=atleast_1d(f)
@@ -396,6 +404,8 @@ class LinearGaborchirp(FIRFilterbank):
         Array of shape ``(nchannels, length_impulse_response)`` with each row
         being an impulse response for the corresponding channel.
     '''
+    channel_arguments = dict(f=1, time_constant=1, c=1, phase=1)
+
     def __init__(self,source, f, time_constant, c, phase=0): 
         self.f=f=atleast_1d(f)
         self.c=c=atleast_1d(c)
@@ -686,6 +696,8 @@ class LowPass(LinearFilterbank):
         Value, list or array (with length = number of channels) of cutoff
         frequencies.
     '''
+    channel_arguments = dict(fc=1)
+
     def __init__(self,source,fc):
         if not isSequenceType(fc):
             fc = fc*ones(source.nchannels)
@@ -719,6 +731,8 @@ class Cascade(LinearFilterbank):
         Number of cascades
     '''
     
+    channel_arguments = {}
+
     def __init__(self,source, filterbank,n):
         b=filterbank.filt_b
         a=filterbank.filt_a
@@ -765,6 +779,8 @@ class AsymmetricCompensation(LinearFilterbank):
         The number of time the basic filter is put in cascade.
      '''
      
+    channel_arguments = dict(f=1, b=1, c=1)
+
     def __init__(self, source, f,b=1.019, c=1,ncascades=4):
         
         f = atleast_1d(f)
@@ -811,6 +827,10 @@ def asymmetric_compensation_coeffs(samplerate,fr,filt_b,filt_a,b,c,p0,p1,p2,p3,p
     '''
     This function is used to generated the coefficient of the asymmetric
     compensation filter used for the gammachirp implementation.
+    
+    The cut off frequencies ``fr`` can also be an array of shape
+    ``(q, nchannels)``, for ``q`` sets of coefficients at once, in which
+    case ``filt_b`` and ``filt_a`` should have shape ``(q, nchannels, 3, 4)``.
     '''
     ERBw=24.7*(4.37e-3*fr+1.)
     nbr_cascade=4
@@ -823,17 +843,18 @@ def asymmetric_compensation_coeffs(samplerate,fr,filt_b,filt_a,b,c,p0,p1,p2,p3,p
         phi=2*pi*maximum((fr+Dfr), 0)/samplerate
         psy=2*pi*maximum((fr-Dfr), 0)/samplerate
 
-        ap=vstack((ones(r.shape),-2*r*cos(phi), r**2)).T
-        bz=vstack((ones(r.shape),-2*r*cos(psy), r**2)).T
+        # the three coefficients are on the last axis
+        ap=rollaxis(array((ones(r.shape),-2*r*cos(phi), r**2)), 0, r.ndim+1)
+        bz=rollaxis(array((ones(r.shape),-2*r*cos(psy), r**2)), 0, r.ndim+1)
 
         vwr=exp(1j*2*pi*fr/samplerate)
-        vwrs=vstack((ones(vwr.shape), vwr, vwr**2)).T
+        vwrs=rollaxis(array((ones(vwr.shape), vwr, vwr**2)), 0, vwr.ndim+1)
 
         ##normilization stuff
-        nrm=abs(sum(vwrs*ap, 1)/sum(vwrs*bz, 1))
-        bz=bz*tile(nrm,[3,1]).T
-        filt_b[:, :, k]=bz
-        filt_a[:, :, k]=ap
+        nrm=abs(sum(vwrs*ap, -1)/sum(vwrs*bz, -1))
+        bz=bz*nrm[..., newaxis]
+        filt_b[..., k]=bz
+        filt_a[..., k]=ap
 
     return filt_b,filt_a
 
@@ -1,17 +1,22 @@
 '''
 FIR filterbank, can be treated as a special case of LinearFilterbank, but an
 optimisation is possible using buffered output by using FFT based convolution
-as in HRTF.apply. To do this is slightly tricky because it needs to cache
-previous inputs. For the moment, we implement it as a special case of
-LinearFilterbank but later this will change to using the FFT method.
+as in HRTF.apply. The FFT based version (FFTFIRFilterbank, the default) uses
+uniformly partitioned overlap-save convolution.
 '''
 from brian import *
 from filterbank import *
 from linearfilterbank import *
+from numpy.fft import rfft, irfft
+from collections import OrderedDict
+import hashlib
 
 __all__ = ['FIRFilterbank', 'LinearFIRFilterbank', 'FFTFIRFilterbank']
 
 class LinearFIRFilterbank(LinearFilterbank):
+    # a 1D impulse response is shared by all the channels
+    channel_arguments = dict(impulse_response=2)
+
     def __init__(self, source, impulse_response, minimum_buffer_size=None):
         # if a 1D impulse response is given we apply it to every channel
         # Note that because we are using LinearFilterbank at the moment, this
@@ -35,15 +40,40 @@ class LinearFIRFilterbank(LinearFilterbank):
             self.minimum_buffer_size = minimum_buffer_size
 
 class FFTFIRFilterbank(Filterbank):
-    def __init__(self, source, impulse_response, minimum_buffer_size=None):
-        # if a 1D impulse response is given we apply it to every channel
-        # Note that because we are using LinearFilterbank at the moment, this
-        # means duplicating the impulse response. However, it could be stored
-        # just once when we move to using FFT based convolution and in fact this
-        # will save a lot of computation as the FFT only needs to be computed
-        # once then.
+    '''
+    FIR filterbank using uniformly partitioned overlap-save convolution
+    
+    The impulse responses are split into partitions of ``partition_size``
+    samples, whose spectra (real FFTs of size ``2*partition_size``) are
+    computed once and shared between filterbanks with the same impulse
+    responses (see :func:`partition_spectra`). For each block of
+    ``partition_size`` input samples, the spectrum of the last two blocks is
+    computed for all channels in a single FFT and stored in a frequency
+    domain delay line, and the output is the inverse FFT of the sum of the
+    products of the delayed input spectra with the partition spectra.
+    
+    Output is produced for every buffer without additional latency, even if
+    the buffer is shorter than a partition: the current (incomplete) block is
+    then zero padded, and the contribution of the previous blocks is only
+    computed once per block. By default, ``partition_size`` is the power of 2
+    (at least 32) which minimises the estimated cost per sample for the size
+    of the first buffer and the length of the impulse responses (see
+    :func:`default_partition_size`): larger partitions mean fewer products
+    with the partition spectra, but longer FFTs, which are computed for every
+    buffer if the buffers are shorter than a partition.
+    '''
+    # a 1D impulse response is shared by all the channels
+    channel_arguments = dict(impulse_response=2)
+
+    def __init__(self, source, impulse_response, minimum_buffer_size=None,
+                 partition_size=None):
+        # if a 1D impulse response is given we apply it to every channel, its
+        # partition spectra are only computed once
         if len(impulse_response.shape)==1:
-            impulse_response = repeat(reshape(impulse_response, (1, len(impulse_response))), source.nchannels, axis=0)
+            self._impulse_response = reshape(impulse_response, (1, len(impulse_response)))
+            impulse_response = repeat(self._impulse_response, source.nchannels, axis=0)
+        else:
+            self._impulse_response = impulse_response
         # Automatically duplicate mono input to fit the desired output shape
         if impulse_response.shape[0]!=source.nchannels:
             if source.nchannels!=1:
@@ -51,88 +81,132 @@ class FFTFIRFilterbank(Filterbank):
             source = RestructureFilterbank(source, impulse_response.shape[0])
         Filterbank.__init__(self, source)
 
-        self.input_cache = zeros((impulse_response.shape[1], self.nchannels))
         self.impulse_response = impulse_response
-        self.fftcache_nmax = -1
-        if minimum_buffer_size is None:
-            minimum_buffer_size = 3*impulse_response.shape[1]
-        self.minimum_buffer_size = minimum_buffer_size
+        self.partition_size = partition_size
+        if minimum_buffer_size is not None:
+            self.minimum_buffer_size = minimum_buffer_size
 
     def buffer_init(self):
         Filterbank.buffer_init(self)
-        self.input_cache[:] = 0
-
-    # This version uses a single FFT/IFFT call, using the axis keyword, but it
-    # doesn't appear to be any more efficient than looping, and uses much more
-    # memory, although my tests weren't exhaustive.
-#    def buffer_apply(self, input):
-#        nmax = max(self.input_cache.shape[0]+input.shape[0], self.impulse_response.shape[1])
-#        nmax = 2**int(ceil(log2(nmax)))
-#        if self.fftcache_nmax!=nmax:
-#            # impulse response: (nchannels, ir_length)
-#            ir = zeros((self.nchannels, nmax))
-#            ir[:, :self.impulse_response.shape[1]] = self.impulse_response
-#            # fftcache: (ir_length, nchannels)
-#            self.fftcache = fft(ir, n=nmax, axis=1).T
-#            self.fftcache_nmax = nmax
-#        fullinput = vstack((self.input_cache, input))
-#        fullinput = vstack((fullinput, zeros((nmax-fullinput.shape[1], self.nchannels))))
-#        # fullinput: (ir_length, nchannels)
-#        fullinput_fft = fft(fullinput, n=nmax, axis=0)
-#        fulloutput_fft = fullinput_fft*self.fftcache
-#        fulloutput = ifft(fulloutput_fft, n=nmax, axis=0).real
-#        output = fulloutput[self.input_cache.shape[0]:self.input_cache.shape[0]+input.shape[0]]
-#        # update input cache
-#        nic = self.input_cache.shape[0]
-#        ni = input.shape[0]
-#        #print ni, nic
-#        if ni>=nic:
-#            self.input_cache[:, :] = input[-nic:, :]
-#        else:
-#            self.input_cache[:-ni, :] = self.input_cache[ni:, :]
-#            self.input_cache[-ni:, :] = input
-#        return output
-    
-    def buffer_apply(self, input):
-        output = zeros_like(input)
-        nmax = max(self.input_cache.shape[0]+input.shape[0], self.impulse_response.shape[1])
-        nmax = 2**int(ceil(log2(nmax)))
-        if self.fftcache_nmax!=nmax:
-            self.fftcache = []
-        for i, (previnput, curinput, ir) in enumerate(zip(self.input_cache.T,
-                                                          input.T,
-                                                          self.impulse_response)):
-            fullinput = hstack((previnput, curinput))
-            # pad
-            fullinput = hstack((fullinput, zeros(nmax-len(fullinput))))
-            # apply fft
-            if self.fftcache_nmax!=nmax:
-                # recompute IR fft, first pad, then take fft, then store
-                ir = hstack((ir, zeros(nmax-len(ir))))
-                ir_fft = fft(ir, n=nmax)
-                self.fftcache.append(ir_fft)
-            else:
-                ir_fft = self.fftcache[i]
-            fullinput_fft = fft(fullinput, n=nmax)
-            curoutput_fft = fullinput_fft*ir_fft
-            curoutput = ifft(curoutput_fft)
-            # unpad
-            curoutput = curoutput[len(previnput):len(previnput)+len(curinput)]
-            output[:, i] = curoutput.real
-        if self.fftcache_nmax!=nmax:
-            self.fftcache_nmax = nmax
-        # update input cache
-        nic = self.input_cache.shape[0]
-        ni = input.shape[0]
-        #print ni, nic
-        if ni>=nic:
-            self.input_cache[:, :] = input[-nic:, :]
+        self.partition_spectra = None
+
+    def partition_init(self, partition_size):
+        '''
+        Initialises the partition spectra and the delay line of input spectra.
+        '''
+        L = self.partition_size = partition_size
+        H = partition_spectra(self._impulse_response, L)
+        if H.shape[2]!=self.nchannels:
+            H = repeat(H, self.nchannels, axis=2)
+        self.partition_spectra = H
+        K = H.shape[0]
+        # last two blocks of input, the current one being filled
+        self.input_window = zeros((2*L, self.nchannels))
+        self.input_fill = 0
+        # The delay line is stored twice, so that the spectra of the previous
+        # K-1 blocks, from the most recent, are always the contiguous slice
+        # input_spectra[pos:pos+K-1]
+        self.input_spectra = zeros((2*K, L+1, self.nchannels), dtype=complex)
+        self.input_spectra_pos = 0
+        self.previous_blocks_output = zeros((L+1, self.nchannels), dtype=complex)
+
+    def buffer_apply(self, input, out=None):
+        if self.partition_spectra is None:
+            L = self.partition_size
+            if L is None:
+                L = default_partition_size(input.shape[0],
+                                           self.impulse_response.shape[1])
+            self.partition_init(L)
+        L = self.partition_size
+        H = self.partition_spectra
+        K = H.shape[0]
+        window = self.input_window
+        if out is None:
+            output = empty_like(input)
         else:
-            self.input_cache[:-ni, :] = self.input_cache[ni:, :]
-            self.input_cache[-ni:, :] = input
+            output = out
+        pos = 0
+        while pos<input.shape[0]:
+            fill = self.input_fill
+            n = min(input.shape[0]-pos, L-fill)
+            window[L+fill:L+fill+n] = input[pos:pos+n]
+            X = rfft(window, axis=0)
+            Y = X*H[0]
+            Y += self.previous_blocks_output
+            output[pos:pos+n] = irfft(Y, 2*L, axis=0)[L+fill:L+fill+n]
+            pos += n
+            self.input_fill += n
+            if self.input_fill==L:
+                # the block is complete: store its spectrum in the delay line
+                # and compute the contribution of the previous blocks to the
+                # next block
+                self.input_fill = 0
+                window[:L] = window[L:]
+                window[L:] = 0
+                if K>1:
+                    i = self.input_spectra_pos = (self.input_spectra_pos-1)%K
+                    self.input_spectra[i] = X
+                    self.input_spectra[i+K] = X
+                    self.previous_blocks_output[:] = einsum('kfc,kfc->fc',
+                                                   self.input_spectra[i:i+K-1],
+                                                   H[1:])
         return output
 
 
+def default_partition_size(buffersize, ir_length):
+    '''
+    Returns the power of 2 (at least 32) which minimises the estimated cost
+    per sample of :class:`FFTFIRFilterbank` for the given buffer size and
+    impulse response length. For each block of
+    ``min(partition_size, buffersize)`` samples, there are two FFTs of size
+    ``2*partition_size``, and for each sample (approximately) one complex
+    multiply-add for each partition of the impulse response (about 3 times as
+    costly as one step of the FFT).
+    '''
+    best = None
+    for k in range(5, max(6, int(ceil(log2(max(buffersize, ir_length))))+1)):
+        L = 2**k
+        npartitions = (ir_length+L-1)//L
+        cost = 4*(k+1)*max(1., float(L)/buffersize)+3*npartitions
+        if best is None or cost<best[0]:
+            best = (cost, L)
+    return best[1]
+
+
+_partition_spectra_cache = OrderedDict()
+_partition_spectra_cache_size = 256*1024*1024 # in bytes
+
+def partition_spectra(impulse_response, partition_size):
+    '''
+    Returns the spectra of the partitions of the impulse responses
+    
+    ``impulse_response`` has shape ``(nchannels, ir_length)``, the returned
+    (read-only) array has shape ``(npartitions, partition_size+1, nchannels)``
+    with the real FFTs of size ``2*partition_size`` of the zero padded
+    partitions. Recently used spectra are kept in memory (up to 256 MB), so
+    that filterbanks with the same impulse responses do not compute them
+    again.
+    '''
+    impulse_response = ascontiguousarray(impulse_response, dtype=float)
+    key = (impulse_response.shape, partition_size,
+           hashlib.sha1(impulse_response).hexdigest())
+    if key in _partition_spectra_cache:
+        H = _partition_spectra_cache.pop(key)
+    else:
+        nchannels, n = impulse_response.shape
+        L = partition_size
+        K = (n+L-1)//L
+        ir = zeros((K*L, nchannels))
+        ir[:n] = impulse_response.T
+        H = rfft(ir.reshape((K, L, nchannels)), 2*L, axis=1)
+        H.flags.writeable = False
+    _partition_spectra_cache[key] = H
+    total = sum(x.nbytes for x in _partition_spectra_cache.itervalues())
+    while total>_partition_spectra_cache_size and len(_partition_spectra_cache)>1:
+        total -= _partition_spectra_cache.popitem(last=False)[1].nbytes
+    return H
+
+
 class FIRFilterbank(Filterbank):
     '''
     Finite impulse response filterbank
@@ -147,19 +221,35 @@ class FIRFilterbank(Filterbank):
         ``ir_length`` the number of samples in the impulse response. Note that
         if you are using a multichannel sound ``x`` as a set of impulse responses,
         the array should be ``impulse_response=array(x.T)``.
+    ``use_linearfilterbank=False``
+        If ``True``, the filtering is done by a :class:`LinearFilterbank`
+        (direct convolution) instead of FFT based convolution.
     ``minimum_buffer_size=None``
-        If specified, gives a minimum size to the buffer. By default, for the
-        FFT convolution based implementation of ``FIRFilterbank``, the minimum
-        buffer size will be ``3*ir_length``. For maximum efficiency with FFTs,
-        ``buffer_size+ir_length`` should be a power of 2 (otherwise there will
-        be some zero padding), and ``buffer_size`` should be as large as
-        possible.
+        If specified, gives a minimum size to the buffer.
+    ``partition_size=None``
+        For the FFT convolution based implementation, the impulse responses
+        are split into partitions of this size (see
+        :class:`FFTFIRFilterbank`). By default, it is the power of 2 (at
+        least 32) which minimises the estimated cost per sample for the size
+        of the first buffer and the length of the impulse responses (see
+        :func:`default_partition_size`). Larger partitions mean fewer
+        products with the partition spectra but longer FFTs, which are
+        computed for every buffer if the buffers are shorter than a
+        partition.
     '''
+    # a 1D impulse response is shared by all the channels
+    channel_arguments = dict(impulse_response=2)
+
     def __init__(self, source, impulse_response, use_linearfilterbank=False,
-                 minimum_buffer_size=None):
+                 minimum_buffer_size=None, partition_size=None):
+        # the initialisation arguments are those of the class we switch to,
+        # they are used to restrict the channels (see select_channels)
         if use_linearfilterbank:
             self.__class__ = LinearFIRFilterbank
+            kwds = dict(minimum_buffer_size=minimum_buffer_size)
         else:
             self.__class__ = FFTFIRFilterbank
-        self.__init__(source, impulse_response,
-                      minimum_buffer_size=minimum_buffer_size)
+            kwds = dict(minimum_buffer_size=minimum_buffer_size,
+                        partition_size=partition_size)
+        self._init_arguments = ((source, impulse_response), kwds)
+        self.__init__(source, impulse_response, **kwds)
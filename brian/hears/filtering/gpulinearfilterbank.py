@@ -40,6 +40,8 @@ class LinearFilterbank(Filterbank):
         this should be done for small filter orders. By default, it is done
         if the filter order is less than or equal to 32.
     '''
+    channel_arguments = dict(b=2, a=2)
+
     def __init__(self, source, b, a, samplerate=None,
                  precision='double', forcesync=True, pagelocked_mem=True, unroll_filterorder=None):
         # Automatically duplicate mono input to fit the desired output shape
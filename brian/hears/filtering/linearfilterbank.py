@@ -2,11 +2,16 @@ from brian import *
 from scipy import signal, weave, random
 from filterbank import Filterbank, RestructureFilterbank
 from ..bufferable import Bufferable
-from itertools import izip
+from time import time
 
 __all__ = ['LinearFilterbank']
 
-def _scipy_apply_linear_filterbank(b, a, x, zi):
+# The durations of the two numpy/scipy kernels below for each shape
+# (nchannels, m, p, buffer size) of the buffers, measured on the first two
+# buffers of this shape (see _scipy_apply_linear_filterbank)
+_kernel_durations = {}
+
+def _scipy_apply_linear_filterbank(b, a, x, zi, out=None):
     '''
     Parallel version of scipy lfilter command for a bank of n sequences of length 1
     
@@ -16,53 +21,122 @@ def _scipy_apply_linear_filterbank(b, a, x, zi):
     and zi must be of shape (n,m-1,p). Here n is the number of channels in the
     filterbank, m is the order of the filter, p is the number of filters in
     a chain (cascade) to apply (you do first with (:,:,0) then (:,:,1), etc.),
-    and s is the size of the buffer segment.
+    and s is the size of the buffer segment. The output is written in out if
+    it is given, and in a new array otherwise.
+    
+    The whole buffer is either filtered channel by channel with
+    :func:`~scipy.signal.lfilter` (faster with few channels or large buffers)
+    or all the channels are filtered at once, one sample at a time. Both give
+    the same results and leave the same filter state in zi. The first two
+    buffers of a given shape are filtered with one kernel each, and the
+    fastest one is used for the following buffers of this shape.
+    '''
+    n, m, p = b.shape
+    kernels = [_lfilter_apply_linear_filterbank, _loop_apply_linear_filterbank]
+    durations = _kernel_durations.setdefault((n, m, p, x.shape[0]), [])
+    if len(durations)<len(kernels):
+        start = time()
+        out = kernels[len(durations)](b, a, x, zi, out)
+        durations.append(time()-start)
+        return out
+    return kernels[argmin(durations)](b, a, x, zi, out)
+
+
+def _lfilter_apply_linear_filterbank(b, a, x, zi, out=None):
+    '''
+    Filters the whole buffer x channel by channel with scipy's lfilter, with
+    the same arguments as :func:`_scipy_apply_linear_filterbank`.
+    '''
+    n, m, p = b.shape
+    # The other versions assume that a[:, 0, :] is 1
+    a = array(a)
+    a[:, 0, :] = 1
+    X = array(x.T, order='C')
+    for i in xrange(n):
+        zi_i = array(zi[i, :m-1, :].T)
+        u = X[i]
+        for curf in xrange(p):
+            u, zi_i[curf] = signal.lfilter(b[i, :, curf], a[i, :, curf], u,
+                                           zi=zi_i[curf])
+        X[i] = u
+        zi[i, :m-1, :] = zi_i.T
+    if out is None:
+        return ascontiguousarray(X.T)
+    out[:] = X.T
+    return out
+
+
+def _loop_apply_linear_filterbank(b, a, x, zi, out=None):
+    '''
+    Filters all the channels at once, one sample at a time, with the same
+    arguments as :func:`_scipy_apply_linear_filterbank`.
+    '''
+    return _loop_apply_time_varying_linear_filterbank(b[newaxis], a[newaxis],
+                                                      [x.shape[0]], x, zi, out)
+
+
+def _loop_apply_time_varying_linear_filterbank(b, a, ends, x, zi, out=None):
+    '''
+    Filters all the channels at once, one sample at a time, with coefficients
+    that change during the buffer. The coeffs b, a have shape (q, n, m, p),
+    where q is the number of segments of the buffer with constant
+    coefficients, and ends are the ends of these segments (so that
+    ``b[j]`` is used for the samples from ``ends[j-1]`` to ``ends[j]``).
+    The other arguments are as in :func:`_scipy_apply_linear_filterbank`.
+    
+    The coefficients and the state are copied to contiguous one-dimensional
+    arrays so that each operation works on a contiguous array of length n.
     '''
-    alf_cache_b00 = [0]*zi.shape[2]
-    alf_cache_a1 = [0]*zi.shape[2]
-    alf_cache_b1 = [0]*zi.shape[2]
-    alf_cache_zi00 = [0]*zi.shape[2]
-    alf_cache_zi0 = [0]*zi.shape[2]
-    alf_cache_zi1 = [0]*zi.shape[2]
-    for curf in xrange(zi.shape[2]):
-        alf_cache_b00[curf] = b[:, 0, curf]
-        alf_cache_zi00[curf] = zi[:, 0, curf]
-        alf_cache_b1[curf] = b[:, 1:b.shape[1], curf]
-        alf_cache_a1[curf] = a[:, 1:b.shape[1], curf]
-        alf_cache_zi0[curf] = zi[:, 0:b.shape[1]-1, curf]
-        alf_cache_zi1[curf] = zi[:, 1:b.shape[1], curf]
-    X = x.copy()
-    output = empty_like(X)
-    num_cascade = zi.shape[2]
-    b_loop_size = b.shape[1]-2
-    y = zeros(zi.shape[0])
-    yr = reshape(y, (1, len(y))).T
-    t = zeros(alf_cache_b1[0].shape, order='F')
-    t2 = zeros(alf_cache_b1[0].shape, order='F')
-    for sample, (x, o) in enumerate(izip(X, output)):
-        xr = reshape(x, (1, len(x))).T
-        for curf in xrange(num_cascade):
-            #y = b[:, 0, curf]*x+zi[:, 0, curf]
-            multiply(alf_cache_b00[curf], x, y)
-            add(y, alf_cache_zi00[curf], y)
-            #zi[:, :i-1, curf] = b[:, 1:i, curf]*xr+zi[:, 1:i, curf]-a[:, 1:i, curf]*yr
-            multiply(alf_cache_b1[curf], xr, t)
-            add(t, alf_cache_zi1[curf], t)
-            multiply(alf_cache_a1[curf], yr, t2)
-            subtract(t, t2, alf_cache_zi0[curf])
-            u = x
-            ur = xr
-            x = y
-            xr = yr
-            y = u
-            yr = ur
-        #output[sample] = y
-        o[:] = x
+    q, n, m, p = b.shape
+    b = ascontiguousarray(b.transpose(0, 3, 2, 1))
+    a = ascontiguousarray(a.transpose(0, 3, 2, 1))
+    Z = [[zi[:, i, curf].copy() for i in xrange(m-1)] for curf in xrange(p)]
+    x = ascontiguousarray(x)
+    if out is None:
+        output = empty_like(x)
+    else:
+        output = out
+    # intermediate results of the cascade alternate between these two arrays
+    u = [empty(n), empty(n)]
+    t = empty(n)
+    segment = -1
+    segment_end = 0
+    for sample in xrange(x.shape[0]):
+        while sample>=segment_end:
+            segment += 1
+            segment_end = ends[segment]
+            B = [list(b[segment, curf]) for curf in xrange(p)]
+            A = [list(a[segment, curf]) for curf in xrange(p)]
+        xs = x[sample]
+        for curf in xrange(p):
+            bf, af, zf = B[curf], A[curf], Z[curf]
+            if curf==p-1:
+                ys = output[sample]
+            else:
+                ys = u[curf%2]
+            # y = b[0]*x+z[0]
+            multiply(bf[0], xs, ys)
+            if m>1:
+                add(ys, zf[0], ys)
+            # z[i] = b[i+1]*x+z[i+1]-a[i+1]*y
+            for i in xrange(m-2):
+                multiply(bf[i+1], xs, zf[i])
+                add(zf[i], zf[i+1], zf[i])
+                multiply(af[i+1], ys, t)
+                subtract(zf[i], t, zf[i])
+            if m>1:
+                multiply(bf[m-1], xs, zf[m-2])
+                multiply(af[m-1], ys, t)
+                subtract(zf[m-2], t, zf[m-2])
+            xs = ys
+    for curf in xrange(p):
+        for i in xrange(m-1):
+            zi[:, i, curf] = Z[curf][i]
     return output
 
 
 def _weave_apply_linear_filterbank(b, a, x, zi,
-                                   cpp_compiler, extra_compile_args):
+                                   cpp_compiler, extra_compile_args, out=None):
     if zi.shape[2]>1:
         # we need to do this so as not to alter the values in x in the C code below
         # but if zi.shape[2] is 1 there is only one filter in the chain and the
@@ -71,14 +145,17 @@ def _weave_apply_linear_filterbank(b, a, x, zi,
     else:
         # make sure that the array is in C-order
         x = asarray(x, order='C')
-    y = empty_like(x)
+    if out is None:
+        y = empty_like(x)
+    else:
+        y = out
     n, m, p = b.shape
     n1, m1, p1 = a.shape
     numsamples = x.shape[0]
     if n1!=n or m1!=m or p1!=p or x.shape!=(numsamples, n) or zi.shape!=(n, m, p):
         raise ValueError('Data has wrong shape.')
-    if numsamples>1 and not x.flags['C_CONTIGUOUS']:
-        raise ValueError('Input data must be C_CONTIGUOUS')
+    if numsamples>1 and not (x.flags['C_CONTIGUOUS'] and y.flags['C_CONTIGUOUS']):
+        raise ValueError('Input and output data must be C_CONTIGUOUS')
     if not b.flags['F_CONTIGUOUS'] or not a.flags['F_CONTIGUOUS'] or not zi.flags['F_CONTIGUOUS']:
         raise ValueError('Filter parameters must be F_CONTIGUOUS')
     code = '''
@@ -110,6 +187,69 @@ def _weave_apply_linear_filterbank(b, a, x, zi,
     return y 
 
 
+def _weave_apply_time_varying_linear_filterbank(b, a, ends, x, zi,
+                                                cpp_compiler, extra_compile_args,
+                                                out=None):
+    '''
+    Weave version of :func:`_loop_apply_time_varying_linear_filterbank`, with
+    the same arguments and filter state as
+    :func:`_weave_apply_linear_filterbank`.
+    '''
+    q, n, m, p = b.shape
+    x = array(x, copy=True, order='C')
+    if out is None:
+        y = empty_like(x)
+    else:
+        y = out
+    numsamples = x.shape[0]
+    if a.shape!=b.shape or len(ends)!=q or x.shape!=(numsamples, n) or zi.shape!=(n, m, p):
+        raise ValueError('Data has wrong shape.')
+    if numsamples>1 and not y.flags['C_CONTIGUOUS']:
+        raise ValueError('Output data must be C_CONTIGUOUS')
+    if not zi.flags['F_CONTIGUOUS']:
+        raise ValueError('Filter state must be F_CONTIGUOUS')
+    # the coefficients of each segment are in Fortran order, as in the time
+    # invariant version
+    b = array(b.transpose(1, 2, 3, 0), order='F')
+    a = array(a.transpose(1, 2, 3, 0), order='F')
+    ends = array(ends, dtype=int)
+    code = '''
+    #define X(s,i) x[(s)*n+(i)]
+    #define Y(s,i) y[(s)*n+(i)]
+    #define A(i,j,k) a[(i)+(j)*n+(k)*n*m+offset]
+    #define B(i,j,k) b[(i)+(j)*n+(k)*n*m+offset]
+    #define Zi(i,j,k) zi[(i)+(j)*n+(k)*n*(m-1)]
+    int segment = 0;
+    int offset = 0;
+    for(int s=0; s<numsamples; s++)
+    {
+        while(s>=ends[segment])
+        {
+            segment++;
+            offset = segment*n*m*p;
+        }
+        for(int k=0; k<p; k++)
+        {
+            for(int j=0; j<n; j++)
+                         Y(s,j) =   B(j,0,k)*X(s,j) + Zi(j,0,k);
+            for(int i=0; i<m-2; i++)
+                for(int j=0;j<n;j++)
+                    Zi(j,i,k) = B(j,i+1,k)*X(s,j) + Zi(j,i+1,k) - A(j,i+1,k)*Y(s,j);
+            for(int j=0; j<n; j++)
+                  Zi(j,m-2,k) = B(j,m-1,k)*X(s,j)               - A(j,m-1,k)*Y(s,j);
+            if(k<p-1)
+                for(int j=0; j<n; j++)
+                    X(s,j) = Y(s,j);
+        }
+    }
+    '''
+    weave.inline(code, ['b', 'a', 'ends', 'x', 'zi', 'y', 'n', 'm', 'p',
+                        'numsamples'],
+                 compiler=cpp_compiler,
+                 extra_compile_args=extra_compile_args)
+    return y
+
+
 class LinearFilterbank(Filterbank):
     '''
     Generalised linear filterbank
@@ -129,6 +269,15 @@ class LinearFilterbank(Filterbank):
     The filter parameters are stored in the modifiable attributes ``filt_b``,
     ``filt_a`` and ``filt_state`` (the variable ``z`` in the section below).
     
+    The coefficients can also change during the next buffer, by setting the
+    attribute ``time_varying_coefficients`` to a tuple ``(ends, b, a)`` where
+    ``b`` and ``a`` have shape ``(q, nchannels, m, p)``, and ``b[j]``,
+    ``a[j]`` are used for the samples from ``ends[j-1]`` to ``ends[j]`` of
+    the buffer (this is used by :class:`ControlFilterbank` to update the
+    filters of a whole buffer at once). The attribute is reset to ``None``
+    after the buffer is filtered, and ``filt_b`` and ``filt_a`` are not
+    modified.
+    
     Has one method:
     
     .. automethod:: decascade
@@ -164,6 +313,8 @@ class LinearFilterbank(Filterbank):
                     a[0] + a[1]z  + ... + a[m] z
         
     '''
+    channel_arguments = dict(b=2, a=2)
+
     def __init__(self, source, b, a):
         # Automatically duplicate mono input to fit the desired output shape
         if b.shape[0]!=source.nchannels:
@@ -190,19 +341,33 @@ class LinearFilterbank(Filterbank):
     def reset(self):
         self.buffer_init()
         
+    time_varying_coefficients = None
+
     def buffer_init(self):
         Filterbank.buffer_init(self)
         self.filt_state[:] = 0
+        self.time_varying_coefficients = None
     
-    def buffer_apply(self, input):
-        
+    def buffer_apply(self, input, out=None):
+        if self.time_varying_coefficients is not None:
+            ends, b, a = self.time_varying_coefficients
+            self.time_varying_coefficients = None
+            if ends[-1]!=input.shape[0]:
+                raise ValueError('The time varying coefficients do not match the buffer.')
+            if self.use_weave:
+                return _weave_apply_time_varying_linear_filterbank(b, a, ends,
+                            input, self.filt_state, self.cpp_compiler,
+                            self.extra_compile_args, out)
+            else:
+                return _loop_apply_time_varying_linear_filterbank(b, a, ends,
+                            input, self.filt_state, out)
         if self.use_weave:
             return _weave_apply_linear_filterbank(self.filt_b, self.filt_a, input,
                                                   self.filt_state, self.cpp_compiler,
-                                                  self.extra_compile_args)
+                                                  self.extra_compile_args, out)
         else:
             return _scipy_apply_linear_filterbank(self.filt_b, self.filt_a, input,
-                                                  self.filt_state)
+                                                  self.filt_state, out)
         
     def decascade(self, ncascade=1):
         '''
@@ -0,0 +1,103 @@
+'''
+Streaming polyphase resampling with a windowed sinc filter
+'''
+from brian import *
+from filterbank import *
+from fractions import gcd
+
+__all__ = ['ResampleFilterbank']
+
+class ResampleFilterbank(Filterbank):
+    '''
+    Filterbank that resamples its source to a new samplerate
+
+    Initialised with arguments:
+
+    ``source``
+        Source sound or filterbank.
+    ``samplerate``
+        The samplerate of the output. The ratio with the samplerate of the
+        source is computed from the samplerates rounded to 1 Hz, e.g. it is
+        160/147 from 44.1 kHz to 48 kHz.
+    ``zero_crossings=16``
+        The number of zero crossings of the sinc function on each side of the
+        filter, which sets the length of the filter and the steepness of the
+        anti-aliasing filter.
+    ``rolloff=0.945``
+        The cutoff frequency of the low pass filter, relative to the Nyquist
+        frequency of the lower of the two samplerates.
+    ``beta=8.6``
+        The parameter of the Kaiser window applied to the sinc function.
+
+    The output sample at time ``t`` is the sum of the source samples weighted
+    by the windowed sinc filter centred on ``t``, so that the output is not
+    delayed. The filter coefficients are computed once for each of the
+    phases of the output samples relative to the source samples (there are
+    as many phases as the numerator of the ratio), and the source samples
+    that are needed for the next buffer are kept between buffers. All the
+    channels are resampled together, and the resampler can be used as a
+    stage in a chain of filterbanks, for example to resample a
+    :class:`LazySound` without loading it into memory::
+
+        sound = LazySound('recording.wav')
+        fb = Gammatone(ResampleFilterbank(sound, 20*kHz), cf)
+
+    The :attr:`duration` of the filterbank is the duration of its source, so
+    that the number of output samples is ``duration*samplerate``.
+    '''
+    channel_arguments = {}
+
+    @check_units(samplerate=Hz)
+    def __init__(self, source, samplerate, zero_crossings=16, rolloff=0.945,
+                 beta=8.6):
+        Filterbank.__init__(self, source)
+        up = int(rint(samplerate))
+        down = int(rint(source.samplerate))
+        g = gcd(up, down)
+        self.up = up = up//g
+        self.down = down = down//g
+        self.samplerate = samplerate
+        # the filter h(t), with t in source samples, is a sinc function with
+        # cutoff fc (relative to the source Nyquist frequency) and a Kaiser
+        # window, and it is zero outside -half<t<half
+        fc = rolloff*min(1., float(up)/down)
+        half_width = zero_crossings/fc
+        self.half = half = int(ceil(half_width))
+        # output sample n is at time n*down/up in source samples, it is
+        # computed from the source samples base-half+1+j for j<2*half, where
+        # base=(n*down)//up and the phase is (n*down)%up
+        t = (arange(up)[:, newaxis]*1./up)+half-1-arange(2*half)[newaxis, :]
+        # (i0 squeezes its output)
+        window = i0(beta*sqrt(clip(1-(t/half_width)**2, 0, 1))).reshape(t.shape)/i0(beta)
+        window[abs(t)>=half_width] = 0
+        self.filters = fc*sinc(fc*t)*window
+
+    def buffer_init(self):
+        Filterbank.buffer_init(self)
+        # source samples input_start:input_start+len(input), starting with
+        # zeros before the start of the source
+        self.input = zeros((self.half, self.nchannels))
+        self.input_start = -self.half
+
+    def buffer_fetch_next(self, samples):
+        n = self.next_sample+arange(samples)
+        self.next_sample += samples
+        base = (n*self.down)//self.up
+        phase = (n*self.down)%self.up
+        half = self.half
+        input_end = self.input_start+len(self.input)
+        needed_end = base[-1]+half+1
+        if needed_end>input_end:
+            self.input = vstack((self.input,
+                                 self.source.buffer_fetch(input_end, needed_end)))
+        start = base-half+1-self.input_start
+        filters = self.filters[phase]
+        output = self.buffer_output(samples)
+        output[:] = 0
+        for j in xrange(2*half):
+            output += filters[:, j, newaxis]*self.input[start+j]
+        # only keep the source samples needed for the next buffers
+        keep = start[-1]
+        self.input = self.input[keep:]
+        self.input_start += keep
+        return output
@@ -35,6 +35,8 @@ class MiddleEar(LinearFilterbank):
     II. Nonlinear Tuning with a Frequency Glide".
     The Journal of the Acoustical Society of America 114 (2003): 2007.
     '''
+    channel_arguments = dict(gain=1)
+
     def __init__(self, source, gain=1, **kwds):
         # Automatically duplicate mono input to fit the desired output shape
         gain = np.atleast_1d(gain)
@@ -320,39 +322,52 @@ class Control_Coefficients:
         self.preal,self.pimg = self.analog_poles()
         
     def return_coefficients(self,control_signal):
-        self.wbw=-(self.preal[:,0] - control_signal)/self.PI2
+        filt_b, filt_a = self.batch_coefficients(control_signal)
+        self.filt_b[:] = filt_b[-1]
+        self.filt_a[:] = filt_a[-1]
+        return self.filt_b,self.filt_a
+
+    def batch_coefficients(self,control_signal):
+        '''
+        Returns the coefficients for each row of control_signal, as arrays of
+        shape (len(control_signal), nch, 3, 5).
+        '''
+        control_signal = np.atleast_2d(control_signal)
+        wbw=-(self.preal[:,0] - control_signal)/self.PI2
         
-        self.gain_norm_bp=((self.PI2**2
-                            * np.sqrt(self.wbw**2 + self.f_shift**2)
-                            * np.sqrt((2*self.cf+self.f_shift)**2 + self.wbw**2)
-                            )**3)/np.sqrt(self.PI2**2*self.cf**2)#       
+        gain_norm_bp=((self.PI2**2
+                       * np.sqrt(wbw**2 + self.f_shift**2)
+                       * np.sqrt((2*self.cf+self.f_shift)**2 + wbw**2)
+                       )**3)/np.sqrt(self.PI2**2*self.cf**2)#       
         iord = [1,3,5]  
         
-        preal = self.preal[:,iord]-control_signal.T  #actually control_signal is the same for the three channels
+        preal = self.preal[:,iord]-control_signal[:,:,np.newaxis]  #actually control_signal is the same for the three channels
+        pimg = self.pimg[:,iord]
         
-        temp=(self.fs_bilinear-(preal))**2 + self.pimg[:,iord]**2    
+        temp=(self.fs_bilinear-(preal))**2 + pimg**2    
         
-        self.filt_a[:,0,0:3] = 1.
-        self.filt_a[:,1,0:3]= -2*(self.fs_bilinear**2-(preal)**2-self.pimg[:,iord]**2)/temp            
-        self.filt_a[:,2,0:3] = ((self.fs_bilinear+(preal))**2+self.pimg[:,iord]**2)/temp
-        self.filt_b[:,0,0:3] = 1./temp
-        self.filt_b[:,1,0:3] = 2./temp  
-        self.filt_b[:,2,0:3] = 1./temp
+        filt_a = np.zeros((len(control_signal),)+self.filt_a.shape)
+        filt_b = np.zeros((len(control_signal),)+self.filt_b.shape)
+        filt_a[:,:,0,0:3] = 1.
+        filt_a[:,:,1,0:3]= -2*(self.fs_bilinear**2-(preal)**2-pimg**2)/temp            
+        filt_a[:,:,2,0:3] = ((self.fs_bilinear+(preal))**2+pimg**2)/temp
+        filt_b[:,:,0,0:3] = 1./temp
+        filt_b[:,:,1,0:3] = 2./temp  
+        filt_b[:,:,2,0:3] = 1./temp
         
-        self.filt_a[:,0,3] = 1.
-        self.filt_a[:,1,3]= 1.      ## changed  from 1 to 0
-        self.filt_a[:,2,3] = 0.
-        self.filt_b[:,0,3] = self.fs_bilinear
-        self.filt_b[:,1,3] = -self.fs_bilinear
-        self.filt_b[:,2,3] = 0
+        filt_a[:,:,0,3] = 1.
+        filt_a[:,:,1,3]= 1.      ## changed  from 1 to 0
+        filt_a[:,:,2,3] = 0.
+        filt_b[:,:,0,3] = self.fs_bilinear
+        filt_b[:,:,1,3] = -self.fs_bilinear
+        filt_b[:,:,2,3] = 0
         
-#        self.filt_b[:,:,3] = self.gain_norm_bp*self.filt_b[:,:,3]  
+#        filt_b[:,:,:,3] = gain_norm_bp*filt_b[:,:,:,3]  
         
-        self.filt_a[:,0,4] = 1.
-        self.filt_b[:,0,4] = self.gain_norm_bp
-  
+        filt_a[:,:,0,4] = 1.
+        filt_b[:,:,0,4] = gain_norm_bp
         
-        return self.filt_b,self.filt_a
+        return filt_b,filt_a
 
     def analog_poles(self):
         self.preal[:,0] = -self.PI2*self.wbw  #that should be -, actually there are never used
@@ -409,22 +424,42 @@ class Signal_Coefficients:
         self.gain_norm = self.gain_norm /(np.sqrt((2*pi*self.cf)**2+self.zeroa**2))**self.order_of_zero
         
     def return_coefficients(self,control_signal):
-        self.preal,self.pimg = self.analog_poles(control_signal)
-        
+        filt_b, filt_a = self.batch_coefficients(control_signal)
+        self.filt_b[:] = filt_b[-1]
+        self.filt_a[:] = filt_a[-1]
+        return self.filt_b,self.filt_a
+
+    def batch_coefficients(self,control_signal):
+        '''
+        Returns the coefficients for each row of control_signal, as arrays of
+        shape (len(control_signal), nch, 3, 11).
+        '''
+        control_signal = np.atleast_2d(control_signal)
+        # the real parts of the poles of the second order sections (the odd
+        # poles of analog_poles), the imaginary parts do not depend on the
+        # control signal
+        preal0 = -self.rgain-control_signal
+        preal4 = preal0-self.ta
+        preal2 = (preal0+preal4)*0.5
+        preal = np.dstack((preal0, preal2, preal4, preal0, preal4,
+                           preal0, preal2, preal4, preal0, preal4))
         iord = np.arange(2,22,2)-1
-        temp=(self.fs_bilinear-self.preal[:,iord])**2 + self.pimg[:,iord]**2
-        self.filt_a[:,0,:10] = 1
-        self.filt_a[:,1,:10] = -2*(self.fs_bilinear**2-self.preal[:,iord]**2-self.pimg[:,iord]**2)/temp            
-        self.filt_a[:,2,:10] = ((self.fs_bilinear+self.preal[:,iord])**2+self.pimg[:,iord]**2)/temp
+        pimg = self.pimg[:,iord]
+        temp=(self.fs_bilinear-preal)**2 + pimg**2
+        filt_a = np.zeros((len(control_signal),)+self.filt_a.shape)
+        filt_b = np.zeros((len(control_signal),)+self.filt_b.shape)
+        filt_a[:,:,0,:10] = 1
+        filt_a[:,:,1,:10] = -2*(self.fs_bilinear**2-preal**2-pimg**2)/temp            
+        filt_a[:,:,2,:10] = ((self.fs_bilinear+preal)**2+pimg**2)/temp
         
-        self.filt_b[:,0,:10] = (-self.zeroamat+self.fs_bilinear)/temp
-        self.filt_b[:,1,:10] = (-2*self.zeroamat)/temp
-        self.filt_b[:,2,:10] = (-self.zeroamat-self.fs_bilinear)/temp 
+        filt_b[:,:,0,:10] = (-self.zeroamat+self.fs_bilinear)/temp
+        filt_b[:,:,1,:10] = (-2*self.zeroamat)/temp
+        filt_b[:,:,2,:10] = (-self.zeroamat-self.fs_bilinear)/temp 
         
-        self.filt_a[:,0,10] = 1.
-        self.filt_b[:,0,10] = self.gain_norm/3.
+        filt_a[:,:,0,10] = 1.
+        filt_b[:,:,0,10] = self.gain_norm/3.
         
-        return self.filt_b,self.filt_a
+        return filt_b,filt_a
 
     def analog_poles(self,control_signal):
         aa = -self.rgain-control_signal
@@ -466,9 +501,16 @@ class Filter_Update:
         reshaped_input = input[-1,:].reshape(1,-1)
         self.target.filt_b,self.target.filt_a = self.coef.return_coefficients(reshaped_input) 
         self.param.append(self.coef.control_signal)
+    def batch(self, ends, input):
+        # the coefficients only depend on the last value of each interval
+        filt_b, filt_a = self.coef.batch_coefficients(input[ends-1,:])
+        self.param.extend([self.coef.control_signal]*len(ends))
+        return filt_b, filt_a
 
 
 class LowPass_IHC(LinearFilterbank):
+    channel_arguments = dict(cf=1)
+
     def __init__(self,source,cf,fc,gain,order): 
         nch = len(cf)
         TWOPI = 2*pi
@@ -488,6 +530,8 @@ class LowPass_IHC(LinearFilterbank):
 
 
 class LowPass_filter(LinearFilterbank):
+    channel_arguments = dict(cf=1)
+
     def __init__(self,source,cf,fc,gain,order):
         nch = len(cf)
         TWOPI = 2*pi
@@ -518,6 +562,8 @@ def saturation_fc(x,A0=1,B=1,C=1,D=1):
 
 class TanCarneyIHC(CombinedFilterbank):
     
+    channel_arguments = dict(cf=1)
+
     def __init__(self, source, cf):
         CombinedFilterbank.__init__(self, source)
         source = self.get_modified_source()
@@ -531,6 +577,8 @@ class TanCarneyIHC(CombinedFilterbank):
 
 
 class TanCarneyControl(CombinedFilterbank):
+    channel_arguments = dict(cf=1, param=1)
+
     def __init__(self, source, cf, update_interval, param=None):
         CombinedFilterbank.__init__(self, source)
         source = self.get_modified_source()       
@@ -570,6 +618,8 @@ class TanCarneyControl(CombinedFilterbank):
 
 
 class TanCarneySignal(CombinedFilterbank):    
+    channel_arguments = dict(cf=1, param=1)
+
     def __init__(self, source, cf, update_interval, param=None):
 
         CombinedFilterbank.__init__(self, source)
@@ -624,6 +674,8 @@ class TanCarney(CombinedFilterbank):
         original paper. 
     '''
         
+    channel_arguments = dict(cf=1, param=1)
+
     def __init__(self, source, cf, update_interval=1, param=None):
         CombinedFilterbank.__init__(self, source)
         source = self.get_modified_source()       
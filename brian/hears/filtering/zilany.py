@@ -224,6 +224,8 @@ def OHC_transduction(x,taumin,taumax,asym):
 
 
 class LowPass_filter(LinearFilterbank):
+    channel_arguments = dict(cf=1)
+
     def __init__(self,source,cf,fc,gain,order):
         nch = len(cf)
         TWOPI = 2*pi
@@ -270,6 +272,8 @@ class ZILANY(CombinedFilterbank):
         original paper. 
     '''
     
+    channel_arguments = dict(cf=1, param=1)
+
     def __init__(self, source,cf,update_interval,param={}):
         file="/home/bertrand/Data/MatlabProg/brian_hears/ZilanyCarney-JASAcode-2009/wbout.mat"
         X=loadmat(file,struct_as_record=False)
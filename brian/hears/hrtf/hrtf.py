@@ -2,6 +2,8 @@ from brian import *
 from ..sounds import Sound
 from ..filtering import FIRFilterbank
 from copy import copy
+from collections import OrderedDict
+from scipy.spatial import cKDTree
 
 __all__ = ['HRTF', 'HRTFSet', 'HRTFDatabase',
            'make_coordinates']
@@ -38,6 +40,7 @@ class HRTF(object):
         self.impulse_response = hrir
         self.left = hrir.left
         self.right = hrir.right
+        self.fft_cache = None
 
     def apply(self, sound):
         '''
@@ -66,12 +69,14 @@ class HRTF(object):
         ir_nmax = max(len(left), len(right))
         nmax = max(ir_nmax, len(sound))+ir_nmax
         nmax = 2**int(ceil(log2(nmax)))
-        leftpad = hstack((left, zeros(nmax-len(left))))
-        rightpad = hstack((right, zeros(nmax-len(right))))
         soundpad = hstack((zeros(ir_nmax), sound, zeros(nmax-ir_nmax-len(sound))))
-        # Compute FFTs, multiply and compute IFFT
-        left_fft = fft(leftpad, n=nmax)
-        right_fft = fft(rightpad, n=nmax)
+        # Compute FFTs, multiply and compute IFFT. The FFTs of the HRTFs are
+        # kept for the next sound, which usually has the same length.
+        if self.fft_cache is None or self.fft_cache[0]!=nmax:
+            leftpad = hstack((left, zeros(nmax-len(left))))
+            rightpad = hstack((right, zeros(nmax-len(right))))
+            self.fft_cache = (nmax, fft(leftpad, n=nmax), fft(rightpad, n=nmax))
+        _, left_fft, right_fft = self.fft_cache
         sound_fft = fft(soundpad, n=nmax)
         left_sound_fft = left_fft*sound_fft
         right_sound_fft = right_fft*sound_fft
@@ -139,10 +144,27 @@ class HRTFSet(object):
     .. automethod:: subset
     .. automethod:: filterbank
     .. automethod:: get_index
+    .. automethod:: nearest
+    .. automethod:: interpolate
     
     You can access an HRTF by index via ``hrtfset[index]``, or
     by its coordinates via ``hrtfset(coord1=val1, coord2=val2)``.
     
+    **Spatial index**
+    
+    The coordinates are indexed when the set is created: the exact lookups
+    of :meth:`get_index` use the sorted values of each coordinate, and the
+    nearest neighbour queries of :meth:`nearest` and :meth:`interpolate` use
+    a KD-tree (``scipy.spatial.cKDTree``). If ``spherical`` is given, the
+    tree is built on the points of the unit sphere given by the azimuth and
+    elevation, so that for instance azimuths 355 and 5 are close; otherwise
+    it is built on the values of all the coordinates. The HRTFs returned by
+    :meth:`interpolate` are kept in a cache of the
+    ``interpolation_cache_size`` (256 by default) most recently used
+    positions, and each :class:`HRTF` keeps the FFT of its impulse response
+    between calls of :meth:`HRTF.apply`, so that a moving source can be
+    simulated buffer by buffer without recomputing the filters.
+    
     **Initialisation**
     
     ``data``
@@ -154,17 +176,46 @@ class HRTFSet(object):
     ``coordinates``
         A record array of length ``num_indices`` giving the coordinates of each
         HRTF. You can use :func:`make_coordinates` to help with this.
+    ``spherical=None``
+        The names of the azimuth and elevation coordinates (in degrees), e.g.
+        ``('azim', 'elev')``, if the HRTFs are positions on a sphere.
     '''
-    def __init__(self, data, samplerate, coordinates):
+    interpolation_cache_size = 256
+
+    def __init__(self, data, samplerate, coordinates, spherical=None):
         self.data = data
         self.samplerate = samplerate
         self.coordinates = coordinates
+        self.spherical = spherical
         self.hrtf = []
         for i in xrange(self.num_indices):
             l = Sound(self.data[0, i, :], samplerate=self.samplerate)
             r = Sound(self.data[1, i, :], samplerate=self.samplerate)
             self.hrtf.append(HRTF(l, r))
-            
+        self.build_index()
+
+    def build_index(self):
+        # sorted values of each coordinate for exact lookups
+        self.sorted_coordinates = {}
+        for name in self.coordinates.dtype.names:
+            order = argsort(self.coordinates[name], kind='mergesort')
+            self.sorted_coordinates[name] = (order, self.coordinates[name][order])
+        # KD-tree for nearest neighbour queries
+        if self.spherical is None:
+            self.tree_coordinates = self.coordinates.dtype.names
+        else:
+            self.tree_coordinates = tuple(self.spherical)
+        self.tree = cKDTree(self.tree_points(*[self.coordinates[name]
+                                               for name in self.tree_coordinates]))
+        self.interpolation_cache = OrderedDict()
+
+    def tree_points(self, *values):
+        if self.spherical is None:
+            return column_stack([asarray(v, dtype=float) for v in values])
+        azim, elev = [asarray(v, dtype=float)*pi/180 for v in values]
+        return column_stack((cos(elev)*cos(azim), cos(elev)*sin(azim),
+                             sin(elev)))
+
     def __getitem__(self, key):
         return self.hrtf[key]
     
@@ -172,15 +223,68 @@ class HRTFSet(object):
         '''
         Return the index of the HRTF with the coords specified by keyword.
         '''
-        I = ones(self.num_indices, dtype=bool)
-        for key, value in kwds.items():
-            I = logical_and(I, abs(self.coordinates[key]-value)<1e-10)
-        indices = I.nonzero()[0]
+        # the candidates for the first coordinate are found in its sorted
+        # values, and then checked for the other ones
+        indices = arange(self.num_indices)
+        for i, (key, value) in enumerate(kwds.items()):
+            if i==0:
+                order, values = self.sorted_coordinates[key]
+                indices = order[values.searchsorted(value-1e-10, side='right'):
+                                values.searchsorted(value+1e-10, side='left')]
+            else:
+                indices = indices[abs(self.coordinates[key][indices]-value)<1e-10]
         if len(indices)==0:
             raise IndexError('No HRTF exists with those coordinates')
         if len(indices)>1:
             raise IndexError('More than one HRTF exists with those coordinates')
         return indices[0]
+
+    def query(self, k, kwds):
+        if sorted(kwds.keys())!=sorted(self.tree_coordinates):
+            raise ValueError('The coordinates should be '+', '.join(self.tree_coordinates))
+        point = self.tree_points(*[kwds[name] for name in self.tree_coordinates])
+        distances, indices = self.tree.query(point[0], k=min(k, self.num_indices))
+        return atleast_1d(distances), atleast_1d(indices)
+
+    def nearest(self, k=1, **kwds):
+        '''
+        Returns the index of the HRTF nearest to the coordinates specified by
+        keyword, or if ``k>1`` the array of the indices of the ``k`` nearest
+        HRTFs, nearest first. All the coordinates of the spatial index
+        should be given (the azimuth and elevation if the set is spherical).
+        '''
+        distances, indices = self.query(k, kwds)
+        if k==1:
+            return indices[0]
+        return indices
+
+    def interpolate(self, k=3, **kwds):
+        '''
+        Returns an :class:`HRTF` for the coordinates specified by keyword,
+        whose impulse responses are the average of those of the ``k``
+        nearest HRTFs weighted by the inverse of their distance. The
+        measured HRTF is returned if there is one at these coordinates.
+        Recently interpolated HRTFs are cached (see "Spatial index" above).
+        '''
+        key = (k,)+tuple(sorted(kwds.items()))
+        cache = self.interpolation_cache
+        if key in cache:
+            hrtf = cache.pop(key)
+        else:
+            distances, indices = self.query(k, kwds)
+            if distances[0]<1e-10:
+                hrtf = self.hrtf[indices[0]]
+            else:
+                weights = 1/distances
+                weights /= sum(weights)
+                hrir = dot(weights, self.data[:, indices, :].transpose((1, 0, 2)).reshape((len(indices), -1)))
+                hrir = hrir.reshape((2, self.num_samples))
+                hrtf = HRTF(Sound(hrir[0], samplerate=self.samplerate),
+                            Sound(hrir[1], samplerate=self.samplerate))
+        cache[key] = hrtf
+        while len(cache)>self.interpolation_cache_size:
+            cache.popitem(last=False)
+        return hrtf
     
     def __call__(self, **kwds):
         return self.hrtf[self.get_index(**kwds)]
@@ -219,6 +323,7 @@ class HRTFSet(object):
         obj.hrtf = hrtf
         obj.coordinates = coords
         obj.data = data
+        obj.build_index()
         return obj
     
     def __len__(self):
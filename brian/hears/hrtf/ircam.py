@@ -3,8 +3,10 @@ from scipy.io import loadmat # NOTE: this requires scipy 0.7+
 from glob import glob
 from copy import copy
 from scipy.io.wavfile import *
-import os, re
+import os, re, tempfile
+import numpy
 from hrtf import *
+from ..sounds import Sound
 
 __all__ = ['IRCAM_LISTEN']
 
@@ -24,7 +26,11 @@ class IRCAM_LISTEN(HRTFDatabase):
         Whether to use the raw or compensated impulse responses.
     ``samplerate=None``
         If specified, you can resample the impulse responses to a different
-        samplerate, otherwise uses the default 44.1 kHz.
+        samplerate, otherwise uses the default 44.1 kHz. The resampled impulse
+        responses are scaled so that the filters have the same gain.
+    ``cachedir=None``
+        If specified, a directory where the subjects are stored in a binary
+        format after they have been loaded for the first time (see below).
     
     The coordinates are pairs ``(azim, elev)`` where ``azim`` ranges from 0
     to 345 degrees in steps of 15 degrees, and elev ranges from -45 to 90 in
@@ -36,8 +42,23 @@ class IRCAM_LISTEN(HRTFDatabase):
     `here <http://recherche.ircam.fr/equipes/salles/listen/download.html>`__.
     Each subject archive should be extracted to a folder (e.g. IRCAM) with the
     names of the subject, e.g. IRCAM/IRC_1002, etc.
+    
+    **Binary cache**
+    
+    Reading the MATLAB files of a subject (and resampling the impulse
+    responses) takes much longer than using them. If ``cachedir`` is
+    specified, each subject is converted once into ``.npy`` files in that
+    directory, named from the subject, the type of impulse responses and the
+    samplerate, e.g. ``IRC_1002_R_44100_hrir.npy`` (the impulse responses,
+    which are memory mapped when they are loaded) and
+    ``IRC_1002_R_44100_coordinates.npy``. Later calls of
+    :meth:`load_subject`, including in other scripts, read these files
+    instead. The impulse responses at a different samplerate are computed from
+    the cached ones at the samplerate of the database, and cached as well.
+    The MATLAB files are not needed for the subjects that are in the cache.
     '''
-    def __init__(self, basedir, compensated=False, samplerate=None):
+    def __init__(self, basedir, compensated=False, samplerate=None,
+                 cachedir=None):
         if not isinstance(basedir, (list, tuple)):
             basedir = [basedir]
         self.basedir = basedir
@@ -50,13 +71,10 @@ class IRCAM_LISTEN(HRTFDatabase):
         p = re.compile('IRC_\d{4,4}')
         self.subjects = [int(name[4:8]) for base, name in splitnames 
                          if not (p.match(name[-8:]) is None)]
-        if samplerate is not None:
-            raise ValueError('Custom samplerate not supported.')
         self.samplerate = samplerate
+        self.cachedir = cachedir
 
     def load_subject(self, subject, rounddot5 = False):
-
-
         subject = str(subject)
         if subject[0] == '3':
             # this is the case only for stuffed animals recordings
@@ -64,6 +82,90 @@ class IRCAM_LISTEN(HRTFDatabase):
             samplerate = 192*kHz
         else:
             samplerate = 44.1*kHz
+        target_samplerate = samplerate
+        if self.samplerate is not None:
+            target_samplerate = self.samplerate
+        cached = self.load_cached(subject, target_samplerate, rounddot5)
+        if cached is None:
+            cached = self.load_cached(subject, samplerate, rounddot5)
+            if cached is None:
+                cached = self.read_subject(subject, rounddot5)
+                self.save_cached(subject, samplerate, rounddot5, *cached)
+            if int(rint(target_samplerate))!=int(rint(samplerate)):
+                data, coords = cached
+                num_indices, length = data.shape[1:]
+                hrir = Sound(reshape(data, (2*num_indices, length)).T,
+                             samplerate=samplerate).resample(target_samplerate)
+                # the impulse responses are scaled so that the filters keep
+                # the same gain with the new number of samples
+                hrir = asarray(hrir)*(float(samplerate)/float(target_samplerate))
+                data = reshape(hrir.T, (2, num_indices, -1))
+                cached = (data, coords)
+                self.save_cached(subject, target_samplerate, rounddot5, *cached)
+        data, coords = cached
+        hrtfset = HRTFSet(data, target_samplerate, coords, spherical=('azim', 'elev'))
+        hrtfset.name = 'IRCAM_'+subject
+        return hrtfset
+
+    def cache_filename(self, subject, samplerate, rounddot5, name):
+        if self.compensated:
+            kind = 'C'
+        else:
+            kind = 'R'
+        filename = 'IRC_%s_%s_%d' % (subject, kind, int(rint(samplerate)))
+        if rounddot5:
+            filename += '_rounddot5'
+        return os.path.join(self.cachedir, filename+'_'+name+'.npy')
+
+    def load_cached(self, subject, samplerate, rounddot5):
+        '''
+        Returns the impulse responses (memory mapped) and coordinates of the
+        subject from the cache, or None.
+        '''
+        if self.cachedir is None:
+            return None
+        hrir_filename = self.cache_filename(subject, samplerate, rounddot5, 'hrir')
+        coords_filename = self.cache_filename(subject, samplerate, rounddot5, 'coordinates')
+        if not (os.path.exists(hrir_filename) and os.path.exists(coords_filename)):
+            return None
+        try:
+            coords = numpy.load(coords_filename)
+            data = numpy.load(hrir_filename, mmap_mode='r')
+        except (IOError, ValueError):
+            log_warn('brian.hears', 'Cannot read cached HRTFs '+hrir_filename)
+            return None
+        return data, coords
+
+    def save_cached(self, subject, samplerate, rounddot5, data, coords):
+        '''
+        Stores the impulse responses and coordinates in the cache. The files
+        are written under temporary names and then renamed, so that other
+        processes never read incomplete files.
+        '''
+        if self.cachedir is None:
+            return
+        try:
+            if not os.path.isdir(self.cachedir):
+                os.makedirs(self.cachedir)
+            # the coordinates are written first because the cache is only
+            # used when the impulse responses exist
+            for name, x in [('coordinates', coords), ('hrir', data)]:
+                fd, tmpname = tempfile.mkstemp(suffix='.npy', dir=self.cachedir)
+                f = os.fdopen(fd, 'wb')
+                try:
+                    numpy.save(f, x)
+                finally:
+                    f.close()
+                os.rename(tmpname, self.cache_filename(subject, samplerate,
+                                                       rounddot5, name))
+        except (IOError, OSError):
+            log_warn('brian.hears', 'Cannot write cached HRTFs in '+self.cachedir)
+
+    def read_subject(self, subject, rounddot5):
+        '''
+        Returns the impulse responses and coordinates of the subject from the
+        MATLAB files.
+        '''
         ok = False
         k = 0
         while k < len(self.basedir) and not ok:
@@ -106,6 +208,4 @@ class IRCAM_LISTEN(HRTFDatabase):
         r = r['content_m'][0][0]
         # self.data has shape (num_ears=2, num_indices, hrir_length)
         data = vstack((reshape(l, (1,) + l.shape), reshape(r, (1,) + r.shape)))
-        hrtfset = HRTFSet(data, samplerate, coords)
-        hrtfset.name = 'IRCAM_'+subject
-        return hrtfset
+        return data, coords
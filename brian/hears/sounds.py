@@ -4,6 +4,7 @@ import numpy
 import array as pyarray
 import time
 import struct
+import os
 try:
     import pygame
     have_pygame = True
@@ -20,7 +21,7 @@ from db import dB, dB_type, dB_error, gain
 from scipy.signal import fftconvolve, lfilter
 from scipy.misc import factorial
 
-__all__ = ['BaseSound', 'Sound',
+__all__ = ['BaseSound', 'Sound', 'LazySound',
            'pinknoise','brownnoise','powerlawnoise',
            'whitenoise', 'irns', 'irno', 
            'tone', 'click', 'clicks', 'silence', 'sequence', 'harmoniccomplex',
@@ -157,6 +158,13 @@ class Sound(BaseSound, numpy.ndarray):
             if duration is not None:
                 raise ValueError('Cannot specify duration when initialising Sound with array.')
             x = array(data, dtype=float)
+        elif isinstance(data, LazySound):
+            if duration is not None:
+                raise ValueError('Cannot specify duration when initialising Sound with LazySound.')
+            if samplerate is not None:
+                raise ValueError('Cannot specify samplerate when initialising Sound with LazySound.')
+            x = data.read()
+            samplerate = data.samplerate
         elif isinstance(data, str):
             if duration is not None:
                 raise ValueError('Cannot specify duration when initialising Sound from file.')
@@ -425,9 +433,14 @@ class Sound(BaseSound, numpy.ndarray):
     def resample(self, samplerate, resample_type='sinc_best'):
         '''
         Returns a resampled version of the sound.
+        
+        The scikits.samplerate package is used if it is installed, otherwise
+        the sound is resampled with a :class:`ResampleFilterbank`.
         '''
         if not have_scikits_samplerate:
-            raise ImportError('Need scikits.samplerate package for resampling')
+            from filtering.resamplefilterbank import ResampleFilterbank
+            fb = ResampleFilterbank(self, samplerate)
+            return Sound(fb.process(buffersize=4096), samplerate=samplerate)
         y = array(resample(self, float(samplerate / self.samplerate), resample_type),
                   dtype=float64)
         return Sound(y, samplerate=samplerate)
@@ -1091,33 +1104,19 @@ class Sound(BaseSound, numpy.ndarray):
         w.close()
     
     @staticmethod
-    def load(filename):
+    def load(filename, mmap=False):
         '''
         Load the file given by filename and returns a Sound object. 
         Sound file can be either a .wav or a .aif file.
-        '''
-        ext = filename.split('.')[-1].lower()
-        if ext=='wav':
-            import wave as sndmodule
-        elif ext=='aif' or ext=='aiff':
-            import aifc as sndmodule
-        else:
-            raise NotImplementedError('Can only load aif or wav soundfiles')
-        wav = sndmodule.open(filename, "r")
-        nchannels, sampwidth, framerate, nframes, comptype, compname = wav.getparams()
-        frames = wav.readframes(nframes * nchannels)
-        typecode = {2:'h', 1:'B'}[sampwidth]
-        out = frombuffer(frames, dtype=dtype(typecode))
-        scale = {2:2 ** 15, 1:2 ** 7-1}[sampwidth]
-        meanval = {2:0, 1:2**7}[sampwidth]
-        
-        data = zeros((nframes, nchannels))
-        for i in range(nchannels):
-            data[:, i] = out[i::nchannels]
-            data[:, i] /= scale
-            data[:, i] -= meanval
         
-        return Sound(data, samplerate=framerate*Hz)
+        If ``mmap=True``, the samples are not read into memory but a
+        :class:`LazySound` is returned, which reads them from the file as
+        they are needed.
+        '''
+        sound = LazySound(filename)
+        if mmap:
+            return sound
+        return Sound(sound)
 
     def __repr__(self):
         arrayrep = repr(asarray(self))
@@ -1136,6 +1135,295 @@ class Sound(BaseSound, numpy.ndarray):
 def _load_Sound_from_pickle(arr, samplerate):
     return Sound(arr, samplerate=samplerate*Hz)
 
+
+class LazySound(BaseSound):
+    '''
+    Sound whose samples are stored in a file and read from the disk as they
+    are needed, for sounds too long to be loaded into memory.
+    
+    The file is mapped into memory with ``numpy.memmap``, and the samples are
+    only converted to floats, one buffer at a time, when a filterbank fetches
+    them, so that the memory used does not depend on the duration of the
+    sound. For example::
+    
+        sound = LazySound('recording.wav')
+        fb = Gammatone(sound[10*second:20*second], cf)
+        
+    **Initialisation**
+    
+    ``data``
+        Either a filename, or an array of shape ``(nsamples, nchannels)``
+        (typically a ``numpy.memmap``). WAV and AIFF files are recognised by
+        their extension, any other file is read as raw PCM data with the
+        given ``nchannels``, ``dtype`` and ``offset``. The samples of a WAV or
+        AIFF file are read into memory if they cannot be mapped (for example
+        if the file is shorter than its header says).
+    ``samplerate=None``
+        The samplerate, for raw PCM data or arrays (the default samplerate
+        is used if it is not specified).
+    ``nchannels=1``, ``dtype='int16'``, ``offset=0``
+        The number of interleaved channels, the type of the samples and the
+        position in bytes of the first sample, for raw PCM data.
+    
+    Integer samples are scaled to the range -1 to 1 in the same way as
+    :meth:`Sound.load`, floating point samples are left unchanged.
+    
+    **Slicing**
+    
+    Slicing works as for :class:`Sound` (with times or samples), except that
+    slices are not zero padded, and returns a new :class:`LazySound` which
+    shares the file with the original one. Selecting channels with an int or
+    a slice does not read any data, e.g. ``sound[:, 0]`` or
+    ``sound[1*second:2*second, :2]``. A :class:`LazySound` (or a slice of it)
+    can be read into memory with ``Sound(sound)`` or :meth:`read`.
+    
+    **Properties**
+    
+    .. autoattribute:: duration
+    .. autoattribute:: nsamples
+    .. autoattribute:: nchannels
+    .. autoattribute:: left
+    .. autoattribute:: right
+    .. automethod:: channel
+    .. automethod:: read
+    .. automethod:: resample
+    '''
+    duration = property(fget=lambda self:len(self) / self.samplerate,
+                        doc='The length of the sound in seconds.')
+    nsamples = property(fget=lambda self:len(self),
+                        doc='The number of samples in the sound.')
+    nchannels = property(fget=lambda self:self.data.shape[1],
+                         doc='The number of channels in the sound.')
+    left = property(fget=lambda self:self.channel(0),
+                    doc='The left channel for a stereo sound.')
+    right = property(fget=lambda self:self.channel(1),
+                     doc='The right channel for a stereo sound.')
+
+    @check_units(samplerate=Hz)
+    def __init__(self, data, samplerate=None, nchannels=1, dtype='int16',
+                 offset=0):
+        if isinstance(data, str):
+            ext = data.split('.')[-1].lower()
+            if ext in ('wav', 'aif', 'aiff'):
+                if samplerate is not None:
+                    raise ValueError('Cannot specify samplerate when initialising LazySound from a sound file.')
+                offset, dtype, nchannels, nsamples, samplerate = _sound_file_params(data)
+            else:
+                samplerate = get_samplerate(samplerate)
+                dtype = numpy.dtype(dtype)
+                nsamples = (os.path.getsize(data)-offset)//(dtype.itemsize*nchannels)
+            if offset is None:
+                # the samples could not be found in the file, they are read
+                # into memory
+                data = _read_sound_file(data, dtype, nchannels, nsamples)
+            elif nsamples>0:
+                data = numpy.memmap(data, dtype=dtype, mode='r', offset=offset,
+                                    shape=(nsamples, nchannels))
+            else:
+                data = zeros((0, nchannels), dtype=dtype)
+        elif isinstance(data, numpy.ndarray):
+            samplerate = get_samplerate(samplerate)
+            if data.ndim==1:
+                data = data.reshape((len(data), 1))
+        else:
+            raise TypeError('Cannot initialise LazySound with data of class ' + str(data.__class__))
+        self.data = data
+        self.samplerate = samplerate
+        if data.dtype.kind=='u':
+            self.scale = 2**(8*data.dtype.itemsize-1)-1
+            self.meanval = 2**(8*data.dtype.itemsize-1)
+        elif data.dtype.kind=='i':
+            self.scale = 2**(8*data.dtype.itemsize-1)
+            self.meanval = 0
+        else:
+            self.scale = 1
+            self.meanval = 0
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def read(self, start=0, end=None, out=None):
+        '''
+        Returns the samples ``start:end`` (by default all of them) as an
+        array of floats, written in ``out`` if it is specified.
+        '''
+        x = self.data[start:end]
+        if out is None:
+            out = empty(x.shape)
+        out[:] = x
+        if self.meanval:
+            out -= self.meanval
+        if self.scale!=1:
+            out /= self.scale
+        return out
+
+    def buffer_init(self):
+        pass
+
+    def buffer_fetch(self, start, end):
+        if start<0:
+            raise IndexError('Can only use positive indices in buffer.')
+        output = self.buffer_output(end-start)
+        n = max(min(end, len(self))-start, 0)
+        self.read(start, start+n, output[:n])
+        output[n:] = 0
+        return output
+
+    def channel(self, n):
+        '''
+        Returns the nth channel of the sound.
+        '''
+        return self[:, n]
+
+    @check_units(samplerate=Hz)
+    def resample(self, samplerate, **kwds):
+        '''
+        Returns a :class:`ResampleFilterbank` which resamples the sound as it
+        is read, with the keyword arguments of :class:`ResampleFilterbank`.
+        '''
+        from filtering.resamplefilterbank import ResampleFilterbank
+        return ResampleFilterbank(self, samplerate, **kwds)
+
+    def __getitem__(self, key):
+        channel = slice(None)
+        if isinstance(key, tuple):
+            channel = key[1]
+            key = key[0]
+
+        if isinstance(key, float):
+            key = int(round(key*self.samplerate))
+        if isinstance(key, int):
+            return self.read(key, key+1 or None)[0, channel]
+        if isinstance(channel, int):
+            # keep the array two-dimensional without copying it
+            channel = slice(channel, channel+1 or None)
+
+        sliceattr = [v for v in [key.start, key.stop] if v is not None]
+        attrisint = array([isinstance(v, int) for v in sliceattr])
+        s = sum(attrisint)
+        if s!=0 and s!=len(sliceattr):
+            raise ValueError('Slice attributes must be all ints or all times')
+        start, stop, step = key.start, key.stop, key.step or 1
+        if s!=len(sliceattr):
+            slicedims = array([units.have_same_dimensions(flag, second) for flag in sliceattr])
+            if not slicedims.all():
+                raise DimensionMismatchError('Slicing',
+                                             *[units.get_unit(d) for d in sliceattr])
+            if int(step)!=step:
+                #resampling
+                raise NotImplementedError
+            if start is not None:
+                start = int(rint(start*self.samplerate))
+            if stop is not None:
+                stop = int(rint(stop*self.samplerate))
+        return LazySound(self.data[start:stop:int(step), channel],
+                         samplerate=self.samplerate)
+
+    def __repr__(self):
+        return 'LazySound(%s, %s)' % (repr(self.data), repr(self.samplerate))
+
+    def __str__(self):
+        return 'LazySound duration %s, channels %s, samplerate %s' % (self.duration,
+                                                                      self.nchannels,
+                                                                      self.samplerate)
+
+
+def _sound_file_params(filename):
+    '''
+    Returns ``(offset, dtype, nchannels, nsamples, samplerate)`` for the
+    samples of a WAV or AIFF file, where ``offset`` is the position in bytes
+    of the first sample in the file, or ``None`` if the samples could not be
+    found in the file (see :func:`_sound_file_offset`).
+    '''
+    ext = filename.split('.')[-1].lower()
+    if ext=='wav':
+        import wave as sndmodule
+    elif ext=='aif' or ext=='aiff':
+        import aifc as sndmodule
+    else:
+        raise NotImplementedError('Can only load aif or wav soundfiles')
+    f = sndmodule.open(filename, 'r')
+    try:
+        nchannels, sampwidth, framerate, nframes, comptype, compname = f.getparams()
+        if comptype!='NONE':
+            raise NotImplementedError('Cannot load compressed soundfiles')
+        if ext=='wav':
+            # 8 bit WAV samples are unsigned, the others are signed
+            typecode = {1:'u1', 2:'<i2', 4:'<i4'}[sampwidth]
+        else:
+            # AIFF samples are big endian
+            typecode = {1:'i1', 2:'>i2', 4:'>i4'}[sampwidth]
+    finally:
+        f.close()
+    offset = _sound_file_offset(filename, ext)
+    # the samples must fit in the file
+    if (offset is not None and
+            offset+nframes*nchannels*sampwidth>os.path.getsize(filename)):
+        offset = None
+    return offset, numpy.dtype(typecode), nchannels, nframes, framerate*Hz
+
+
+def _sound_file_offset(filename, ext):
+    '''
+    Returns the position in bytes of the first sample of a WAV or AIFF file,
+    found from the headers of the chunks of the file, or ``None`` if the
+    chunk of samples is not found.
+    
+    The file is a RIFF (WAV, little endian) or FORM (AIFF, big endian) chunk
+    containing a sequence of chunks, each one starting with a 4 character
+    name and its size in bytes (not including the header and the pad byte of
+    chunks of odd size). The samples are in the ``data`` chunk (WAV) or in
+    the ``SSND`` chunk (AIFF), which starts with an offset and a block size
+    before the samples.
+    '''
+    if ext=='wav':
+        form, formtypes, endian, name = 'RIFF', ('WAVE',), '<', 'data'
+    else:
+        form, formtypes, endian, name = 'FORM', ('AIFF', 'AIFC'), '>', 'SSND'
+    f = open(filename, 'rb')
+    try:
+        header = f.read(12)
+        if len(header)<12 or header[:4]!=form or header[8:] not in formtypes:
+            return None
+        while True:
+            header = f.read(8)
+            if len(header)<8:
+                return None
+            size, = struct.unpack(endian+'L', header[4:])
+            if header[:4]==name:
+                if ext=='wav':
+                    return f.tell()
+                header = f.read(8)
+                if len(header)<8:
+                    return None
+                ssnd_offset, blocksize = struct.unpack('>LL', header)
+                return f.tell()+ssnd_offset
+            f.seek(size+(size&1), 1)
+    finally:
+        f.close()
+
+
+def _read_sound_file(filename, dtype, nchannels, nsamples):
+    '''
+    Reads the samples of a WAV or AIFF file into an array of shape
+    ``(nsamples, nchannels)`` with the wave or aifc module, for the files
+    whose samples cannot be mapped into memory (see :class:`LazySound`).
+    '''
+    ext = filename.split('.')[-1].lower()
+    if ext=='wav':
+        import wave as sndmodule
+    else:
+        import aifc as sndmodule
+    f = sndmodule.open(filename, 'r')
+    try:
+        frames = f.readframes(nsamples)
+    finally:
+        f.close()
+    data = frombuffer(frames, dtype=dtype)
+    # the file can be shorter than what its header says
+    return data[:len(data)//nchannels*nchannels].reshape((-1, nchannels))
+
+
 def play(*sounds, **kwds):
     '''
     Plays a sound or sequence of sounds. For example::
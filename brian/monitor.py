@@ -39,14 +39,18 @@ if properly coded.
 '''
 
 __all__ = ['VanRossumMetric','SpikeMonitor', 'PopulationSpikeCounter', 'SpikeCounter', 'FileSpikeMonitor', 'StateMonitor', 'ISIHistogramMonitor', 'Monitor',
-           'PopulationRateMonitor', 'StateSpikeMonitor', 'MultiStateMonitor', 'RecentStateMonitor', 'CoincidenceCounter', 'CoincidenceMatrixCounter', 'StateHistogramMonitor', 'AERSpikeMonitor']
+           'PopulationRateMonitor', 'StateSpikeMonitor', 'MultiStateMonitor', 'RecentStateMonitor',
+           'FileStateMonitor', 'MultiFileStateMonitor', 'CoincidenceCounter', 'CoincidenceMatrixCounter', 'StateHistogramMonitor', 'AERSpikeMonitor']
 
 from units import *
 from connections import Connection, SparseConnectionVector
 from numpy import array, zeros, mean, histogram, linspace, tile, digitize,     \
         copy, ones, rint, exp, arange, convolve, argsort, mod, floor, asarray, \
         maximum, Inf, amin, amax, sort, nonzero, setdiff1d, diag, hstack, resize,\
-         inf, var, tril, empty, float64, array, sum, int32, ceil
+         inf, var, tril, empty, float64, array, sum, int32, ceil, searchsorted,\
+         save, load
+from numpy.lib.format import open_memmap, magic, dtype_to_descr
+from numpy import memmap
 from scipy.spatial.distance import sqeuclidean
 from itertools import repeat, izip
 from clock import guess_clock, EventClock, Clock
@@ -57,14 +61,27 @@ import types
 from operator import isSequenceType
 from tools.statistics import firing_rate
 from neurongroup import NeuronGroup
+from utils.dynamicarray import DynamicArray1D
 import bisect
 from base import *
 from time import time
 import datetime
+import tempfile
+import shutil
+import atexit
+import os
+import struct
+import threading
+import Queue
+import weakref
 try:
     import pylab, matplotlib
 except:
     pass
+try:
+    import h5py
+except ImportError:
+    h5py = None
 
 
 from globalprefs import *
@@ -109,7 +126,9 @@ class SpikeMonitor(Connection, Monitor):
         ``t=M.spiketimes[3]`` gives the spike times for neuron 3.
     ``it``
         Return a tuple ``(i, t)`` where ``i`` and ``t`` are the arrays of spike
-        indices and corresponding spike times (int and float).
+        indices and corresponding spike times (int32 and float64). These
+        arrays are views on the internal storage of the monitor and should
+        not be modified.
 
     For ``M`` a :class:`SpikeMonitor`, you can also write:
     
@@ -122,6 +141,12 @@ class SpikeMonitor(Connection, Monitor):
     To define a custom monitor, either define a subclass and
     rewrite the ``propagate`` method, or pass the monitoring function
     as an argument (``function=myfunction``, with ``def myfunction(spikes):...``)
+    
+    The spikes are stored in two growable arrays of indices and times (see
+    :class:`~brian.utils.dynamicarray.DynamicArray1D`), so that recording
+    large numbers of spikes is cheap in memory. The list of pairs ``spikes``
+    is only created when it is accessed, using ``it`` or ``spiketimes`` is
+    more efficient.
     '''
     # isn't there a units problem here for delay?
     def __init__(self, source, record=True, delay=0, function=None):
@@ -129,7 +154,9 @@ class SpikeMonitor(Connection, Monitor):
         self.source = source # pointer to source group
         self.target = None
         self.nspikes = 0
-        self.spikes = []
+        self._spike_indices = DynamicArray1D(0, dtype=int32)
+        self._spike_times = DynamicArray1D(0, dtype=float64)
+        self._spikes = []
         self.record = record
         self.W = None # should we just remove this variable?
         source.set_max_delay(delay)
@@ -144,7 +171,9 @@ class SpikeMonitor(Connection, Monitor):
         Clears all monitored spikes
         """
         self.nspikes = 0
-        self.spikes = []
+        self._spike_indices = DynamicArray1D(0, dtype=int32)
+        self._spike_times = DynamicArray1D(0, dtype=float64)
+        self._spikes = []
         self._newspikes = True #recreate self._spiketimes on next access
 
     def propagate(self, spikes):
@@ -153,11 +182,16 @@ class SpikeMonitor(Connection, Monitor):
         Overload this function to store or process spikes.
         Default: counts the spikes (variable nspikes)
         '''
-        if len(spikes):
+        n = len(spikes)
+        if n:
             self._newspikes = True
-            self.nspikes += len(spikes)
+            self.nspikes += n
             if self.record:
-                self.spikes += zip(spikes, repeat(self.source.clock.t))
+                start = len(self._spike_indices)
+                self._spike_indices.resize(start + n)
+                self._spike_times.resize(start + n)
+                self._spike_indices.data[start:] = spikes
+                self._spike_times.data[start:] = self.source.clock._t
 
     def origin(self, P, Q):
         '''
@@ -175,22 +209,48 @@ class SpikeMonitor(Connection, Monitor):
     def getspiketimes(self):
         if self._newspikes:
             self._newspikes = False
-            self._spiketimes = {}
-            for i in xrange(len(self.source)):
-                self._spiketimes[i] = []
-            for i, t in self.spikes:
-                self._spiketimes[i].append(float(t))
-            for i in xrange(len(self.source)):
-                self._spiketimes[i] = array(self._spiketimes[i])
+            # a stable sort keeps the spikes of each neuron in time order,
+            # the spike trains are then views on the sorted times
+            i, t = self.it
+            N = len(self.source)
+            order = argsort(i, kind='mergesort')
+            sortedtimes = t[order]
+            bounds = searchsorted(i[order], arange(N + 1))
+            self._spiketimes = dict((j, sortedtimes[bounds[j]:bounds[j + 1]])
+                                    for j in xrange(N))
         return self._spiketimes
     spiketimes = property(fget=getspiketimes)
     
     @property
     def it(self):
-        if len(self.spikes)==0:
-            return array([], dtype=int), array([], dtype=float)
-        i, t = zip(*self.spikes)
-        return array(i, dtype=int), array(t, dtype=float)
+        return self._spike_indices.data, self._spike_times.data
+
+    def getspikes(self):
+        # The list of pairs is only extended with the spikes recorded since
+        # the last access
+        start = len(self._spikes)
+        i, t = self.it
+        if len(i) > start:
+            if isinstance(second, Quantity):
+                times = [Quantity.with_dimensions(x, second.dim)
+                         for x in t[start:]]
+            else:
+                times = t[start:].tolist()
+            self._spikes.extend(izip(i[start:].tolist(), times))
+        return self._spikes
+
+    def setspikes(self, spikes):
+        self._spikes = []
+        if len(spikes):
+            i, t = zip(*spikes)
+        else:
+            i, t = [], []
+        self._spike_indices = DynamicArray1D(len(i), dtype=int32)
+        self._spike_times = DynamicArray1D(len(t), dtype=float64)
+        self._spike_indices[:] = i
+        self._spike_times[:] = t
+        self._newspikes = True
+    spikes = property(fget=getspikes, fset=setspikes)
 
     def __repr__(self):
         repr_str = 'SpikeMonitor(%s, record=%s' % (repr(self.source),
@@ -370,8 +430,11 @@ class StateSpikeMonitor(SpikeMonitor):
         Returns an array of the values of variable ``var`` for the
         whole monitored group, or just for neuron ``i`` if specified.
     '''
+    spikes = None # the tuples are stored in a list rather than in arrays
+
     def __init__(self, source, var):
         SpikeMonitor.__init__(self, source)
+        self.spikes = []
         if isinstance(var, (str, int)) or not isSequenceType(var):
             var = (var,)
         self._varnames = var
@@ -380,8 +443,8 @@ class StateSpikeMonitor(SpikeMonitor):
         self._units = [source.unit(v) for v in var]
 
     def propagate(self, spikes):
+        SpikeMonitor.propagate(self, spikes)
         if len(spikes):
-            self.nspikes += len(spikes)
             recordedstate = [ [ x * u for x in self.source.state_(varname)[spikes]] for varname, u in izip(self._varnames, self._units)]
             # the above line used to be this one:
             # recordedstate = [ [x * u for x in v[spikes]] for v, u in izip(self._vars, self._units) ]
@@ -389,6 +452,10 @@ class StateSpikeMonitor(SpikeMonitor):
             # a = b + c : 1
             self.spikes += zip(spikes, repeat(self.source.clock.t), *recordedstate)
 
+    def reinit(self):
+        SpikeMonitor.reinit(self)
+        self.spikes = []
+
     def __getitem__(self, i):
         return NotImplemented # don't use the version from SpikeMonitor
 
@@ -681,7 +748,7 @@ class StateMonitor(NetworkOperation, Monitor):
     Initialise as::
     
         StateMonitor(P,varname(,record=False)
-            (,when='end)(,timestep=1)(,clock=clock))
+            (,when='end)(,timestep=1)(,clock=clock)(,max_memory=None))
     
     Where:
     
@@ -712,6 +779,19 @@ class StateMonitor(NetworkOperation, Monitor):
         be taken into account, as network updates are done clock by clock.
         Use the ``timestep`` parameter if you need recordings to be made at a
         precise point in the network update step.
+    ``max_memory``
+        If specified, the maximum number of bytes of recorded values to keep
+        in memory. Recorded values are stored in chunks, and finished chunks
+        are written to temporary files on disk (and memory mapped) so that
+        only the chunk currently being filled is held in memory. The files
+        are deleted by ``reinit()`` and when Python exits.
+
+    Recorded values are written in place into preallocated chunks, each
+    large enough to hold the values for the rest of the current run (or
+    as much of it as fits in ``max_memory``), with one row per time step.
+    After a single run, ``values`` is therefore a (transposed) view of the
+    recorded data and no copy is made. After several runs, the chunks are
+    merged the first time ``values`` is accessed.
 
     The :class:`StateMonitor` object has the following properties:
 
@@ -774,12 +854,13 @@ class StateMonitor(NetworkOperation, Monitor):
     var_ = var
     std = property(fget=lambda self:self.var ** .5)
     std_ = std
-    times = property(fget=lambda self:array(self._times))
+    times = property(fget=lambda self:self.gettimes())
     times_ = times
     values = property(fget=lambda self:self.getvalues())
     values_ = values
 
-    def __init__(self, P, varname, clock=None, record=False, timestep=1, when='end'):
+    def __init__(self, P, varname, clock=None, record=False, timestep=1, when='end',
+                 max_memory=None):
         '''
         -- P is the neuron group
         -- varname is the variable name
@@ -795,6 +876,8 @@ class StateMonitor(NetworkOperation, Monitor):
         -- timestep defines how often a recording is made (e.g. if you have a very
            small dt, you might not want to record every value of the variable), it
            is an integer (multiple of the clock dt)
+        -- max_memory is the number of bytes of recorded values to keep in memory,
+           older chunks are spilled to disk
         '''
         NetworkOperation.__init__(self, None, clock=clock, when=when)
         self.record = record
@@ -805,6 +888,8 @@ class StateMonitor(NetworkOperation, Monitor):
         self.timestep = timestep
         self.curtimestep = timestep
         self._values = None
+        self.max_memory = max_memory
+        self._tempdir = None
         self.P = P
         self.varname = varname
         self.N = 0 # number of steps
@@ -824,12 +909,15 @@ class StateMonitor(NetworkOperation, Monitor):
             self._mu += V
             self._sqr += V * V
         elif self.curtimestep == self.timestep:
-            i = self._recordstep
-            if not isinstance(self.record, bool):
-                self._values.append(V[self.record])
-            elif self.record is True:
-                self._values.append(V.copy())
-            self._times.append(self.clock._t)
+            if self._chunkpos == self._chunksize:
+                self._new_chunk(V.dtype)
+            i = self._chunkpos
+            if self.record is True:
+                self._chunk[i] = V
+            else:
+                self._chunk[i] = V[self.record]
+            self._chunktimes[i] = self.clock._t
+            self._chunkpos += 1
             self._recordstep += 1
         self.curtimestep -= 1
         if self.curtimestep == 0: self.curtimestep = self.timestep
@@ -853,26 +941,133 @@ class StateMonitor(NetworkOperation, Monitor):
         elif self.record is True:
             return self.values[i]
 
-    def getvalues(self):
-        if len(self._values):
-            newvalues = array(self._values)
-            if len(newvalues.shape)==1:
-                newvalues.shape = (1, newvalues.size)
-            else:
-                newvalues = newvalues.T
-            values = hstack((self._values_cache, newvalues))
-            self._values_cache = values
-            self._values = []
+    def _new_chunk(self, dtype):
+        '''
+        Stores the current (full) chunk and allocates a new one, large enough
+        for the recordings of the rest of the run if it fits in ``max_memory``.
+        '''
+        if self._chunk is not None and self._chunkpos > self._chunkmerged:
+            self._store_chunk(self._chunk[self._chunkmerged:],
+                              self._chunktimes[self._chunkmerged:])
+        clock = self.clock
+        steps = int(rint((clock._end - clock._t) / clock._dt))
+        size = (steps + self.timestep - 1) // self.timestep
+        if size < 1: # recording outside of a run
+            size = 16
+        nrecord = len(self.get_record_indices())
+        if self.max_memory is not None and nrecord:
+            rowbytes = nrecord * dtype.itemsize
+            size = max(min(size, int(self.max_memory) // rowbytes), 1)
+        # one row per time step, so that each step is a contiguous write
+        self._chunk = empty((size, nrecord), dtype=dtype)
+        self._chunktimes = empty(size)
+        self._chunksize = size
+        self._chunkpos = self._chunkmerged = 0
+
+    def _store_chunk(self, values, times):
+        '''
+        Appends a finished chunk to the list of chunks, writing it to disk if
+        ``max_memory`` is set.
+        '''
+        if self.max_memory is not None:
+            fname = self._tempfile()
+            save(fname, values)
+            values = load(fname, mmap_mode='r+')
+        self._chunks.append((values, times))
+
+    def _tempfile(self):
+        if self._tempdir is None:
+            self._tempdir = tempfile.mkdtemp(prefix='brian_statemonitor_')
+            atexit.register(shutil.rmtree, self._tempdir, True)
+        self._nfiles += 1
+        return os.path.join(self._tempdir, 'chunk%d.npy' % self._nfiles)
+
+    def _get_chunks(self):
+        chunks = self._chunks
+        if self._chunkpos > self._chunkmerged:
+            chunks = chunks + [(self._chunk[self._chunkmerged:self._chunkpos],
+                                self._chunktimes[self._chunkmerged:self._chunkpos])]
+        return chunks
+
+    def _merge_chunks(self):
+        '''
+        Merges all the recorded chunks (including the current one) into a
+        single chunk, on disk if it is larger than ``max_memory``.
+        
+        The chunks are appended to the previously merged ones, in a buffer
+        whose size is doubled when it is full, so that reading the values
+        during a run only copies the new recordings.
+        '''
+        chunks = self._get_chunks()
+        if self._nmerged:
+            values, times = self._merged
+            chunks = chunks[1:]
         else:
-            values = self._values_cache    
-        return values
+            values = times = None
+        nrecord = len(self.get_record_indices())
+        nsteps = self._nmerged + sum(len(t) for _, t in chunks)
+        dtype = chunks[0][0].dtype
+        if values is None or len(values) < nsteps:
+            if values is None:
+                size = nsteps
+            else:
+                size = max(nsteps, 2 * len(values))
+            if self.max_memory is not None and nrecord * size * dtype.itemsize > self.max_memory:
+                newvalues = open_memmap(self._tempfile(), mode='w+',
+                                        dtype=dtype, shape=(size, nrecord))
+            else:
+                newvalues = empty((size, nrecord), dtype=dtype)
+            newtimes = empty(size)
+            if values is not None:
+                newvalues[:self._nmerged] = values[:self._nmerged]
+                newtimes[:self._nmerged] = times[:self._nmerged]
+            values, times = newvalues, newtimes
+        i = self._nmerged
+        for v, t in chunks:
+            values[i:i + len(t)] = v
+            times[i:i + len(t)] = t
+            i += len(t)
+        if isinstance(values, memmap):
+            values.flush()
+        self._merged = (values, times)
+        self._nmerged = nsteps
+        self._chunks = [(values[:nsteps], times[:nsteps])]
+        self._chunkmerged = self._chunkpos
+
+    def getvalues(self):
+        chunks = self._get_chunks()
+        if len(chunks) == 0:
+            return zeros((len(self.get_record_indices()), 0))
+        if len(chunks) > 1:
+            self._merge_chunks()
+            chunks = self._chunks
+        # the chunks have one row per time step
+        return chunks[0][0].T
     getvalues_ = getvalues
 
+    def gettimes(self):
+        chunks = self._get_chunks()
+        if len(chunks) == 0:
+            return zeros(0)
+        if len(chunks) > 1:
+            self._merge_chunks()
+            chunks = self._chunks
+        return chunks[0][1]
+    gettimes_ = gettimes
+
     def reinit(self):
-        self._values = []
-        self._times = []
-        ri = self.get_record_indices()
-        self._values_cache = zeros((len(ri), 0))
+        self._chunks = []
+        self._chunk = None
+        self._chunktimes = None
+        self._chunksize = 0
+        self._chunkpos = 0
+        self._chunkmerged = 0
+        self._merged = None
+        self._nmerged = 0
+        self._nfiles = 0
+        if self._tempdir is not None:
+            shutil.rmtree(self._tempdir, True)
+            self._tempdir = None
         self.N = 0
         self._recordstep = 0
         self._mu = zeros(len(self.P))
@@ -1148,7 +1343,8 @@ class MultiStateMonitor(NetworkOperation):
     ``vars`` is omitted then all the variables of ``G`` will be recorded.
     Any additional keyword argument used to initialise the object will
     be passed to the individual :class:`StateMonitor` objects (e.g. the
-    ``when`` keyword).
+    ``when`` keyword). The ``max_memory`` keyword gives the memory budget
+    for all the variables together, it is split evenly between the monitors.
     
     Methods:
     
@@ -1187,6 +1383,8 @@ class MultiStateMonitor(NetworkOperation):
         if vars is None:
             vars = [name for name in G.var_index.keys() if isinstance(name, str)]
         self.vars = vars
+        if kwds.get('max_memory', None) is not None and len(vars):
+            kwds['max_memory'] = kwds['max_memory'] // len(vars)
         for varname in vars:
             self.monitors[varname] = StateMonitor(G, varname, clock=clock, **kwds)
         self.contained_objects = self.monitors.values()
@@ -1220,6 +1418,311 @@ class MultiStateMonitor(NetworkOperation):
         pass
 
 
+class _NpyStateFile(object):
+    '''
+    A ``.npy`` file of shape (nsteps, nrecord) written block by block.
+
+    The header has a fixed size so that it can be rewritten in place with the
+    current number of steps.
+    '''
+    header_size = 256
+
+    def __init__(self, filename, dtype, nrecord):
+        self.filename = filename
+        self.dtype = dtype
+        self.nrecord = nrecord
+        self.f = open(filename, 'w+b')
+        self.set_length(0)
+
+    def header(self, nsteps):
+        d = "{'descr': %r, 'fortran_order': False, 'shape': (%d, %d), }" % (
+                dtype_to_descr(self.dtype), nsteps, self.nrecord)
+        prefix = magic(1, 0)
+        d = d.ljust(self.header_size - len(prefix) - 3) + '\n'
+        return prefix + struct.pack('<H', len(d)) + d
+
+    def write(self, values, times):
+        values.tofile(self.f)
+
+    def set_length(self, nsteps):
+        self.f.seek(0)
+        self.f.write(self.header(nsteps))
+        self.f.seek(0, 2)
+        self.f.flush()
+
+    def open_data(self, nsteps):
+        return memmap(self.filename, dtype=self.dtype, mode='r+',
+                      offset=self.header_size, shape=(nsteps, self.nrecord))
+
+    def close(self):
+        self.f.close()
+
+
+class _HDF5StateFile(object):
+    '''
+    An HDF5 file with resizable datasets ``values`` (nsteps, nrecord) and
+    ``times``, written block by block.
+    '''
+    def __init__(self, filename, dtype, nrecord, blocksize):
+        if h5py is None:
+            raise ImportError('h5py is required for HDF5 state monitor files.')
+        self.filename = filename
+        self.f = h5py.File(filename, 'w')
+        self.values = self.f.create_dataset('values', shape=(0, nrecord),
+                                            maxshape=(None, nrecord),
+                                            chunks=(blocksize, max(nrecord, 1)),
+                                            dtype=dtype)
+        self.times = self.f.create_dataset('times', shape=(0,), maxshape=(None,),
+                                           chunks=(blocksize,), dtype=float64)
+
+    def write(self, values, times):
+        n = self.values.shape[0]
+        self.values.resize(n + len(values), axis=0)
+        self.values[n:] = values
+        self.times.resize((n + len(times),))
+        self.times[n:] = times
+
+    def set_length(self, nsteps):
+        self.f.flush()
+
+    def open_data(self, nsteps):
+        if not self.f:
+            # the file was closed, open it again for reading
+            self.f = h5py.File(self.filename, 'r')
+            self.values = self.f['values']
+        return self.values
+
+    def close(self):
+        if self.f:
+            self.f.close()
+
+
+def _state_file_writer(blocks, free, statefile, errors):
+    '''
+    Writes the blocks of recorded values put in the ``blocks`` queue to
+    ``statefile`` and gives the buffers back through the ``free`` queue,
+    until ``None`` is received. Exceptions are stored in ``errors``.
+    '''
+    while True:
+        item = blocks.get()
+        try:
+            if item is None:
+                return
+            values, times, n = item
+            if not errors:
+                statefile.write(values[:n], times[:n])
+        except Exception, e:
+            errors.append(e)
+        finally:
+            if item is not None:
+                free.put((values, times))
+            blocks.task_done()
+
+
+def _close_file_monitor(ref):
+    monitor = ref()
+    if monitor is not None:
+        monitor.close()
+
+
+class FileStateMonitor(StateMonitor):
+    '''
+    Records the values of a state variable to a file
+
+    Initialised as::
+
+        FileStateMonitor(P, varname, filename[, record=True[, format='npy'
+                         [, buffersize=8*1024**2]]])
+
+    with the additional keywords ``clock``, ``timestep`` and ``when`` of a
+    :class:`StateMonitor`. Recorded values are stored in memory blocks of
+    ``buffersize`` bytes, which are written to the file ``filename`` by a
+    background thread while the simulation goes on, so that the memory used
+    does not grow with the duration of the run.
+
+    With ``format='npy'``, the file is a Numpy ``.npy`` file containing an
+    array of shape ``(len(M.times), len(record))`` (it can be loaded with
+    ``numpy.load(filename, mmap_mode='r')``). With ``format='hdf5'`` (which
+    requires the ``h5py`` package), the file has the datasets ``values``,
+    with the same shape, and ``times``.
+
+    Has the same attributes as a :class:`StateMonitor`, and:
+
+    ``data``
+        The recorded values, as an array of shape (number of recordings,
+        number of recorded neurons). For the ``.npy`` format, this is a
+        ``numpy.memmap`` of the file, so that only the parts you use are
+        loaded; for the HDF5 format, this is an ``h5py`` dataset.
+    ``values``
+        Is ``data.T`` (for the HDF5 format, this loads all the values).
+
+    Methods:
+
+    ``flush()``
+        Writes all the values recorded so far to the file.
+    ``close()``
+        Writes all the values and closes the file (will happen automatically
+        when the program ends).
+    '''
+    def __init__(self, P, varname, filename, record=True, format='npy',
+                 buffersize=8 * 1024 ** 2, clock=None, timestep=1, when='end'):
+        if record is False:
+            raise ValueError('FileStateMonitor needs record=True or a list of neurons.')
+        if format not in ('npy', 'hdf5'):
+            raise ValueError("Unknown format " + str(format) + ", should be 'npy' or 'hdf5'.")
+        self.filename = filename
+        self.format = format
+        self.buffersize = buffersize
+        self._file = None
+        self._thread = None
+        StateMonitor.__init__(self, P, varname, clock=clock, record=record,
+                              timestep=timestep, when=when)
+        atexit.register(_close_file_monitor, weakref.ref(self))
+
+    def __call__(self):
+        if self.curtimestep == self.timestep:
+            V = self.P.state_(self.varname)
+            i = self._blockpos
+            if self.record is True:
+                self._block[i] = V
+            else:
+                self._block[i] = V[self.record]
+            self._blocktimes[i] = self.clock._t
+            self._blockpos += 1
+            if self._blockpos == self._blocksize:
+                self._send_block()
+            self._recordstep += 1
+        self.curtimestep -= 1
+        if self.curtimestep == 0: self.curtimestep = self.timestep
+        self.N += 1
+
+    def _check_errors(self):
+        if self._errors:
+            raise self._errors[0]
+
+    def _send_block(self):
+        '''
+        Passes the current block to the writer thread and takes a free one.
+        '''
+        if self._thread is None:
+            raise IOError('File ' + self.filename + ' is closed.')
+        self._check_errors()
+        n = self._blockpos
+        self._times.resize(self._nrecorded + n)
+        self._times[self._nrecorded:] = self._blocktimes[:n]
+        self._nrecorded += n
+        self._blocks.put((self._block, self._blocktimes, n))
+        self._block, self._blocktimes = self._free.get()
+        self._blockpos = 0
+
+    def flush(self):
+        if self._thread is None:
+            return
+        if self._blockpos:
+            self._send_block()
+        self._blocks.join()
+        self._check_errors()
+        self._file.set_length(self._nrecorded)
+
+    def close(self):
+        if self._thread is None:
+            return
+        self.flush()
+        self._blocks.put(None)
+        self._thread.join()
+        self._thread = None
+        self._file.close()
+
+    def getdata(self):
+        self.flush()
+        if self._nrecorded == 0:
+            return zeros((0, len(self.get_record_indices())))
+        if self._data is None or len(self._data) != self._nrecorded:
+            self._data = self._file.open_data(self._nrecorded)
+        return self._data
+
+    data = property(fget=getdata)
+
+    def getvalues(self):
+        data = self.getdata()
+        if self.format == 'hdf5' and self._nrecorded:
+            data = data[...]
+        return data.T
+    getvalues_ = getvalues
+
+    def gettimes(self):
+        self.flush()
+        return self._times.data
+    gettimes_ = gettimes
+
+    def reinit(self):
+        StateMonitor.reinit(self)
+        self.close()
+        self._data = None
+        dtype = self.P.state_(self.varname).dtype
+        nrecord = len(self.get_record_indices())
+        rows = max(int(self.buffersize) // (nrecord * dtype.itemsize), 1)
+        if self.format == 'npy':
+            self._file = _NpyStateFile(self.filename, dtype, nrecord)
+        else:
+            self._file = _HDF5StateFile(self.filename, dtype, nrecord, rows)
+        self._times = DynamicArray1D(0)
+        self._nrecorded = 0
+        self._errors = []
+        # two buffers: one is being filled while the other one is written
+        self._blocks = Queue.Queue()
+        self._free = Queue.Queue()
+        for _ in range(2):
+            self._free.put((empty((rows, nrecord), dtype=dtype), empty(rows)))
+        self._block, self._blocktimes = self._free.get()
+        self._blocksize = rows
+        self._blockpos = 0
+        self._thread = threading.Thread(target=_state_file_writer,
+                                        args=(self._blocks, self._free,
+                                              self._file, self._errors))
+        self._thread.daemon = True
+        self._thread.start()
+
+
+class MultiFileStateMonitor(MultiStateMonitor):
+    '''
+    Records multiple state variables of a group to files
+
+    Works like :class:`MultiStateMonitor` with :class:`FileStateMonitor`
+    objects. Initialised with a group ``G``, a file name ``filename`` and
+    optionally a list of variables ``vars``. The values of variable ``x`` are
+    written to a file named by adding ``_x`` to ``filename`` before the
+    extension, for example ``rec_V.npy`` for ``filename='rec.npy'``. Additional
+    keywords (e.g. ``format``, ``record``) are passed to the individual
+    :class:`FileStateMonitor` objects.
+
+    Has the methods ``flush()`` and ``close()`` which are called on all the
+    monitors.
+    '''
+    def __init__(self, G, filename, vars=None, clock=None, **kwds):
+        NetworkOperation.__init__(self, lambda : None, clock=clock)
+        self.monitors = {}
+        if vars is None:
+            vars = [name for name in G.var_index.keys() if isinstance(name, str)]
+        self.vars = vars
+        root, ext = os.path.splitext(filename)
+        self.filenames = {}
+        for varname in vars:
+            self.filenames[varname] = root + '_' + varname + ext
+            self.monitors[varname] = FileStateMonitor(G, varname,
+                                                      self.filenames[varname],
+                                                      clock=clock, **kwds)
+        self.contained_objects = self.monitors.values()
+
+    def flush(self):
+        for m in self.monitors.itervalues():
+            m.flush()
+
+    def close(self):
+        for m in self.monitors.itervalues():
+            m.close()
+
+
 class CoincidenceCounter(SpikeCounter):
     """
     Coincidence counter class.
@@ -1430,7 +1933,7 @@ class VanRossumMetric(StateMonitor):
             distance_matrix=zeros((nbr_neurons,nbr_neurons),dtype=float64)
             nbr_time_step=int(len(self[0]))
             dt=float(self.dt)
-            traces=self.values
+            traces=self.values.T # one row per time step, C-contiguous
             tau=float(self.tau)
             
             code='''
@@ -1439,9 +1942,9 @@ class VanRossumMetric(StateMonitor):
                 for(int k2=0;k2<k1;k2++)
                 {
                     double &dm = distance_matrix[k1*nbr_neurons+k2];
-                    double *tr1 = traces+k1*nbr_time_step;
-                    double *tr2 = traces+k2*nbr_time_step;
-                    for(int istep=0;istep<nbr_time_step;istep++, tr1++, tr2++)
+                    double *tr1 = traces+k1;
+                    double *tr2 = traces+k2;
+                    for(int istep=0;istep<nbr_time_step;istep++, tr1+=nbr_neurons, tr2+=nbr_neurons)
                     {
                         double diff = *tr1-*tr2;
                         dm += diff*diff; 
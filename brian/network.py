@@ -42,10 +42,13 @@ from operator import isSequenceType
 from inspect import *
  
 from brian.base import *
-from brian.clock import guess_clock, Clock
+from brian.clock import guess_clock, Clock, ClockScheduler
 from brian.connections import *
 from brian.globalprefs import *
 from brian.neurongroup import NeuronGroup
+from brian.stateupdater import LinearStateUpdater, FusedLinearStateUpdater, \
+                              LazyStateUpdater
+from brian.log import log_info, log_warn
 from brian.units import second
 from brian.utils.progressreporting import *
 
@@ -58,6 +61,16 @@ __all__ = ['Network', 'MagicNetwork', 'NetworkOperation', 'network_operation', '
 
 globally_stopped = False
 
+define_global_preference(
+    'usefusedschedule', 'False',
+    desc="""
+         Whether networks should use the fused update schedule by default,
+         where neuron groups with the same clock and the same linear model
+         are updated together in one vectorised operation (see
+         :meth:`Network.set_fused_schedule`).
+         """)
+set_global_preferences(usefusedschedule=False)
+
 
 class Network(object):
     '''
@@ -96,10 +109,11 @@ class Network(object):
         as initialisation.
     ``remove(...)``
         Remove objects from the Network.
-    ``run(duration[, report[, report_period]])``
+    ``run(duration[, threads[, report[, report_period]]])``
         Runs the network for the given duration. See below for details about
         what happens when you do this. See documentation for :func:`run` for
-        an explanation of the ``report`` and ``report_period`` keywords.
+        an explanation of the ``threads``, ``report`` and ``report_period``
+        keywords.
     ``reinit(states=True)``
         Reinitialises the network, runs each object's ``reinit()`` and each
         clock's ``reinit()`` method (resetting them to 0). If ``states=False``
@@ -136,7 +150,10 @@ class Network(object):
     has run for the given length of time. After each call of the
     ``update()`` method, the clock is advanced by one tick, and if
     multiple clocks are being used, the next clock is determined (this
-    is the clock whose value of ``t`` is minimal amongst all the clocks).
+    is the clock whose value of ``t`` is minimal amongst all the clocks,
+    clocks are kept in a priority queue so that this is cheap even with many
+    clocks, and all clocks with the same ``t`` are updated in turn according
+    to their ``order``).
     For example, if you had two clocks in operation, say ``clock1`` with
     ``dt=3*ms`` and ``clock2`` with ``dt=5*ms`` then this will happen:
     
@@ -188,7 +205,18 @@ class Network(object):
     called relative to this rearrangement). You can also define your own update
     schedule with the ``set_update_schedule`` method (see that method's API documentation for
     details). This might be useful for example if you have a sequence of network
-    operations which need to be run in a given order.    
+    operations which need to be run in a given order.
+    
+    **Fused schedule**
+    
+    Networks with many small groups spend most of their time in the Python
+    calls of the update schedule rather than in numerical work. By calling
+    the ``set_fused_schedule()`` method (or setting the global preference
+    ``usefusedschedule``), the :class:`NeuronGroup` objects that share a
+    clock and have identical linear equations (with exact updates) are
+    integrated together in a single vectorised operation, followed by the
+    threshold of each group. The results are the same as with the standard
+    schedule (up to floating point rounding).
     '''
 
     operations = property(fget=lambda self:self._all_operations)
@@ -197,6 +225,7 @@ class Network(object):
         self.clock = None # Initialized later
         self.groups = []
         self.connections = []
+        self._fused = get_global_preference('usefusedschedule')
         # The following dict keeps a copy of which operations are in which slot
         self._operations_dict = defaultdict(list)
         self._all_operations = []
@@ -214,8 +243,10 @@ class Network(object):
             # calling __init__ again and then adding the previously added
             # objects
             _added_objects = self._added_objects
+            _fused = self._fused
             self.prepared = False
             Network.__init__(self)
+            self._fused = _fused
             for o in _added_objects:
                 self.add(o)
 
@@ -447,6 +478,20 @@ class Network(object):
         self._schedule = schedule
         self._build_update_schedule()
 
+    def set_fused_schedule(self, fused=True):
+        '''
+        Switches the fused update schedule on or off
+        
+        With the fused schedule, the ``groups`` item of the update schedule
+        integrates all the :class:`NeuronGroup` objects that share a clock
+        and have the same linear model together in one vectorised step (see
+        :class:`FusedLinearStateUpdater`), the threshold of each group is
+        then checked as usual. Groups with other state updaters are updated
+        separately.
+        '''
+        self._fused = fused
+        self._build_update_schedule()
+
     def _build_update_schedule(self):
         '''
         Defines what the update step does
@@ -474,6 +519,8 @@ class Network(object):
                     # a circular import
                     objset = [group for group in self.groups
                               if not hasattr(group, 'presynaptic')]
+                    if self._fused:
+                        objset = fuse_groups(objset)
                     objfun = 'update'
                     allclocks = False
                 elif item == 'synapses':
@@ -541,6 +588,36 @@ class Network(object):
         '''
         Runs the simulation for the given duration.
         '''
+        if threads > 1:
+            # groups with their own number of threads are left unchanged
+            groups = [G for G in self.groups
+                      if getattr(G, '_threads', None) == 1]
+            single = [G for G in groups if not G._can_split_threads()]
+            groups = [G for G in groups if G._can_split_threads()]
+            # groups without equations (e.g. PoissonGroup) have nothing to split
+            lazy = [G for G in single
+                    if isinstance(G._state_updater, LazyStateUpdater)]
+            if lazy:
+                log_info('brian.network', describe_groups(lazy) +
+                         ' updated in a single thread')
+            single = [G for G in single
+                      if not isinstance(G._state_updater, LazyStateUpdater)]
+            if single:
+                log_warn('brian.network', 'The state updaters of ' +
+                         describe_groups(single) + ' cannot be split between '
+                         'threads, using a single thread')
+            for G in groups:
+                G.set_threads(threads)
+            if self.prepared:
+                self._build_update_schedule()
+            try:
+                self.run(duration, report=report, report_period=report_period)
+            finally:
+                for G in groups:
+                    G.set_threads(1)
+                if self.prepared:
+                    self._build_update_schedule()
+            return
         global globally_stopped
         self.stopped = False
         globally_stopped = False
@@ -562,25 +639,37 @@ class Network(object):
                 next_report_time = report.next_report_time
 
         if self.clock.still_running() and not self.stopped and not globally_stopped:
-            not_same_clocks = not self.same_clocks()
-            clk = self.clock
-            while clk.still_running() and not self.stopped and not globally_stopped:
-                if report is not None:
-                    cur_time = time.time()
-                    if cur_time > next_report_time:
-                        next_report_time = cur_time + float(report_period)
-                        report.update((self.clock.t - self.clock.start) / duration)
-                self.update()
-                clk.tick()
-                if not_same_clocks:
-                    # Find the next clock to update
-                    #self.clock = min([(clock.t, id(clock), clock) for clock in self.clocks])[2]
-                    clk = self.clock = min(self.clocks)
-                    #heapq.heappush(self.clocks, self.clock)
-                    #clk = self.clock = heapq.heappop(self.clocks)
-                    #clk = self.clock = heapq.heappushpop(self.clocks, self.clock)
-                    #if not clk<self.clocks[0]:
-                    #    clk = self.clock = heapq.heapreplace(self.clocks, self.clock)
+            if self.same_clocks():
+                clk = self.clock
+                while clk.still_running() and not self.stopped and not globally_stopped:
+                    if report is not None:
+                        cur_time = time.time()
+                        if cur_time > next_report_time:
+                            next_report_time = cur_time + float(report_period)
+                            report.update((self.clock.t - self.clock.start) / duration)
+                    self.update()
+                    clk.tick()
+            else:
+                # All clocks due at the same time are taken from the scheduler
+                # in one go and updated in the order given by clock.order
+                scheduler = ClockScheduler(self.clocks)
+                running = True
+                while running:
+                    due = scheduler.pop_due()
+                    for clk in due:
+                        if not clk.still_running() or self.stopped or globally_stopped:
+                            running = False
+                            break
+                        self.clock = clk
+                        if report is not None:
+                            cur_time = time.time()
+                            if cur_time > next_report_time:
+                                next_report_time = cur_time + float(report_period)
+                                report.update((clk.t - clk.start) / duration)
+                        self.update()
+                        clk.tick()
+                    scheduler.push(due)
+                self.clock = scheduler.next_clock()
         if report is not None:
             report.update(1.0)
 
@@ -620,11 +709,7 @@ class Network(object):
         self.clock points to the current clock between considered.
         '''
         self.clocks = list(set([obj.clock for obj in self.groups + self.operations]))
-        #self.clocks.sort(key=lambda c:-c._dt)
-        #heapq.heapify(self.clocks)
-        #self.clock = min([(clock.t, clock) for clock in self.clocks])[1]
         self.clock = min(self.clocks)
-        #self.clock = heapq.heappop(self.clocks)
 
     def __len__(self):
         '''
@@ -677,6 +762,75 @@ class Network(object):
         net._update_schedule = None # remove the problematic element from the copy
         return (unpickle_network, (oldclass, net)) # the unpickle_network function called with arguments oldclass, net restores it as it was
 
+def describe_groups(groups):
+    '''
+    Returns a short description of a list of groups for log messages, e.g.
+    ``'2 PoissonGroup, 1 NeuronGroup'``.
+    '''
+    counts = defaultdict(int)
+    for G in groups:
+        counts[G.__class__.__name__] += 1
+    return ', '.join('%d %s' % (n, name) for name, n in sorted(counts.items()))
+
+def fusion_key(group):
+    '''
+    Returns a key which is the same for groups whose update step can be fused,
+    or ``None`` if the group has to be updated on its own.
+    '''
+    updater = getattr(group, '_state_updater', None)
+    if (updater.__class__ is not LinearStateUpdater or
+        getattr(group, '_owner', None) is not group or
+        getattr(group, '_threads', 1) > 1 or
+        group.__class__.update.im_func is not NeuronGroup.update.im_func):
+        return None
+    key = updater.fusion_key()
+    if key is None:
+        return None
+    return (id(group.clock), key)
+
+
+def fuse_groups(groups):
+    '''
+    Replaces the groups that can be updated together by a
+    :class:`FusedGroupUpdate` object, at the position of the first of these
+    groups. Other groups are returned unchanged.
+    '''
+    objset = []
+    fused = {}
+    for G in groups:
+        key = fusion_key(G)
+        if key is None:
+            objset.append([G])
+        elif key in fused:
+            fused[key].append(G)
+        else:
+            fused[key] = [G]
+            objset.append(fused[key])
+    return [FusedGroupUpdate(obj) if len(obj) > 1 else obj[0]
+            for obj in objset]
+
+
+class FusedGroupUpdate(object):
+    '''
+    Update step of several groups with the same clock and linear model
+    
+    The state variables of all groups are updated with a
+    :class:`FusedLinearStateUpdater`, and then spikes are detected for each
+    group in turn. Used by the fused schedule of :class:`Network`.
+    '''
+    def __init__(self, groups):
+        self.groups = groups
+        self.clock = groups[0].clock
+        self._state_updater = FusedLinearStateUpdater(groups[0]._state_updater,
+                                                      groups)
+        self._spike_updates = [G._update_spikes for G in groups if G._spiking]
+
+    def update(self):
+        self._state_updater()
+        for f in self._spike_updates:
+            f()
+
+
 # This class just used as a general 'heap' class - has no methods but can have attributes
 class NetworkNoMethods(object):
     pass
@@ -905,6 +1059,13 @@ def run(duration, threads=1, report=None, report_period=10 * second):
     
     ``duration``
         the length of time to run the network for.
+    ``threads``
+        Number of threads used to update the state variables of each
+        :class:`NeuronGroup` (see the ``threads`` keyword of
+        :class:`NeuronGroup`). Groups created with their own number of
+        threads keep it. Groups whose state update cannot be split are
+        updated in a single thread, with a warning for those with
+        differential equations (but not e.g. for a :class:`PoissonGroup`).
     ``report``
         How to report progress, the default ``None`` doesn't report the
         progress. Some standard values for ``report``:
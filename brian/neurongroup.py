@@ -63,7 +63,8 @@ from base import *
 from group import *
 from threshold import select_threshold
 from collections import defaultdict
-from log import log_info
+from log import log_info, log_warn
+from multiprocessing.pool import ThreadPool
 
 timedarray = None # ugly hack: import this module when it is needed, can't do it here because of order of imports
 network = None # ugly hack: import this module when it is needed, can't do it here because of order of imports
@@ -124,6 +125,60 @@ def linked_var(source, var=0, func=None, when='start', clock=None):
     return LinkedVar(source, var, func, when, clock)
 
 
+_thread_pools = {}
+
+def get_thread_pool(threads):
+    '''
+    Returns a pool of ``threads`` worker threads
+    
+    The pool is created on the first call and then shared by all the groups
+    updated with the same number of threads.
+    '''
+    if threads not in _thread_pools:
+        _thread_pools[threads] = ThreadPool(threads)
+    return _thread_pools[threads]
+
+
+class GroupShard(object):
+    '''
+    Contiguous range of neurons of a group, updated by a single thread
+    
+    Only has the attributes used by the state updaters: ``_S`` is a view on
+    the columns ``i:j`` of the state matrix of the group, and ``_dS`` is a
+    separate buffer for the derivatives.
+    '''
+    def __init__(self, group, i, j):
+        self.clock = group.clock
+        self.var_index = group.var_index
+        self._S = group._S[:, i:j]
+        self._dS = zeros_like(self._S)
+
+    def __len__(self):
+        return self._S.shape[1]
+
+    def state_(self, name):
+        return self._S[self.var_index[name]]
+    state = state_
+
+
+def shardable_updater(updater):
+    '''
+    Returns the pair ``(updater, noise)`` where ``updater`` is the state
+    updater to apply separately to each :class:`GroupShard` (``None`` if the
+    update cannot be split), and ``noise`` the list of :class:`SynapticNoise`
+    wrappers, which are applied to the whole group afterwards so that the
+    random numbers do not depend on the number of threads.
+    '''
+    noise = []
+    while isinstance(updater, SynapticNoise):
+        noise.insert(0, updater)
+        updater = updater.baseupdater
+    if isinstance(updater, NonlinearStateUpdater) or \
+       (isinstance(updater, LinearStateUpdater) and not updater._useaccel):
+        return updater, noise
+    return None, noise
+
+
 class NeuronGroup(magic.InstanceTracker, ObjectContainer, Group):
     """Group of neurons
     
@@ -196,6 +251,31 @@ class NeuronGroup(magic.InstanceTracker, ObjectContainer, Group):
         keywords).
     ``unit_checking=True``
         Set to ``False`` to bypass unit-checking.
+    ``vectorize_parameters=None``
+        A dictionary ``{name: values}`` to simulate the group for ``K``
+        sets of parameters at once (parameter sweeps). Each ``name`` is an
+        external constant of the equations, which becomes a parameter of
+        the model (see :meth:`Equations.vectorize_parameters`), and
+        ``values`` a sequence of ``K`` values (or a single value, used for
+        all the sets). The group then has ``N*K`` neurons, the neurons
+        ``k*N`` to ``(k+1)*N-1`` using the ``k``-th set of parameters.
+        Connections within a set can be made with :meth:`parameter_set`,
+        and the results of the monitors are split by
+        :meth:`split_parameter_sets`. The vectorized parameters make linear
+        equations nonlinear (e.g. ``tau`` in ``dv/dt=-v/tau``), so for
+        linear equations each set is instead updated exactly with its own
+        update matrix (see :class:`ParameterSetsLinearStateUpdater`), as in
+        separate groups. Nonlinear equations are integrated with the same
+        method as without vectorized parameters.
+    ``threads=1``
+        Number of threads used to update the state variables. With
+        ``threads>1``, the neurons are split into contiguous ranges which
+        are updated in parallel by a shared pool of threads, and the
+        threshold and reset are applied once all of them are done. Only
+        worthwhile for large groups, since numpy releases the GIL only
+        for the array operations. Models whose state updater cannot be
+        split (e.g. compiled with weave or code generation) are updated by
+        a single thread. See also the ``threads`` keyword of :func:`run`.
     
     **Methods**
     
@@ -215,6 +295,25 @@ class NeuronGroup(magic.InstanceTracker, ObjectContainer, Group):
         Sets the neuron state values at rest for their differential
         equations.
 
+    .. method:: set_threads(threads)
+    
+        Sets the number of threads used to update the state variables.
+
+    .. method:: parameter_set(k)
+    
+        Returns the subgroup of neurons using the ``k``-th set of parameters
+        (see the ``vectorize_parameters`` keyword).
+
+    .. method:: split_parameter_sets(M)
+    
+        Splits the results of a monitor of the group into a list with one
+        item for each set of parameters (see the ``vectorize_parameters``
+        keyword), with neuron indices relative to the set. For a
+        :class:`SpikeMonitor` the items are pairs ``(i, t)`` of arrays of
+        neuron indices and spike times, for a :class:`SpikeCounter` arrays
+        of spike counts, and for a :class:`StateMonitor` arrays of recorded
+        values (one row per recorded neuron of the set).
+
     The following usages are also possible for a group ``G``:
     
     ``G[i:j]``
@@ -246,13 +345,15 @@ class NeuronGroup(magic.InstanceTracker, ObjectContainer, Group):
     TODO: details of other methods and properties for people
     wanting to write extensions?
     """
+    _threads = 1
+    _shards = None
 
     @check_units(max_delay=second)
     def __init__(self, N, model=None, threshold=None, reset=NoReset(),
                  init=None, refractory=0 * msecond, level=0,
                  clock=None, order=1, implicit=False, unit_checking=True,
                  max_delay=0 * msecond, compile=False, freeze=False, method=None,
-                 max_refractory=None,
+                 max_refractory=None, vectorize_parameters=None, threads=1,
                  ):#**args): # any reason why **args was included here?
         '''
         Initializes the group.
@@ -272,6 +373,24 @@ class NeuronGroup(magic.InstanceTracker, ObjectContainer, Group):
         # If it is a string, convert to Equations object
         if isinstance(model, (str, list, tuple)):
             model = Equations(model, level=level + 1)
+        elif isinstance(model, Equations) and vectorize_parameters is not None:
+            model = Equations([model]) # copy
+
+        # Parameter sweep
+        self._parameter_sets = 1
+        self._parameter_set_size = N
+        if vectorize_parameters is not None:
+            if not isinstance(model, Equations):
+                raise TypeError("Parameters can only be vectorized for a model given by equations.")
+            for values in vectorize_parameters.itervalues():
+                if isSequenceType(values):
+                    if self._parameter_sets == 1:
+                        self._parameter_sets = len(values)
+                    elif len(values) != self._parameter_sets:
+                        raise ValueError("All parameters must have the same number of values.")
+            original_model = Equations([model]) # copy
+            model.vectorize_parameters(**vectorize_parameters)
+            N = N * self._parameter_sets
 
         if isinstance(threshold, str):
             if isinstance(model, Equations):
@@ -310,6 +429,10 @@ class NeuronGroup(magic.InstanceTracker, ObjectContainer, Group):
                                                                      check_units=unit_checking, implicit=implicit,
                                                                      compile=compile, freeze=freeze,
                                                                      method=method)
+                if vectorize_parameters is not None and method in (None, 'linear'):
+                    self._state_updater = self._linear_parameter_sets_updater(
+                        self._state_updater, var_names, original_model,
+                        vectorize_parameters, clock, unit_checking)
                 Group.__init__(self, model, N, unit_checking=unit_checking)
                 self._all_units = model._units
                 # Converts S0 from dictionary to tuple
@@ -436,6 +559,16 @@ class NeuronGroup(magic.InstanceTracker, ObjectContainer, Group):
         # call mechanism.
         self._spikesarray = zeros(N, dtype=int)
 
+        self.set_threads(threads)
+
+        if vectorize_parameters is not None:
+            for name, values in vectorize_parameters.iteritems():
+                if isSequenceType(values):
+                    values = [float(value) for value in values]
+                else:
+                    values = [float(values)] * self._parameter_sets
+                self.state_(name)[:] = repeat(values, self._parameter_set_size)
+
         # various things for optimising
         self.__t = TArray(zeros(N))
         self._var_array = {}
@@ -465,6 +598,112 @@ class NeuronGroup(magic.InstanceTracker, ObjectContainer, Group):
                     G._max_delay = self._max_delay
                     G.LS = self.LS
 
+    def set_threads(self, threads):
+        '''
+        Sets the number of threads used to update the state variables.
+        '''
+        self._threads = threads
+        self._shards = None
+
+    def _can_split_threads(self):
+        '''
+        Returns True if the state update can be split between threads (see
+        :func:`shardable_updater`).
+        '''
+        return shardable_updater(self._state_updater)[0] is not None
+
+    def _make_shards(self):
+        '''
+        Splits the group into one :class:`GroupShard` per thread, or returns
+        an empty list if the state updater cannot be split.
+        '''
+        updater, noise = shardable_updater(self._state_updater)
+        if updater is None:
+            log_warn('brian.neurongroup',
+                     'State updater ' + repr(self._state_updater) + 
+                     ' cannot be split between threads, using a single thread')
+            return []
+        self._shard_updater = updater
+        self._shard_noise = noise
+        bounds = linspace(0, len(self), self._threads + 1).astype(int)
+        return [GroupShard(self, i, j) for i, j in zip(bounds[:-1], bounds[1:])
+                if j > i]
+
+    def _linear_parameter_sets_updater(self, updater, var_names, eqs,
+                                       parameters, clock, check_units):
+        '''
+        Returns a :class:`ParameterSetsLinearStateUpdater` in place of the
+        state updater ``updater`` of the vectorized equations if the
+        equations ``eqs`` (before the ``parameters`` are vectorized) are
+        linear, so that each set of parameters is integrated exactly as in a
+        separate group. Otherwise returns ``updater``.
+        '''
+        linear_updaters = []
+        for k in range(self._parameter_sets):
+            eqs_k = Equations([eqs])
+            for name, values in parameters.iteritems():
+                if isSequenceType(values):
+                    values = values[k]
+                # Namespaces can be shared with other Equations objects
+                for var, namespace in eqs_k._namespace.items():
+                    namespace = namespace.copy()
+                    namespace[name] = values
+                    eqs_k._namespace[var] = namespace
+            updater_k, vars_k = magic_state_updater(eqs_k, clock=clock,
+                                                    check_units=check_units)
+            while isinstance(updater_k, SynapticNoise):
+                updater_k = updater_k.baseupdater
+            if not isinstance(updater_k, LinearStateUpdater):
+                return updater
+            linear_updaters.append(updater_k)
+        indices = [var_names.index(var) for var in vars_k]
+        linear = ParameterSetsLinearStateUpdater(linear_updaters, indices,
+                                                 len(var_names),
+                                                 self._parameter_set_size)
+        # The noise is added after the linear update
+        if not isinstance(updater, SynapticNoise):
+            return linear
+        noise = updater
+        while isinstance(noise.baseupdater, SynapticNoise):
+            noise = noise.baseupdater
+        noise.baseupdater = linear
+        return updater
+
+    def parameter_set(self, k):
+        '''
+        Returns the subgroup of neurons using the ``k``-th set of parameters.
+        '''
+        if not 0 <= k < self._parameter_sets:
+            raise IndexError("There are only " + str(self._parameter_sets) + " sets of parameters.")
+        N = self._parameter_set_size
+        return self[k * N:(k + 1) * N]
+
+    def split_parameter_sets(self, M):
+        '''
+        Splits the results of the monitor ``M`` of the group into one item
+        for each set of parameters.
+        '''
+        source = getattr(M, 'source', getattr(M, 'P', None))
+        if source is not self or self._owner is not self:
+            raise ValueError("The monitor must record the whole group.")
+        K, N = self._parameter_sets, self._parameter_set_size
+        if hasattr(M, 'count'): # SpikeCounter
+            return list(M.count.reshape((K, N)))
+        elif hasattr(M, 'it'): # SpikeMonitor
+            i, t = M.it
+            sets = i // N
+            order = argsort(sets, kind='mergesort') # keeps the time order
+            i, t = i[order], t[order]
+            bounds = searchsorted(sets[order], arange(K + 1))
+            return [(i[a:b] - k * N, t[a:b])
+                    for k, (a, b) in enumerate(zip(bounds[:-1], bounds[1:]))]
+        elif hasattr(M, 'get_record_indices'): # StateMonitor
+            sets = asarray(M.get_record_indices(), dtype=int) // N
+            values = M.values
+            return [values[sets == k] for k in range(K)]
+        else:
+            raise TypeError("Cannot split the results of " + repr(M))
+
     def rest(self):
         '''
         Sets the variables at rest.
@@ -489,24 +728,40 @@ class NeuronGroup(magic.InstanceTracker, ObjectContainer, Group):
         '''
         Updates the state variables.
         '''
-        self._state_updater(self) # update the variables
+        if self._threads > 1:
+            if self._shards is None:
+                self._shards = self._make_shards()
+        if self._threads > 1 and self._shards:
+            # map returns when all the shards are updated
+            get_thread_pool(self._threads).map(self._shard_updater, self._shards)
+            for noise in self._shard_noise:
+                noise.add_noise(self)
+        else:
+            self._state_updater(self) # update the variables
         if self._spiking:
-            spikes = self._threshold(self) # get spikes
-            if not isinstance(spikes, numpy.ndarray):
-                spikes = array(spikes, dtype=int)
-            if not spikes.flags.contiguous:
-                spikes = array(spikes)
-            if self._use_next_allowed_spiketime_refractoriness:
-                spikes = spikes[self._next_allowed_spiketime[spikes] <= self.clock._t]
-                if self._variable_refractory_time:
-                    if self._refractory_variable is not None:
-                        refractime = self.state_(self._refractory_variable)
-                    else:
-                        refractime = self._refractory_array
-                    self._next_allowed_spiketime[spikes] = self.clock._t + refractime[spikes]
+            self._update_spikes()
+
+    def _update_spikes(self):
+        '''
+        Finds the neurons that spike and stores the spikes, this is the second
+        half of the update step (after the state update).
+        '''
+        spikes = self._threshold(self) # get spikes
+        if not isinstance(spikes, numpy.ndarray):
+            spikes = array(spikes, dtype=int)
+        if not spikes.flags.contiguous:
+            spikes = array(spikes)
+        if self._use_next_allowed_spiketime_refractoriness:
+            spikes = spikes[self._next_allowed_spiketime[spikes] <= self.clock._t]
+            if self._variable_refractory_time:
+                if self._refractory_variable is not None:
+                    refractime = self.state_(self._refractory_variable)
                 else:
-                    self._next_allowed_spiketime[spikes] = self.clock._t + self._refractory_time
-            self.LS.push(spikes) # Store spikes
+                    refractime = self._refractory_array
+                self._next_allowed_spiketime[spikes] = self.clock._t + refractime[spikes]
+            else:
+                self._next_allowed_spiketime[spikes] = self.clock._t + self._refractory_time
+        self.LS.push(spikes) # Store spikes
 
     def get_refractory_indices(self):
         return (self._next_allowed_spiketime > self.clock._t).nonzero()[0]
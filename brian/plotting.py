@@ -60,7 +60,7 @@ from network import network_operation
 from clock import EventClock
 import warnings
 from log import *
-from numpy import amax, amin, array, hstack
+from numpy import amax, amin, array, hstack, searchsorted
 import bisect
 
 def _take_options(myopts, givenopts):
@@ -161,17 +161,25 @@ def raster_plot(*monitors, **additionalplotoptions):
             allsn = []
             allst = []
             for i, m in enumerate(monitors):
-                mspikes = m.spikes
-                if tmin is not None and tmax is not None:
-                    x = SecondTupleArray(mspikes)
-                    imin = bisect.bisect_left(x, tmin)
-                    imax = bisect.bisect_right(x, tmax)
-                    mspikes = mspikes[imin:imax]
-                if len(mspikes):
-                    sn, st = array(mspikes).T
+                if hasattr(m, 'it'):
+                    sn, st = m.it
+                    if tmin is not None and tmax is not None:
+                        imin = searchsorted(st, tmin, 'left')
+                        imax = searchsorted(st, tmax, 'right')
+                        sn, st = sn[imin:imax], st[imin:imax]
+                    st = st / float(ms)
                 else:
-                    sn, st = array([]), array([])
-                st /= ms
+                    mspikes = m.spikes
+                    if tmin is not None and tmax is not None:
+                        x = SecondTupleArray(mspikes)
+                        imin = bisect.bisect_left(x, tmin)
+                        imax = bisect.bisect_right(x, tmax)
+                        mspikes = mspikes[imin:imax]
+                    if len(mspikes):
+                        sn, st = array(mspikes).T
+                    else:
+                        sn, st = array([]), array([])
+                    st /= ms
                 if len(monitors) == 1:
                     allsn = [sn]
                 else:
@@ -38,7 +38,9 @@ Neuron StateUpdaters
 
 __all__ = ['StateUpdater', 'LinearStateUpdater', 'NonlinearStateUpdater',
            'SynapticNoise', 'LazyStateUpdater', 'magic_state_updater',
-           'FunStateUpdater', 'get_linear_equations']
+           'FunStateUpdater', 'get_linear_equations',
+           'FusedLinearStateUpdater', 'ParameterSetsLinearStateUpdater',
+           'get_linear_update', 'clear_linear_update_cache']
 
 #from scipy.weave import blitz
 from numpy import *
@@ -56,6 +58,10 @@ from equations import *
 from itertools import count
 from units import Quantity
 import warnings
+import hashlib
+import os
+import tempfile
+from collections import OrderedDict
 from log import *
 from globalprefs import *
 from experimental.codegen import *
@@ -244,10 +250,10 @@ class StateUpdater(object):
 #    B=linalg.lstsq(M,AB)[0] # We use this instead of solve in case M is degenerate
 #    return M,B
 
-def get_linear_equations(eqs):
+def get_linear_system(eqs):
     '''
-    Returns the matrices M and B for the linear model dX/dt = M(X-B),
-    where eqs is an Equations object. 
+    Returns the matrices M and AB for the linear model dX/dt = MX - AB,
+    where eqs is an Equations object.
     '''
     # Otherwise assumes it is given in functional form
     n = len(eqs._diffeq_names) # number of state variables
@@ -270,33 +276,25 @@ def get_linear_equations(eqs):
             d[dynamicvars[i]] = 1.
         for var, j in zip(dynamicvars, count()):
             M[j, i] = eqs.apply(var, d) + AB[j]
+    return M, AB
+
+def get_linear_equations(eqs):
+    '''
+    Returns the matrices M and B for the linear model dX/dt = M(X-B),
+    where eqs is an Equations object. 
+    '''
+    M, AB = get_linear_system(eqs)
     #M-=eye(n)*1e-10 # quick dirty fix for problem of constant derivatives; dimension = Hz
     #B=linalg.lstsq(M,AB)[0] # We use this instead of solve in case M is degenerate
     B = linalg.solve(M, AB) # We use this instead of solve in case M is degenerate
     return M, B
 
 def get_linear_equations_solution_numerically(eqs, dt):
-    # Otherwise assumes it is given in functional form
-    n = len(eqs._diffeq_names) # number of state variables
-    dynamicvars = eqs._diffeq_names
-    # Calculate B
-    AB = zeros((n, 1))
-    d = dict.fromkeys(dynamicvars)
-    for j in range(n):
-        d[dynamicvars[j]] = 0. * eqs._units[dynamicvars[j]]
-    for var, i in zip(dynamicvars, count()):
-        AB[i] = -eqs.apply(var, d)
-    # Calculate A
-    M = zeros((n, n))
-    for i in range(n):
-        for j in range(n):
-            d[dynamicvars[j]] = 0. * eqs._units[dynamicvars[j]]
-        if isinstance(eqs._units[dynamicvars[i]], Quantity):
-            d[dynamicvars[i]] = Quantity.with_dimensions(1., eqs._units[dynamicvars[i]].get_dimensions())
-        else:
-            d[dynamicvars[i]] = 1.
-        for var, j in zip(dynamicvars, count()):
-            M[j, i] = eqs.apply(var, d) + AB[j]
+    M, AB = get_linear_system(eqs)
+    return get_linear_system_solution_numerically(M, AB, dt)
+
+def get_linear_system_solution_numerically(M, AB, dt):
+    n = M.shape[0]
     #B=linalg.solve(M,AB)
     numeulersteps = 100
     deltat = dt / numeulersteps
@@ -317,6 +315,178 @@ define_global_preference('useweave_linear_diffeq', 'False',
                                   some platforms, typically new ones, this is actually
                                   slower.
                                   """)
+set_global_preferences(linear_diffeq_cache_size=128)
+define_global_preference('linear_diffeq_cache_size', '128',
+                           desc="""
+                                  Maximum number of update matrices of linear
+                                  differential equations kept in memory, so that
+                                  groups with the same linear equations and time step
+                                  do not compute them again (0 to disable the cache).
+                                  """)
+set_global_preferences(linear_diffeq_cache_dir=None)
+define_global_preference('linear_diffeq_cache_dir', 'None',
+                           desc="""
+                                  If not None, a directory where the update matrices of
+                                  linear differential equations are also stored, so that
+                                  they are reused by later runs and by other processes.
+                                  """)
+
+_linear_update_cache = OrderedDict()
+
+def linear_equations_key(eqs, dt):
+    '''
+    Returns a hash of the equations and the time step dt, in which the
+    external parameters are replaced by their values. Returns None if one of
+    them is not a number, in which case the linear system has to be evaluated
+    first (see :func:`linear_system_key`).
+    '''
+    h = hashlib.sha1()
+    h.update(','.join(eqs._diffeq_names) + ';' + repr(float(dt)))
+    variables = eqs._units.keys() + eqs._alias.keys()
+    for name in sorted(eqs._units.keys()):
+        if name == 't' or name not in eqs._function:
+            continue
+        if name not in eqs._string:
+            return None
+        expr = eqs._string[name]
+        h.update(';' + name + '=' + expr)
+        namespace = eqs._namespace[name]
+        for id in sorted(set(get_identifiers(expr))):
+            if id in variables:
+                continue
+            value = namespace.get(id, None)
+            if isinstance(value, (int, float)):
+                h.update(';' + id + '=' + repr(float(value)))
+            elif isinstance(value, ufunc):
+                h.update(';' + id + '=' + repr(value))
+            else:
+                return None
+    return h.hexdigest()
+
+def linear_system_key(M, AB, dt):
+    '''
+    Returns a hash of the linear system dX/dt = MX - AB and the time step dt.
+    '''
+    h = hashlib.sha1()
+    for x in (M, AB):
+        x = ascontiguousarray(x, dtype=float)
+        h.update(str(x.shape))
+        h.update(x.tostring())
+    h.update(repr(float(dt)))
+    return h.hexdigest()
+
+def get_linear_update(eqs, dt):
+    '''
+    Returns the matrices ``(A, B, C)`` of the exact update X <- AX+C over a
+    time step dt of the linear equations ``eqs`` (an :class:`Equations`
+    object), with B the fixed point (``NotImplemented`` if the system is
+    degenerate).
+    
+    The matrices are kept in a process-wide least recently used cache (see the
+    ``linear_diffeq_cache_size`` global preference) and, if the
+    ``linear_diffeq_cache_dir`` global preference is set, stored in that
+    directory. The cache is keyed by the equations and the values of their
+    parameters, or by the evaluated linear system when a parameter is not a
+    number. The returned arrays are shared and read-only.
+    '''
+    maxsize = get_global_preference('linear_diffeq_cache_size')
+    directory = get_global_preference('linear_diffeq_cache_dir')
+    if not maxsize and directory is None:
+        M, AB = get_linear_system(eqs)
+        return solve_linear_update(M, AB, dt)
+    M = AB = None
+    key = linear_equations_key(eqs, dt)
+    if key is None:
+        M, AB = get_linear_system(eqs)
+        key = linear_system_key(M, AB, dt)
+    if key in _linear_update_cache:
+        update = _linear_update_cache.pop(key)
+    else:
+        update = None
+        if directory is not None:
+            update = load_linear_update(directory, key)
+        if update is None:
+            if M is None:
+                M, AB = get_linear_system(eqs)
+            update = solve_linear_update(M, AB, dt)
+            for x in update:
+                if isinstance(x, ndarray):
+                    x.flags.writeable = False
+            if directory is not None:
+                save_linear_update(directory, key, update)
+    if maxsize:
+        _linear_update_cache[key] = update
+        while len(_linear_update_cache) > maxsize:
+            _linear_update_cache.popitem(last=False)
+    return update
+
+def clear_linear_update_cache():
+    '''
+    Empties the in-memory cache of :func:`get_linear_update`.
+    '''
+    _linear_update_cache.clear()
+
+def solve_linear_update(M, AB, dt):
+    '''
+    Computes the matrices ``(A, B, C)`` returned by :func:`get_linear_update`.
+    '''
+    try:
+        B = linalg.solve(M, AB)
+        A = linalg.expm(M * float(dt))
+        C = -dot(A, B) + B
+    except LinAlgError:
+        log_info('brian.stateupdater', 'Solving linear equations numerically')
+        A, C = get_linear_system_solution_numerically(M, AB, float(dt))
+        B = NotImplemented # raises error on trying to use this
+    return A, B, C
+
+def load_linear_update(directory, key):
+    '''
+    Loads the matrices stored by :func:`save_linear_update`, or returns None.
+    '''
+    filename = os.path.join(directory, key + '.npz')
+    if not os.path.exists(filename):
+        return None
+    try:
+        f = load(filename)
+        try:
+            A, C = f['A'], f['C']
+            if 'B' in f.files:
+                B = f['B']
+            else:
+                B = NotImplemented
+        finally:
+            f.close()
+    except (IOError, ValueError, KeyError):
+        log_warn('brian.stateupdater', 'Cannot read cached linear update ' + filename)
+        return None
+    for x in (A, B, C):
+        if isinstance(x, ndarray):
+            x.flags.writeable = False
+    return A, B, C
+
+def save_linear_update(directory, key, update):
+    '''
+    Stores the matrices ``(A, B, C)`` in the given directory. The file is
+    written under a temporary name and then renamed so that concurrent
+    processes never read incomplete files.
+    '''
+    A, B, C = update
+    arrays = dict(A=A, C=C)
+    if B is not NotImplemented:
+        arrays['B'] = B
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, tmpname = tempfile.mkstemp(suffix='.npz', dir=directory)
+        f = os.fdopen(fd, 'wb')
+        try:
+            savez(f, **arrays)
+        finally:
+            f.close()
+        os.rename(tmpname, os.path.join(directory, key + '.npz'))
+    except (IOError, OSError):
+        log_warn('brian.stateupdater', 'Cannot write cached linear update in ' + directory)
 
 
 class LinearStateUpdater(StateUpdater):
@@ -337,7 +507,10 @@ class LinearStateUpdater(StateUpdater):
         Optional clock.
     
     Computes an update matrix A=exp(M dt) for the linear system,
-    and performs the update step.
+    and performs the update step. When initialised with an
+    :class:`Equations` object, the update matrices are taken from the cache
+    of :func:`get_linear_update`, so that groups with the same linear
+    equations and time step share them.
     
     TODO: more mathematical details? 
     '''
@@ -361,21 +534,10 @@ class LinearStateUpdater(StateUpdater):
             self.A = linalg.expm(M * clock.dt)
             self.B = B
         elif isinstance(M, Equations):
-            try:
-                M, self.B = get_linear_equations(M)
-                self.A = linalg.expm(M * clock.dt)
-                #self.A=array(self.A,single)
-                if self.B is not None:
-                    self._C = -dot(self.A, self.B) + self.B
-                    #self._C=array(self._C,single)
-                    self._useB = True
-                else:
-                    self._useB = False
-            except LinAlgError:
-                log_info('brian.stateupdater', 'Solving linear equations numerically')
-                self.A, self._C = get_linear_equations_solution_numerically(M, clock.dt)
-                self.B = NotImplemented # raises error on trying to use this
-                self._useB = True
+            self.A, self.B, self._C = get_linear_update(M, clock.dt)
+            if self.B is not NotImplemented:
+                self.B = self.B.copy()
+            self._useB = True
         # note the numpy dot command works faster if self.A has C ordering compared
         # to fortran ordering (although maybe this depends on which implementation
         # of BLAS you're using). The difference is only significant in small
@@ -480,7 +642,97 @@ class LinearStateUpdater(StateUpdater):
         '''
         return self.A.shape[0]
 
+    def fusion_key(self):
+        '''
+        Returns a hashable key which is the same for two state updaters doing
+        exactly the same update, or ``None`` if the update cannot be fused
+        (see :class:`FusedLinearStateUpdater`).
+        '''
+        if self._useaccel:
+            return None
+        if self._useB:
+            C = (self._C.shape, self._C.tostring())
+        else:
+            C = None
+        return (self.A.shape, self.A.tostring(), C)
+
+
+class FusedLinearStateUpdater(object):
+    '''
+    Updates several groups with identical linear equations at once
+    
+    Initialised with a :class:`LinearStateUpdater` and a list of groups whose
+    state updaters have the same :meth:`~LinearStateUpdater.fusion_key`.
+    Calling the object concatenates the state matrices of all the groups,
+    updates them with a single matrix product and copies the results back,
+    which for many small groups is much faster than updating each group
+    separately. It is used by the fused update schedule of :class:`Network`.
+    '''
+    def __init__(self, updater, groups):
+        self.A = updater.A
+        self._useB = updater._useB
+        if self._useB:
+            self._C = updater._C
+        self._states = [G._S for G in groups]
+        bounds = cumsum([0] + [S.shape[1] for S in self._states])
+        self._slices = zip(self._states, bounds[:-1], bounds[1:])
+
+    def __call__(self):
+        S = dot(self.A, concatenate(self._states, axis=1))
+        if self._useB:
+            add(S, self._C, S)
+        for P_S, i, j in self._slices:
+            P_S[:] = S[:, i:j]
+
+    def __len__(self):
+        return self.A.shape[0]
+
 
+class ParameterSetsLinearStateUpdater(StateUpdater):
+    '''
+    Exact updates of linear equations for several sets of values of their
+    constants
+    
+    Used by :class:`NeuronGroup` with the ``vectorize_parameters`` keyword,
+    where the constants become state variables, so that the equations are no
+    longer linear. Initialised with the list of the
+    :class:`LinearStateUpdater` objects of the equations with each set of
+    values, the indices of their variables in the state matrix (which has
+    ``nvars`` variables) and the number ``N`` of neurons of each set. The
+    neurons ``k*N`` to ``(k+1)*N-1`` are updated with the ``k``-th update
+    matrix, and the other variables (the vectorized parameters) do not change.
+    '''
+    def __init__(self, updaters, indices, nvars, N):
+        K = len(updaters)
+        self.N = N
+        self.indices = indices
+        self.A = zeros((K, nvars, nvars))
+        self._C = zeros((nvars, K))
+        self.B = []
+        for k, updater in enumerate(updaters):
+            self.A[k] = eye(nvars)
+            self.A[k][ix_(indices, indices)] = updater.A
+            self._C[indices, k] = updater._C.flatten()
+            self.B.append(updater.B)
+
+    def rest(self, P):
+        S = P._S.reshape((len(self), len(self.B), self.N))
+        for k, B in enumerate(self.B):
+            if B is NotImplemented:
+                raise NotImplementedError, \
+                    "The resting potential cannot be found because the equations are degenerate " + \
+                    "(most likely because they include a parameter)"
+            S[self.indices, k, :] = B
+
+    def __call__(self, P):
+        S = P._S.reshape((len(self), len(self.B), self.N))
+        S[:] = einsum('kij,jkn->ikn', self.A, S)
+        S += self._C[:, :, newaxis]
+
+    def __len__(self):
+        return self.A.shape[1]
+
+
 class NonlinearStateUpdater(StateUpdater):
     '''
     A nonlinear model with dynamics dX/dt = f(X).
@@ -659,6 +911,12 @@ class SynapticNoise(StateUpdater):
         P is the neuron group.
         '''
         self.baseupdater(P) # update the underlying model
+        self.add_noise(P)
+
+    def add_noise(self, P):
+        '''
+        Adds the noise term to the synaptic state variable.
+        '''
         P._S[self.nstate, :] += self.mu + random.randn(P._S.shape[1]) * self.sigma
 
     def __repr__(self):
@@ -7,17 +7,17 @@ from equations import *
 from monitor import SpikeMonitor, RecentStateMonitor
 from network import NetworkOperation
 from neurongroup import NeuronGroup
-from stateupdater import get_linear_equations, LinearStateUpdater
+from stateupdater import get_linear_equations, get_linear_system, LinearStateUpdater
 from scipy.linalg import expm
 from scipy import dot, eye, zeros, array, clip, exp, Inf
 from stdunits import ms
-from connections import DelayConnection, DenseConstructionMatrix, SparseConnectionVector
+from connections import DelayConnection, DenseConstructionMatrix, SparseConnectionVector, SparseConnectionMatrix
 import re
 from utils.documentation import flattened_docstring
 from copy import copy
 import warnings
 from itertools import izip
-from numpy import arange, floor
+from numpy import arange, floor, asarray, repeat, cumsum, ones, diag
 from clock import Clock
 from units import second
 from utils.separate_equations import separate_equations
@@ -28,11 +28,119 @@ from optimiser import freeze
 __all__ = ['STDP', 'ExponentialSTDP']
 
 
+def vectorise_stdp_code(code, vars, other_vars, clipcode):
+    '''
+    Returns the code updating the variables and weights for all the spikes of
+    a time step at once, or None if the code cannot be vectorised.
+    
+    ``code`` is the pre or postsynaptic code (after freezing), ``vars`` the
+    variables of the side of the spikes and ``other_vars`` the variables of
+    the other side. The returned code uses the arrays ``_syn`` (indices in
+    ``_alldata`` of the synapses of the neurons that spiked), ``_own`` and
+    ``_other`` (the neurons of these synapses on the side of the spikes and
+    on the other side). This is only done if every line is an assignment of
+    either a variable of ``vars`` from these variables, or of ``w`` from
+    ``w`` and the variables, without function calls: the updates of the
+    different spikes are then independent of each other, and the result is
+    the same as executing the code spike after spike.
+    '''
+    outcode = ['_w=_alldata[_syn]']
+    for line in code.split('\n'):
+        line = line.strip()
+        if not line:
+            continue
+        m = re.match(r'(\w+)\s*([-+*/]?=)(.*)$', line)
+        if m is None:
+            return None
+        target, op, expr = m.groups()
+        if expr.strip().startswith('=') or re.search(r'\w\s*\(', expr):
+            return None
+        names = set(re.findall(r'\b[A-Za-z_]\w*', expr))
+        if target == 'w':
+            if not names.issubset(set(vars) | set(other_vars) | set(['w'])):
+                return None
+            for var in vars:
+                expr = re.sub(r'\b' + var + r'\b', var + '[_own]', expr)
+            for var in other_vars:
+                expr = re.sub(r'\b' + var + r'\b', var + '[_other]', expr)
+            expr = re.sub(r'\bw\b', '_w', expr)
+            outcode.append('_w' + op + expr)
+        elif target in vars:
+            if not names.issubset(set(vars)):
+                return None
+            for var in vars:
+                expr = re.sub(r'\b' + var + r'\b', var + '[spikes]', expr)
+            outcode.append(target + '[spikes]' + op + expr)
+        else:
+            return None
+    outcode.append('_w=' + clipcode)
+    outcode.append('_alldata[_syn]=_w')
+    return '\n'.join(outcode)
+
+
+class EventDrivenGroup(NeuronGroup):
+    '''
+    Group of STDP variables which are only updated at spike times
+    
+    The variables must follow independent linear differential equations
+    (``dx/dt=m*x-b`` for every variable ``x``). The group does nothing at
+    every time step: the variables of some neurons are advanced to the end
+    of the current time step with the exact solution of these equations when
+    they are needed (see :meth:`advance`), and the time of that update is
+    stored for every neuron in :attr:`lastt`. The values of the variables
+    are therefore those at the last update of each neuron.
+    '''
+    def __init__(self, N, model, clock=None):
+        NeuronGroup.__init__(self, N, model=model, clock=clock)
+        if not model.is_linear():
+            raise ValueError('Event-driven STDP requires linear equations.')
+        M, AB = get_linear_system(model)
+        if (M != diag(diag(M))).any():
+            raise ValueError('Event-driven STDP requires independent equations for the variables.')
+        self._traces = [(self.state_(var), M[i, i], AB[i, 0])
+                        for i, var in enumerate(model._diffeq_names)]
+        self.lastt = zeros(N)
+
+    def reinit(self, states=True):
+        NeuronGroup.reinit(self, states)
+        self.lastt[:] = 0
+
+    def update(self):
+        pass
+
+    def advance(self, neurons):
+        '''
+        Advances the variables of ``neurons`` (array of indices or slice) to
+        the end of the current time step.
+        '''
+        t = self.clock._t + self.clock._dt
+        interval = t - self.lastt[neurons]
+        for x, m, b in self._traces:
+            if b == 0:
+                x[neurons] *= exp(m * interval)
+            elif m == 0:
+                x[neurons] -= b * interval
+            else:
+                x[neurons] = b / m + (x[neurons] - b / m) * exp(m * interval)
+        self.lastt[neurons] = t
+
+
 class STDPUpdater(SpikeMonitor):
     '''
     Updates STDP variables at spike times
+    
+    If ``vectorised_code`` is given (see :func:`vectorise_stdp_code`) and the
+    connection matrix is a :class:`SparseConnectionMatrix`, the synapses of
+    all the neurons that spiked are found in the arrays of the matrix (the
+    rows, or the columns if ``reverse`` is True), and the weights are updated
+    with that code rather than spike by spike.
+    
+    If ``groups`` is given, the variables are event-driven: the variables of
+    the neurons that spiked and of the neurons on the other side of their
+    synapses are advanced to the current time before the code is executed.
     '''
-    def __init__(self, source, C, vars, code, namespace, delay=0 * ms):
+    def __init__(self, source, C, vars, code, namespace, delay=0 * ms,
+                 vectorised_code=None, reverse=False, groups=None):
         '''
         source = source group
         C = connection
@@ -41,17 +149,70 @@ class STDPUpdater(SpikeMonitor):
         code = code to execute for every spike
         namespace = namespace for the code
         delay = transmission delay 
+        vectorised_code = code to execute for all spikes with a sparse matrix
+        reverse = True if the spikes are those of the target group
+        groups = (own, other) EventDrivenGroup objects, or None
         '''
         super(STDPUpdater, self).__init__(source, record=False, delay=delay)
         self._code = code # update code
         self._namespace = namespace # code namespace
+        self._vectorised_code = vectorised_code
+        self.reverse = reverse
+        self.groups = groups
         self.C = C
 
     def propagate(self, spikes):
         if len(spikes):
             self._namespace['spikes'] = spikes
-            self._namespace['w'] = self.C.W
-            exec self._code in self._namespace
+            if self.groups is not None:
+                own, other = self.groups
+                own.advance(spikes)
+            W = self.C.W
+            if (self._vectorised_code is not None and
+                    isinstance(W, SparseConnectionMatrix) and
+                    (W.column_access or not self.reverse)):
+                self.sparse_synapses(W, spikes)
+                if self.groups is not None:
+                    other.advance(self._namespace['_other'])
+                exec self._vectorised_code in self._namespace
+            else:
+                if self.groups is not None:
+                    other.advance(slice(None))
+                self._namespace['w'] = W
+                exec self._code in self._namespace
+
+    def sparse_synapses(self, W, spikes):
+        '''
+        Puts the arrays ``_syn``, ``_own``, ``_other`` and ``_alldata`` of
+        the vectorised code in the namespace.
+        '''
+        spikes = asarray(spikes, dtype=int)
+        if self.reverse:
+            ind = W.colind
+        else:
+            ind = W.rowind
+        starts = asarray(ind[spikes], dtype=int)
+        lengths = asarray(ind[spikes + 1], dtype=int) - starts
+        nonempty = lengths > 0
+        spikes, starts, lengths = spikes[nonempty], starts[nonempty], lengths[nonempty]
+        # positions of the synapses in the blocks of the rows (or columns):
+        # consecutive within a block, with a jump to the start of the next one
+        offsets = cumsum(lengths)
+        k = ones(offsets[-1] if len(offsets) else 0, dtype=int)
+        if len(k):
+            k[0] = starts[0]
+            k[offsets[:-1]] += starts[1:] - (starts[:-1] + lengths[:-1])
+            cumsum(k, out=k)
+        ns = self._namespace
+        if self.reverse:
+            ns['_syn'] = W.allcoldataindices[k]
+            ns['_other'] = W.colalli[k]
+        else:
+            ns['_syn'] = k
+            ns['_other'] = W.allj[k]
+        if '_own' in self._vectorised_code.co_names:
+            ns['_own'] = repeat(spikes, lengths)
+        ns['_alldata'] = W.alldata
 
 
 class DelayedSTDPUpdater(SpikeMonitor):
@@ -115,6 +276,8 @@ class STDP(NetworkOperation):
         Presynaptic delay
     ``delay_post``
         Postsynaptic delay (backward propagating spike)
+    ``event_driven``
+        If True, the variables are only updated at spike times (see below).
     
     The STDP object works by specifying a set of differential equations
     associated to each synapse (``eqs``) and two rules to specify what should
@@ -177,8 +340,24 @@ class STDP(NetworkOperation):
     :class:`NeuronGroup` objects). As well as propagating spikes from the source
     and target of ``C`` via ``C``, spikes are also propagated to the respective
     groups created. At spike propagation time the weight values are updated.
+    When the connection matrix is sparse (and has column access for the
+    postsynaptic code), the weights of all the synapses of the neurons that
+    spiked during a time step are updated at once on the arrays of the matrix,
+    provided that the ``pre`` and ``post`` codes are simple assignments of the
+    variables and of ``w`` (as for :class:`ExponentialSTDP`).
+    
+    With ``event_driven=True``, the two groups are not updated at every time
+    step, which is faster when the neurons fire at low rates. The variables
+    of a neuron are advanced with the exact solution of their equations, from
+    the time of their last update, when the neuron spikes or when one of the
+    neurons it is connected to spikes (see :class:`EventDrivenGroup`). This
+    requires the variables to follow independent linear equations (e.g.
+    exponentially decaying traces), and is not available for connections with
+    heterogeneous delays. Note that ``stdp.A_pre`` then gives the values of
+    the variables at the time of their last update.
     '''
-    def __init__(self, C, eqs, pre, post, wmin=0, wmax=Inf, level=0, clock=None, delay_pre=None, delay_post=None):
+    def __init__(self, C, eqs, pre, post, wmin=0, wmax=Inf, level=0, clock=None, delay_pre=None, delay_post=None,
+                 event_driven=False):
         '''
         C: connection object
         eqs: differential equations (with units)
@@ -187,8 +366,10 @@ class STDP(NetworkOperation):
         wmax: maximum weight (default unlimited)
         delay_pre: presynaptic delay
         delay_post: postsynaptic delay (backward propagating spike)
+        event_driven: update the variables only at spike times
         '''
-        if get_global_preference('usecstdp') and get_global_preference('useweave'):
+        if (get_global_preference('usecstdp') and get_global_preference('useweave')
+                and not event_driven):
             from experimental.c_stdp import CSTDP
             log_warn('brian.stdp', 'Using experimental C STDP class.')
             self.__class__ = CSTDP
@@ -279,8 +460,16 @@ class STDP(NetworkOperation):
         post = '\n'.join(freeze(line.strip(), all_vars, post_namespace) for line in post.split('\n'))
 
         # Neuron groups
-        G_pre = NeuronGroup(len(C.source), model=sep_pre, clock=self.clock)
-        G_post = NeuronGroup(len(C.target), model=sep_post, clock=self.clock)
+        if event_driven:
+            if isinstance(C, DelayConnection):
+                raise ValueError('Event-driven STDP is not available with heterogeneous delays.')
+            G_pre = EventDrivenGroup(len(C.source), model=sep_pre, clock=self.clock)
+            G_post = EventDrivenGroup(len(C.target), model=sep_post, clock=self.clock)
+            pre_groups, post_groups = (G_pre, G_post), (G_post, G_pre)
+        else:
+            G_pre = NeuronGroup(len(C.source), model=sep_pre, clock=self.clock)
+            G_post = NeuronGroup(len(C.target), model=sep_post, clock=self.clock)
+            pre_groups = post_groups = None
         G_pre._S[:] = 0
         G_post._S[:] = 0
         self.pre_group = G_pre
@@ -368,6 +557,20 @@ class STDP(NetworkOperation):
             self.contained_objects += self.G_post_monitors.values()
 
         else:
+            # Code for all the spikes of a time step with sparse matrices
+            if wmax==Inf:
+                clipcode = 'clip(_w,%(min)e,Inf,_w)' % {'min':wmin}
+            else:
+                clipcode = 'clip(_w,%(min)e,%(max)e,_w)' % {'min':wmin, 'max':wmax}
+            pre_vectorised = vectorise_stdp_code(pre, vars_pre, vars_post, clipcode)
+            post_vectorised = vectorise_stdp_code(post, vars_post, vars_pre, clipcode)
+            if pre_vectorised is not None:
+                log_debug('brian.stdp', 'PRE CODE (VECTORISED):\n'+pre_vectorised)
+                pre_vectorised = compile(pre_vectorised, "Presynaptic code (vectorised)", "exec")
+            if post_vectorised is not None:
+                log_debug('brian.stdp', 'POST CODE (VECTORISED):\n'+post_vectorised)
+                post_vectorised = compile(post_vectorised, "Postsynaptic code (vectorised)", "exec")
+
             # Indent and loop
             pre = re.compile('^', re.M).sub('    ', pre)
             post = re.compile('^', re.M).sub('    ', post)
@@ -408,8 +611,10 @@ class STDP(NetworkOperation):
                 delay_post = connection_delay - delay_pre
                 if delay_post < 0 * ms: raise AttributeError, "Postsynaptic delay is too large"
             # create forward and backward Connection objects or SpikeMonitor objects
-            pre_updater = STDPUpdater(C.source, C, vars=vars_pre, code=pre_code, namespace=pre_namespace, delay=delay_pre)
-            post_updater = STDPUpdater(C.target, C, vars=vars_post, code=post_code, namespace=post_namespace, delay=delay_post)
+            pre_updater = STDPUpdater(C.source, C, vars=vars_pre, code=pre_code, namespace=pre_namespace, delay=delay_pre,
+                                      vectorised_code=pre_vectorised, groups=pre_groups)
+            post_updater = STDPUpdater(C.target, C, vars=vars_post, code=post_code, namespace=post_namespace, delay=delay_post,
+                                       vectorised_code=post_vectorised, reverse=True, groups=post_groups)
             updaters = [pre_updater, post_updater]
             self.contained_objects += [pre_updater, post_updater]
 
@@ -480,10 +685,14 @@ class ExponentialSTDP(STDP):
         (or "soft bounds")
       * 'mixed': depression is multiplicative, potentiation is additive
     
+    ``event_driven=False``
+        If True, the variables are only updated at spike times.
+    
     See documentation for :class:`STDP` for more details.
     '''
     def __init__(self, C, taup, taum, Ap, Am, interactions='all', wmin=0, wmax=None,
-                 update='additive', delay_pre=None, delay_post=None, clock=None):
+                 update='additive', delay_pre=None, delay_post=None, clock=None,
+                 event_driven=False):
         if wmax is None:
             raise AttributeError, "You must specify the maximum synaptic weight"
         wmax = float(wmax) # removes units
@@ -536,7 +745,8 @@ class ExponentialSTDP(STDP):
                     raise AttributeError, "There is no potentiation in STDP rule"
         else:
             raise AttributeError, "Unknown update type " + update
-        STDP.__init__(self, C, eqs=eqs, pre=pre, post=post, wmin=wmin, wmax=wmax, delay_pre=delay_pre, delay_post=delay_post, clock=clock)
+        STDP.__init__(self, C, eqs=eqs, pre=pre, post=post, wmin=wmin, wmax=wmax, delay_pre=delay_pre, delay_post=delay_post, clock=clock,
+                      event_driven=event_driven)
 
 if __name__ == '__main__':
     pass
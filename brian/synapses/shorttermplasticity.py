@@ -0,0 +1,106 @@
+'''
+Tsodyks-Markram short-term plasticity in Synapses
+'''
+import numpy as np
+
+from brian.stdunits import ms
+from brian.synapses.synapses import Synapses
+from brian.synapses.synaptic_equations import SynapticEquations
+
+__all__ = ['STPSynapses']
+
+
+class STPSynapses(Synapses):
+    '''
+    Synapses with short-term plasticity, following the Tsodyks-Markram model
+
+    Each synapse has two variables ``x`` and ``u``, which follow the
+    differential equations::
+
+      dx/dt=(1-x)/taud  (depression)
+      du/dt=(U-u)/tauf  (facilitation)
+
+    and each presynaptic spike arriving at the synapse triggers the
+    modifications::
+
+      x<-x*(1-u)
+      u<-u+U*(1-u)
+
+    Initialised with the arguments of :class:`Synapses`, and:
+
+    ``taud``, ``tauf``
+        The depression and facilitation time constants (``tauf=0*ms`` gives
+        depression only).
+    ``U``
+        The parameter U in 0..1.
+
+    The variables ``u``, ``x`` and ``lastupdate_stp`` (the time of their last
+    update) are added to the synaptic variables, and new synapses start with
+    ``u=U`` and ``x=1``. The variables are not integrated at every time step:
+    when presynaptic spikes arrive, the variables of all the synapses
+    concerned are updated at once with the analytical solution of the
+    equations, then the presynaptic code is executed, then the above
+    modifications are applied to the values of ``u`` and ``x`` after the
+    presynaptic code (which can modify them). The presynaptic code can therefore use ``u``
+    and ``x`` to modulate the synaptic weight by the product u*x (before
+    update), for example::
+
+        S = STPSynapses(input, neurons, model='w : 1', pre='i+=w*u*x',
+                        taud=1*ms, tauf=100*ms, U=.1)
+
+    If there are several presynaptic codes, the variables are updated by the
+    spikes of the first one.
+    '''
+    def __init__(self, source, target=None, model=None, pre=None, post=None,
+                 taud=1*ms, tauf=100*ms, U=.1, level=0, **kwds):
+        if not isinstance(model, SynapticEquations):
+            model = SynapticEquations(model or '', level=level+1)
+        model += '''
+                 u : 1
+                 x : 1
+                 lastupdate_stp : second
+                 '''
+        self.taud = float(taud)
+        self.tauf = float(tauf)
+        self.U = U
+        Synapses.__init__(self, source, target, model=model, pre=pre,
+                          post=post, level=level+1, **kwds)
+
+    def create_synapses(self, presynaptic, postsynaptic,
+                        synapses_pre=None, synapses_post=None):
+        nsynapses = len(self)
+        Synapses.create_synapses(self, presynaptic, postsynaptic,
+                                 synapses_pre, synapses_post)
+        self._S[self.var_index['u'], nsynapses:] = self.U
+        self._S[self.var_index['x'], nsynapses:] = 1
+
+    def process_events(self, k, synaptic_events):
+        if k > 0:
+            return Synapses.process_events(self, k, synaptic_events)
+        t = self.clock._t
+        u = self.state_('u')
+        x = self.state_('x')
+        lastupdate = self.state_('lastupdate_stp')
+        # take and put are faster than indexing with arrays
+        interval = lastupdate.take(synaptic_events)
+        interval -= t
+        if self.tauf > 0:
+            u_events = u.take(synaptic_events)
+            u_events -= self.U
+            u_events *= np.exp(interval * (1 / self.tauf))
+            u_events += self.U
+        else:
+            u_events = self.U * np.ones(len(synaptic_events))
+        x_events = x.take(synaptic_events)
+        x_events -= 1
+        x_events *= np.exp(interval * (1 / self.taud))
+        x_events += 1
+        u.put(synaptic_events, u_events)
+        x.put(synaptic_events, x_events)
+        lastupdate.put(synaptic_events, t)
+        Synapses.process_events(self, k, synaptic_events)
+        # the presynaptic code can modify u and x
+        u_events = u.take(synaptic_events)
+        x_events = x.take(synaptic_events)
+        x.put(synaptic_events, x_events * (1 - u_events))
+        u.put(synaptic_events, u_events + self.U * (1 - u_events))
@@ -40,9 +40,16 @@ Main methods:
 * propagate()
     The class is implemented as a SpikeMonitor, which means the propagate() function is
     called at each timestep with the spikes produced by the neuron group.
+    The target synapses of all spikes are gathered in one vectorised operation
+    from a CSR-style index (see set_synapse_index()), then inserted at once.
     The function executes different codes (different strategies) depending on whether
     offsets are precomputed or not, and on whether delays are heterogeneous or
     homogeneous.
+* set_synapse_index(indptr, indices)
+    The synapses of all neurons are stored in one flat array (indices),
+    where the synapses of neuron i are indices[indptr[i]:indptr[i+1]]. This
+    is set by Synapses.compress(), or computed from the list of synapse
+    arrays if the queue is used on its own.
 """
 import numpy as np
 try:
@@ -56,10 +63,49 @@ from brian.monitor import SpikeMonitor
 from brian.stdunits import ms
 import warnings
 
-__all__=['SpikeQueue']
+__all__=['SpikeQueue', 'csr_index']
 
 INITIAL_MAXSPIKESPER_DT = 1
 
+def csr_index(synapses):
+    '''
+    Returns a CSR-style index ``(indptr, indices)`` of a list of synapse
+    arrays: ``indices`` is the concatenation of all the arrays and the
+    synapses of neuron ``i`` are ``indices[indptr[i]:indptr[i+1]]``.
+    '''
+    indptr = np.zeros(len(synapses)+1, dtype=int)
+    indptr[1:] = np.cumsum([len(targets) for targets in synapses])
+    if len(synapses):
+        dtype = synapses[0].dtype
+    else:
+        dtype = int
+    if indptr[-1]:
+        indices = np.array(np.hstack([targets[:] for targets in synapses]), dtype=dtype)
+    else:
+        indices = np.zeros(0, dtype=dtype)
+    return indptr, indices
+
+def gather_positions(indptr, spikes):
+    '''
+    Returns the positions in the CSR-style index ``(indptr, indices)`` of the
+    synapses of all the neurons in ``spikes`` (in order), and the number of
+    synapses of each neuron, without a loop over spikes.
+    '''
+    spikes = np.asarray(spikes, dtype=int)
+    starts = indptr[spikes]
+    counts = indptr[spikes+1]-starts
+    # Position of each event in indices: the start of the row of its spike
+    # plus its rank in the output minus the number of events of previous spikes
+    shifts = np.repeat(starts-(np.cumsum(counts)-counts), counts)
+    return np.arange(len(shifts))+shifts, counts
+
+def gather_synapses(indptr, indices, spikes):
+    '''
+    Returns the synapses of all the neurons in ``spikes`` (in order), using
+    the CSR-style index ``(indptr, indices)``, without a loop over spikes.
+    '''
+    return indices[gather_positions(indptr, spikes)[0]]
+
 class SpikeQueue(SpikeMonitor):
     '''Spike queue
     
@@ -85,9 +131,13 @@ class SpikeQueue(SpikeMonitor):
         A flag to precompute offsets. By default, offsets (an internal array
         derived from ``delays``, used to insert events in the data structure,
         see below)
-        are precomputed for all neurons, the first time the object is run.
-        This usually results in a speed up but takes memory, which is why it
-        can be disabled.
+        are precomputed for all neurons, the first time the object is run,
+        together with the delays of the synapses in the order of the CSR-style
+        index. The events of a single spike are then inserted without sorting,
+        and only the delays of the spiking neurons are sorted when several
+        neurons spike in the same timestep. This usually results in a speed
+        up but takes memory (two integers per synapse), which is why it can
+        be disabled.
 
     **Data structure** 
     
@@ -116,6 +166,12 @@ class SpikeQueue(SpikeMonitor):
         delays will not change during the simulation. If they do (between two
         runs for example), then this method can be called.
     
+    .. method:: set_synapse_index([indptr, indices])
+    
+        Sets the CSR-style index of synapses used to gather the synaptic
+        events of all the spikes of a timestep in a single operation. If
+        it is not given, it is calculated from ``synapses``.
+    
     **Offsets**
     
     Offsets are used to solve the problem of inserting multiple synaptic events with the
@@ -146,7 +202,10 @@ class SpikeQueue(SpikeMonitor):
         self.currenttime = 0
         self.n = np.zeros(nsteps, dtype = int) # number of events in each time step
         
-        self._offsets = None # precalculated offsets
+        self._offsets = None # precalculated offsets (in the order of _indices)
+        self._csr_delays = None # delays in the order of _indices
+        self._indptr = None # CSR-style index of synapses
+        self._indices = None
         
         # Compiled version
         self._useweave = get_global_preference('useweave')
@@ -179,10 +238,12 @@ class SpikeQueue(SpikeMonitor):
         if hasattr(self, '_iscompressed') and self._iscompressed:
             return
         self._iscompressed = True
+        if self._indptr is None:
+            self.set_synapse_index()
         # Adjust the maximum delay and number of events per timestep if necessary
         maxevents=self.X.shape[1]
         if maxevents==INITIAL_MAXSPIKESPER_DT: # automatic resize
-            maxevents=max(INITIAL_MAXSPIKESPER_DT,max([len(targets) for targets in self.synapses]))
+            maxevents=max(INITIAL_MAXSPIKESPER_DT,max(np.diff(self._indptr)))
         # Check if homogeneous delays
         if self._max_delay>0:
             self._homogeneous=False
@@ -223,16 +284,36 @@ class SpikeQueue(SpikeMonitor):
         #log_debug('brian.synapses.spikequeue', 'Updating delays...')
         self.delays = np.array(np.floor(delays/self.source.clock.dt), dtype = int)+1
     
+    def set_synapse_index(self, indptr=None, indices=None):
+        '''
+        Sets the CSR-style index of synapses: the synapses of neuron ``i``
+        are ``indices[indptr[i]:indptr[i+1]]``. If they are not given, they
+        are calculated from ``synapses``. Precomputed offsets are updated.
+        '''
+        if indptr is None:
+            indptr, indices = csr_index(self.synapses)
+        self._indptr = indptr
+        self._indices = indices
+        if self._offsets is not None or (self._precompute_offsets and
+                                         getattr(self, '_iscompressed', False)):
+            self.precompute_offsets()
+    
     def precompute_offsets(self):
         '''
         Precompute all offsets corresponding to delays. This assumes that
         delays will not change during the simulation. If they do (between two
         runs for example), then this method can be called.
         '''
-        self._offsets=[]
-        for i in range(len(self.synapses)):
-            delays=self.delays[self.synapses[i].data]
-            self._offsets.append(self.offsets(delays))
+        if self._indptr is None:
+            self._indptr, self._indices = csr_index(self.synapses)
+        # Offsets are calculated for all neurons at once, grouping synapses
+        # by presynaptic neuron and delay
+        nneurons = len(self._indptr)-1
+        neuron = np.repeat(np.arange(nneurons), np.diff(self._indptr))
+        delays = np.array(self.delays[self._indices], dtype=int)
+        ndelays = delays.max()+1 if len(delays) else 1
+        self._offsets = group_offsets(neuron*ndelays+delays)
+        self._csr_delays = delays
     
     def offsets(self, delay):
         '''
@@ -247,20 +328,7 @@ class SpikeQueue(SpikeMonitor):
         '''
         if self._useweave:
             return self.offsets_C(delay)
-        # We use merge sort because it preserves the input order of equal
-        # elements in the sorted output
-        I = np.argsort(delay,kind='mergesort')
-        xs = delay[I]
-        J = xs[1:]!=xs[:-1]
-        #K = xs[1:]==xs[:-1]
-        A = np.hstack((0, np.cumsum(J)))
-        #B = np.hstack((0, np.cumsum(K)))
-        B = np.hstack((0, np.cumsum(-J)))
-        BJ = np.hstack((0, B[J]))
-        ei = B-BJ[A]
-        ofs = np.zeros_like(delay)
-        ofs[I] = np.array(ei,dtype=ofs.dtype) # maybe types should be signed?
-        return ofs
+        return group_offsets(delay)
            
     def insert(self, delay, target, offset=None):
         '''
@@ -338,23 +406,31 @@ class SpikeQueue(SpikeMonitor):
         Spikes produce synaptic events that are inserted in the queue. 
         '''
         if len(spikes):
-#            print '(Python) In propagate: spikes = ', spikes
-            if self._homogeneous: # homogeneous delays
-                synaptic_events=np.hstack([self.synapses[i].data for i in spikes]) # could be not efficient
-                self.insert_homogeneous(self.delays[0],synaptic_events)
-            elif self._offsets is None: # vectorise over synaptic events
-                # there are no precomputed offsets, this is the case (in particular) when there are dynamic delays
-                synaptic_events=np.hstack([self.synapses[i].data for i in spikes])
-                if len(synaptic_events):
+            if self._indptr is None:
+                self.set_synapse_index()
+            offsets = delay = None
+            if len(spikes)==1: # the events are a contiguous part of the index
+                i = spikes[0]
+                start, end = self._indptr[i], self._indptr[i+1]
+                synaptic_events = self._indices[start:end]
+                if self._offsets is not None: # offsets are precomputed
+                    offsets = self._offsets[start:end]
+                    delay = self._csr_delays[start:end]
+            else: # vectorise over spikes and synaptic events
+                positions = gather_positions(self._indptr, spikes)[0]
+                synaptic_events = self._indices[positions]
+                if self._offsets is not None:
+                    delay = self._csr_delays[positions]
+            if len(synaptic_events):
+                if self._homogeneous: # homogeneous delays
+                    self.insert_homogeneous(self.delays[0],synaptic_events)
+                    return
+                if delay is None:
                     delay = self.delays[synaptic_events]
-                    self.insert(delay, synaptic_events)
-            else: # offsets are precomputed
-                for i in spikes:
-                    synaptic_events=self.synapses[i].data # assuming a dynamic array: could change at run time?    
-                    if len(synaptic_events):
-                        delay = self.delays[synaptic_events]
-                        offsets = self._offsets[i]
-                        self.insert(delay, synaptic_events, offsets)
+                # otherwise offsets are calculated at insertion from the
+                # delays of the spiking neurons only, this is the case when
+                # several neurons spike or when there are dynamic delays
+                self.insert(delay, synaptic_events, offsets)
 
     ######################################## C optimised versions
     def insert_C(self,delay,target):
@@ -413,6 +489,22 @@ class SpikeQueue(SpikeMonitor):
         res = 'SpikeQueue(shape = (%d, %d), ' % (self.X.shape)
         res += 'max_delay = %.1f ms)' % (self._max_delay/ms)
         return res
+
+def group_offsets(key):
+    '''
+    Returns the offsets of the elements of ``key`` among the elements with the
+    same value, in order, e.g. [7,5,7,3,7,5] -> [0,0,1,0,2,1].
+    '''
+    # We use merge sort because it preserves the input order of equal
+    # elements in the sorted output
+    I = np.argsort(key,kind='mergesort')
+    xs = key[I]
+    # start (in the sorted array) of the group of each element
+    J = np.hstack((True, xs[1:]!=xs[:-1]))
+    starts = np.maximum.accumulate(np.where(J, np.arange(len(xs)), 0))
+    ofs = np.zeros_like(key)
+    ofs[I] = np.array(np.arange(len(xs))-starts,dtype=ofs.dtype) # maybe types should be signed?
+    return ofs
         
     
 
@@ -453,6 +545,8 @@ try:
 
             self.synapses = synapses
             self.delays = delays # Delay handling should also be in C
+            self._indptr = None
+            self._indices = None
 
             _cspikequeue.SpikeQueue.__init__(self, nsteps, int(maxevents))
 
@@ -479,13 +573,22 @@ try:
             # Resize
 
             self.expand(int(maxevents))
+
+        def set_synapse_index(self, indptr=None, indices=None):
+            if indptr is None:
+                indptr, indices = csr_index(self.synapses)
+            self._indptr = indptr
+            self._indices = indices
+
         def propagate(self, spikes):
             '''
             Called by the network object at every timestep.
             Spikes produce synaptic events that are inserted in the queue. 
             '''
             if len(spikes):
-                synaptic_events=np.hstack([self.synapses[i].data for i in spikes]) # could be not efficient
+                if self._indptr is None:
+                    self.set_synapse_index()
+                synaptic_events=gather_synapses(self._indptr, self._indices, spikes)
                 self.insert(synaptic_events, self.delays[synaptic_events])   
         warnings.warn('Using C++ SpikeQueue')
 except ImportError:
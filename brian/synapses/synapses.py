@@ -16,7 +16,7 @@ from brian.log import log_debug, log_warn
 from brian.neurongroup import NeuronGroup
 from brian.optimiser import AffineFunction, symbolic_eval
 from brian.stdunits import ms
-from brian.synapses.spikequeue import SpikeQueue
+from brian.synapses.spikequeue import SpikeQueue, csr_index
 from brian.synapses.synaptic_equations import SynapticEquations
 from brian.synapses.synapticvariable import (SynapticDelayVariable, 
                                              SynapticVariable, slice_to_array)
@@ -145,6 +145,9 @@ class Synapses(NeuronGroup): # This way we inherit a lot of useful stuff
         The compiled codes to be executed on pre and postsynaptic spikes.
     ``namespaces``
         The namespaces for the pre and postsynaptic codes.
+    ``_kernels``
+        The same codes compiled as functions ``kernel(_synapses, t)`` (with
+        the namespace as globals), called at every timestep.
     '''
     def __init__(self, source, target = None, model = None, pre = None, post = None,
              max_delay = 0*ms,
@@ -323,11 +326,13 @@ class Synapses(NeuronGroup): # This way we inherit a lot of useful stuff
 
         self.contained_objects = []
         self.codes=[]
+        self._kernels=[]
         self.namespaces=[]
         self.queues=[]
         for i,pre in enumerate(pre_list):
             code,_namespace=self.generate_code(pre,level+1,code_namespace=code_namespace)
             self.codes.append(code)
+            self._kernels.append(compile_kernel(_namespace))
             self.namespaces.append(_namespace)
             
             if self.has_variable_delays:
@@ -340,6 +345,7 @@ class Synapses(NeuronGroup): # This way we inherit a lot of useful stuff
         if post is not None:
             code,_namespace=self.generate_code(post,level+1,direct=True,code_namespace=code_namespace)
             self.codes.append(code)
+            self._kernels.append(compile_kernel(_namespace))
             self.namespaces.append(_namespace)
             self.queues.append(SpikeQueue(self.target, self.synapses_post, self._delay_post, max_delay = max_delay))
 
@@ -392,6 +398,7 @@ class Synapses(NeuronGroup): # This way we inherit a lot of useful stuff
         _namespace['take'] = np.take
         _namespace['extract'] = np.extract
         _namespace['add'] = np.add
+        _namespace['subtract'] = np.subtract
         _namespace['hstack'] = np.hstack
 
         code = re.sub(r'\b' + 'rand\(\)', 'rand(n)', code)
@@ -429,8 +436,14 @@ class Synapses(NeuronGroup): # This way we inherit a lot of useful stuff
  
             return res
  
+        if not direct:
+            scatter_code_str = self.scatter_code(code, update_code)
         if direct: # direct update code, not caring about multiple accesses to postsynaptic variables
             code_str = '_post_neurons = _post[_synapses]\n'+update_code(code, '_synapses', '_post_neurons') + "\n"            
+        elif scatter_code_str is not None:
+            # postsynaptic variables are only incremented: vectorised over all
+            # synapses with add.at, which handles repeated postsynaptic neurons
+            code_str = scatter_code_str
         else:
             algo = 3
             if algo==0:
@@ -530,12 +543,61 @@ class Synapses(NeuronGroup): # This way we inherit a lot of useful stuff
         
         return compiled_code,_namespace
 
+    def scatter_code(self, code, update_code):
+        '''
+        Returns the code vectorised over all synaptic events if postsynaptic
+        variables are only modified by statements of the form ``v+=expr`` or
+        ``v-=expr``, where ``expr`` does not depend on the modified postsynaptic
+        variables, and None otherwise. The increments are accumulated with
+        ``add.at``, so that repeated postsynaptic neurons are correctly handled
+        without looping.
+        
+        ``update_code``
+            The function substituting variables in a statement (see generate_code).
+        '''
+        if not hasattr(np.add, 'at'): # Numpy < 1.8
+            return None
+        postsyn_vars = {}
+        for var in self.target.var_index:
+            if isinstance(var, str):
+                postsyn_vars[var + '_post'] = var
+                if var not in self.var_index: # synaptic variables come first
+                    postsyn_vars[var] = var
+        statements = []
+        modified = set()
+        for line in code.split('\n'):
+            if not line.strip():
+                continue
+            m = re.match(r'^\s*([A-Za-z_]\w*)\s*(\+=|-=|\*=|/=|=)(?!=)(.*)$', line)
+            if m is None: # not a simple assignment
+                return None
+            var, op, expr = m.groups()
+            expr = expr.strip()
+            if var in postsyn_vars:
+                if op not in ('+=', '-='):
+                    return None
+                modified.add(postsyn_vars[var])
+            statements.append((var, op, expr))
+        for var, op, expr in statements:
+            if modified.intersection(postsyn_vars.get(name) for name in get_identifiers(expr)):
+                return None
+        code_str = '_post_neurons = _post.data.take(_synapses)\n'
+        for var, op, expr in statements:
+            if var in postsyn_vars:
+                ufunc = {'+=': 'add', '-=': 'subtract'}[op]
+                code_str += '%s.at(_target_%s, _post_neurons, %s)\n' % (ufunc, postsyn_vars[var],
+                                                                      update_code(expr, '_synapses', '_post_neurons'))
+            else:
+                code_str += update_code(var + op + expr, '_synapses', '_post_neurons') + '\n'
+        return code_str
+
     # Pickling support
     def __getstate__(self):
         # code objects cannot be pickled, we therefore delete them and later
         # reconstruct them from the code strings (stored in the namespace)
         state = copy.copy(self.__dict__)
         state['codes'] = [None] * len(self.codes)
+        state['_kernels'] = [None] * len(self._kernels)
         # We cannot pickle module objects and numpy is included as 'np'
         for ns in state['namespaces']:
             for k, v in ns.iteritems():
@@ -549,6 +611,7 @@ class Synapses(NeuronGroup): # This way we inherit a lot of useful stuff
         for idx, (queue, namespace) in enumerate(zip(self.queues, self.namespaces)):
             self.codes[idx] = compile(namespace['_original_code_string'],
                                       "Synaptic code", "exec")
+            self._kernels[idx] = compile_kernel(namespace)
             # I"m not quite sure why, but this seems to be necessary
             for postsyn_var in self.target.var_index:
                 if isinstance(postsyn_var, str):
@@ -800,16 +863,22 @@ class Synapses(NeuronGroup): # This way we inherit a lot of useful stuff
         if self._state_updater is not None:
             self._state_updater(self)
 
-        for queue, _namespace, code in zip(self.queues, self.namespaces, self.codes):
+        for k, (queue, _namespace) in enumerate(zip(self.queues, self.namespaces)):
             synaptic_events = queue.peek()
             if len(synaptic_events):
-                # Build the namespace - Here we don't consider static equations
-                _namespace['_synapses'] = synaptic_events
-                _namespace['t'] = self.clock._t
-                exec code in _namespace
+                # Here we don't consider static equations
+                self.process_events(k, synaptic_events)
             queue.next()
             if self.has_variable_delays:
                 queue._update_delays(_namespace['delay'])#self._S[self.var_index['delay'],:])
+
+    def process_events(self, k, synaptic_events):
+        '''
+        Executes the code of queue ``k`` (the presynaptic codes, then the
+        postsynaptic code) for the synapses ``synaptic_events`` of the
+        current time step.
+        '''
+        self._kernels[k](synaptic_events, self.clock._t)
             
     def connect_one_to_one(self,pre=None,post=None):
         '''
@@ -895,6 +964,7 @@ class Synapses(NeuronGroup): # This way we inherit a lot of useful stuff
         '''
         * Checks that the object is not empty.
         * Make the state array non-dynamical (important for the state updater).
+        * Builds the flat (CSR-style) synapse indexes of the spike queues.
         * Updates namespaces of pre and post code.
         '''
         if hasattr(self, '_iscompressed') and self._iscompressed:
@@ -905,6 +975,14 @@ class Synapses(NeuronGroup): # This way we inherit a lot of useful stuff
             warnings.warn("Empty Synapses object")
         self._S=self._S[:,:]
         
+        # Flat synapse indexes (CSR), shared by the queues with the same synapses
+        indexes={}
+        for queue in self.queues:
+            key=id(queue.synapses)
+            if key not in indexes:
+                indexes[key]=csr_index(queue.synapses)
+            queue.set_synapse_index(*indexes[key])
+        
         # Update namespaces of pre/post code        
         for _namespace in self.namespaces:
             for var,i in self.var_index.iteritems(): # no static variables here
@@ -1041,6 +1119,34 @@ class Synapses(NeuronGroup): # This way we inherit a lot of useful stuff
     def __repr__(self):
         return 'Synapses object with '+ str(len(self))+ ' synapses'
 
+def compile_kernel(_namespace):
+    '''
+    Compiles the synaptic code stored in ``_namespace`` into a function
+    ``kernel(_synapses, t)`` whose global namespace is ``_namespace``.
+    Calling it is equivalent to executing the code in the namespace, with
+    the values of ``_synapses`` and ``t`` as local variables.
+    
+    The names that the code assigns are local variables of the function, so
+    if one of them is also in the namespace (e.g. ``total = total + w``), the
+    code is instead executed in the namespace, after setting ``_synapses``
+    and ``t`` in it.
+    '''
+    code_str = _namespace['_original_code_string']
+    kernel_str = 'def _kernel(_synapses, t):\n' + indent(code_str) + '\n'
+    kernel_code = compile(kernel_str, "Synaptic code", "exec")
+    kernel_namespace = {}
+    exec kernel_code in kernel_namespace
+    kernel = kernel_namespace['_kernel']
+    if not any(name in _namespace for name in kernel.func_code.co_varnames):
+        exec kernel_code in _namespace
+        return _namespace.pop('_kernel')
+    code = compile(code_str, "Synaptic code", "exec")
+    def _kernel(_synapses, t):
+        _namespace['_synapses'] = _synapses
+        _namespace['t'] = t
+        exec code in _namespace
+    return _kernel
+
 def smallest_inttype(N):
     '''
     Returns the smallest signed integer dtype that can store N indexes.
@@ -254,6 +254,110 @@ def test_poissoninput():
     #only checks that there some spikes
     assert (m.nspikes >= 1)
 
+def test_poissoninput_jitter():
+    '''
+    Test that the jittered copies of the Poisson events are all delivered:
+    without jitter they are identical to a single input with the weight of
+    all the copies, and with jitter they are delivered later.
+    '''
+    import numpy
+    results = []
+    for weight, copies, jitter in [(1., 1, None), (.25, 4, 0 * ms)]:
+        reinit_default_clock()
+        numpy.random.seed(3)
+        group = NeuronGroup(1000, model='v : 1')
+        input = PoissonInput(group, N=10, rate=50 * Hz, weight=weight,
+                             copies=copies, jitter=jitter, state='v')
+        net = Network(group, input)
+        net.run(100 * ms)
+        results.append(group.v.copy())
+    assert (results[0] == results[1]).all()
+
+    reinit_default_clock()
+    group = NeuronGroup(1000, model='v : 1')
+    input = PoissonInput(group, N=10, rate=10 * Hz, weight=1., copies=5,
+                         jitter=10 * ms, state='v')
+    net = Network(group, input)
+    net.run(1 * second)
+    # 10*10*5 copies per neuron, the last ones are not delivered yet
+    expected = 1000 * 10 * 10 * 5 * (1 - 10 * ms / second)
+    assert abs(group.v.sum() - expected) < 0.03 * expected
+    # the scheduled copies are removed by reinit
+    net.reinit()
+    group.v = 0
+    input.rate = 0 * Hz
+    net.run(100 * ms)
+    assert (group.v == 0).all()
+
+def test_spikegeneratorgroup_arrays():
+    '''
+    Test that arrays of spikes sorted or not, record arrays and memory-mapped
+    files give the same spikes, and the computation of the offsets by blocks.
+    '''
+    import os
+    import numpy
+    import tempfile
+    from brian.directcontrol import spike_offsets, FastSpikeGeneratorThreshold
+    numpy.random.seed(5)
+    dt = float(defaultclock.dt)
+    times = numpy.sort(numpy.random.rand(2000)) * 0.05
+    times[100:110] = times[100] # simultaneous spikes
+    indices = numpy.random.randint(0, 10, len(times))
+    steps = numpy.array(numpy.ceil(times / dt), dtype=int)
+    offsets = numpy.hstack((0, numpy.cumsum(numpy.bincount(steps))))
+    for blocksize in [1, 7, 100, 10000]:
+        assert (spike_offsets(times, dt, blocksize=blocksize) == offsets).all()
+    assert_raises(ValueError, spike_offsets, times[::-1], dt)
+
+    spikes = numpy.zeros(len(times), dtype=[('i', numpy.int32), ('t', float)])
+    spikes['i'] = indices
+    spikes['t'] = times
+    fd, filename = tempfile.mkstemp(suffix='.npy')
+    os.close(fd)
+    numpy.save(filename, spikes)
+    shuffle = numpy.random.permutation(len(times))
+    expected = sorted(zip(indices, steps))
+    try:
+        for spiketimes, period in [((indices, times), None),
+                                   ((indices[shuffle], times[shuffle]), None),
+                                   (spikes, None), (filename, None),
+                                   (numpy.vstack((indices, times)).T, None),
+                                   ((indices, times), 20 * ms)]:
+            reinit_default_clock()
+            G = SpikeGeneratorGroup(10, spiketimes, period=period)
+            M = SpikeMonitor(G)
+            net = Network(G, M)
+            net.run(60 * ms)
+            result = sorted((i, int(round(t / dt))) for i, t in M.spikes)
+            if period is None:
+                assert result == expected
+            else:
+                # spikes in the first 20 ms, repeated three times
+                first = [(i, s) for i, s in expected if s < 200]
+                assert result == sorted([(i, s + k * 200) for k in range(3)
+                                         for i, s in first])
+        assert_raises(ValueError, SpikeGeneratorGroup, 10,
+                      (indices[shuffle], times[shuffle]), sort=False)
+        # the spikes of a time step are sorted by neuron index, unless
+        # sort=False, in which case the arrays are not copied
+        for sort in [True, False]:
+            thresh = FastSpikeGeneratorThreshold(10, indices, times, dt=dt,
+                                                 sort=sort)
+            I = thresh.I[thresh.offsets[steps[100]]:thresh.offsets[steps[100]+1]]
+            assert len(I) == 10
+            if sort:
+                assert (numpy.diff(I) >= 0).all()
+            else:
+                assert thresh.I is indices and (I == indices[100:110]).all()
+        order = numpy.lexsort((indices, steps))
+        sorted_indices = indices[order]
+        thresh = FastSpikeGeneratorThreshold(10, sorted_indices, times[order],
+                                             dt=dt)
+        assert thresh.I is sorted_indices
+    finally:
+        os.remove(filename)
+
 if __name__ == '__main__':
     test()
     test_poissoninput()
+    test_spikegeneratorgroup_arrays()
@@ -179,6 +179,68 @@ def test_shifting():
         assert_equal(shifted[:10*ms, channel],
                      silence(duration=10*ms, samplerate=10*kHz))
     
+
+def test_lazysound():
+    ''' Test sounds read from a file as they are needed '''
+    import os, tempfile, shutil, struct
+    tmpdir = tempfile.mkdtemp()
+    try:
+        sound = Sound(0.5*sin(arange(1000)*array([[0.01], [0.03]])).T,
+                      samplerate=44.1*kHz)
+        sound.save(os.path.join(tmpdir, 'sound.wav'))
+        loaded = loadsound(os.path.join(tmpdir, 'sound.wav'))
+        lazy = loadsound(os.path.join(tmpdir, 'sound.wav'), mmap=True)
+        assert isinstance(lazy, LazySound)
+        assert abs(asarray(loaded)-asarray(sound)).max()<2.**-15
+        assert_equal(asarray(Sound(lazy)), asarray(loaded))
+        assert lazy.duration==loaded.duration and lazy.nchannels==2
+        # slicing
+        assert_equal(asarray(Sound(lazy[10*ms:20*ms, 1])),
+                     asarray(loaded[10*ms:20*ms, 1]))
+        assert_equal(lazy.right[100:200:2].read(), loaded.right[100:200:2])
+        assert_equal(lazy[5], asarray(loaded[5]))
+        # buffers are zero padded after the end of the sound
+        output = lazy.buffer_fetch(990, 1010)
+        assert_equal(output[:10], asarray(loaded)[990:])
+        assert_equal(output[10:], 0)
+        fb = Gammatone(lazy, [300*Hz, 1*kHz])
+        assert_equal(asarray(fb.process(buffersize=37)),
+                     asarray(Gammatone(loaded, [300*Hz, 1*kHz]).process(buffersize=37)))
+        # raw PCM data
+        (asarray(sound)*2**15).astype(int16).tofile(os.path.join(tmpdir,
+                                                                 'sound.raw'))
+        raw = LazySound(os.path.join(tmpdir, 'sound.raw'),
+                        samplerate=44.1*kHz, nchannels=2, dtype='int16')
+        assert_equal(raw.read(), asarray(loaded))
+        # the samples are found after other chunks
+        wav = open(os.path.join(tmpdir, 'sound.wav'), 'rb').read()
+        riff = wav[12:].index('data')+12
+        extra = 'LIST'+struct.pack('<L', 5)+'abcde\0'
+        with open(os.path.join(tmpdir, 'extra.wav'), 'wb') as f:
+            f.write('RIFF'+struct.pack('<L', len(wav)-8+len(extra))+wav[8:riff]+
+                    extra+wav[riff:])
+        extra = LazySound(os.path.join(tmpdir, 'extra.wav'))
+        assert isinstance(extra.data, memmap)
+        assert_equal(extra.read(), asarray(loaded))
+        # a truncated file is read into memory
+        with open(os.path.join(tmpdir, 'truncated.wav'), 'wb') as f:
+            f.write(wav[:-400])
+        truncated = LazySound(os.path.join(tmpdir, 'truncated.wav'))
+        assert not isinstance(truncated.data, memmap)
+        assert_equal(truncated.read(), asarray(loaded)[:-100])
+        import aifc
+        f = aifc.open(os.path.join(tmpdir, 'sound.aif'), 'w')
+        f.setparams((2, 2, 44100, 1000, 'NONE', 'not compressed'))
+        f.writeframes((asarray(loaded)*2**15).astype('>i2').tostring())
+        f.close()
+        aiff = loadsound(os.path.join(tmpdir, 'sound.aif'), mmap=True)
+        assert isinstance(aiff.data, memmap)
+        assert_equal(aiff.read(), asarray(loaded))
+        del lazy, raw, fb, extra, aiff
+    finally:
+        shutil.rmtree(tmpdir)
+
+
 @repeat_with_global_opts([{'useweave': False},
                           {'useweave': True}])
 def test_linear_filtering():
@@ -189,6 +251,353 @@ def test_linear_filtering():
     assert_equal(np.asarray(original_sound), np.asarray(sound))
 
 
+def test_fir_filtering():
+    ''' Test FFT based FIR filtering against direct convolution '''
+    sound = Sound(randn(1000, 2), samplerate=44.1*kHz)
+    for ir_length in [1, 100, 300]:
+        ir = randn(2, ir_length)
+        expected = array([convolve(sound[:, i].flatten(), ir[i])[:len(sound)]
+                          for i in range(2)]).T
+        for buffersize, partition_size in [(32, None), (7, None), (100, 16),
+                                           (1000, 64)]:
+            fb = FIRFilterbank(sound, ir, partition_size=partition_size)
+            output = asarray(fb.process(buffersize=buffersize))
+            assert abs(output-expected).max()<1e-10
+        # the same impulse response for all channels
+        fb = FIRFilterbank(sound, ir[0])
+        output = asarray(fb.process(buffersize=50))
+        assert abs(output[:, 1]-convolve(sound[:, 1].flatten(),
+                                         ir[0])[:len(sound)]).max()<1e-10
+
+
+def test_resample():
+    ''' Test the streaming resampler against pure tones '''
+    freqs = array([200., 1000., 3000.])
+    for samplerate, new_samplerate in [(44.1*kHz, 48*kHz), (48*kHz, 16*kHz),
+                                       (20*kHz, 20*kHz)]:
+        sound = Sound(lambda t: sin(2*pi*t[:, newaxis]*freqs),
+                      samplerate=samplerate, duration=50*ms)
+        fb = ResampleFilterbank(sound, new_samplerate)
+        assert fb.samplerate==new_samplerate
+        output = asarray(fb.process(buffersize=37))
+        assert_equal(output, asarray(fb.process(buffersize=1000)))
+        assert output.shape==(int(50*ms*new_samplerate), 3)
+        t = arange(len(output))/float(new_samplerate)
+        expected = sin(2*pi*t[:, newaxis]*freqs)
+        # away from the edges of the sound
+        assert abs(output-expected)[len(t)//5:-len(t)//5].max()<1e-4
+    # frequencies above the new Nyquist frequency are removed
+    sound = tone(10*kHz, 50*ms, samplerate=48*kHz)
+    output = asarray(ResampleFilterbank(sound, 16*kHz).process())
+    assert abs(output[200:-200]).max()<1e-4
+
+
+@repeat_with_global_opts([{'useweave': False},
+                          {'useweave': True}])
+def test_linear_filterbank_buffers():
+    ''' Test that the filter state is kept across buffers of any size '''
+    from scipy.signal import lfilter
+    sound = Sound(randn(1000, 1), samplerate=44.1*kHz)
+    cf = erbspace(100*Hz, 10*kHz, 3)
+    fb = Gammatone(sound, cf)
+    expected = zeros((len(sound), len(cf)))
+    for i in range(len(cf)):
+        x = asarray(sound).flatten()
+        for k in range(fb.filt_b.shape[2]):
+            x = lfilter(fb.filt_b[i, :, k], fb.filt_a[i, :, k], x)
+        expected[:, i] = x
+    for buffersize in [1, 7, 32, 1000]:
+        output = asarray(Gammatone(sound, cf).process(buffersize=buffersize))
+        assert abs(output-expected).max()<1e-10*abs(expected).max()
+
+
+def test_linear_filterbank_kernels():
+    ''' Test that both numpy/scipy kernels of LinearFilterbank give the same output '''
+    from brian.hears.filtering.linearfilterbank import (
+        _lfilter_apply_linear_filterbank, _loop_apply_linear_filterbank)
+    sound = Sound(randn(1000, 1), samplerate=44.1*kHz)
+    for nchannels in [1, 5, 50]:
+        fb = Gammatone(sound, erbspace(100*Hz, 10*kHz, nchannels))
+        x = randn(100, nchannels)
+        states = [randn(*fb.filt_state.shape) for _ in range(2)]
+        states[1][:] = states[0]
+        outputs = [kernel(fb.filt_b, fb.filt_a, x, state)
+                   for kernel, state in zip([_lfilter_apply_linear_filterbank,
+                                             _loop_apply_linear_filterbank],
+                                            states)]
+        assert_equal(outputs[0], outputs[1])
+        assert_equal(states[0], states[1])
+
+
+def test_buffer_output():
+    ''' Test filterbanks writing into preallocated output buffers '''
+    sound = Sound(randn(1000, 2), samplerate=44.1*kHz)
+    cf = erbspace(100*Hz, 5*kHz, 4)
+    expected = asarray(Gammatone(Interleave(sound, sound), cf).process())
+    for buffersize in [1, 7, 100]:
+        fb = Gammatone(Interleave(sound, sound), cf)
+        output = asarray(fb.process(buffersize=buffersize))
+        assert_equal(output, expected)
+    # consecutive buffers of the source of a filterbank alternate between two
+    # preallocated arrays
+    fb = Gammatone(Interleave(sound, sound), cf)
+    fb.buffer_init()
+    outputs = [fb.source.buffer_fetch(i*32, (i+1)*32) for i in range(5)]
+    assert outputs[1].base is outputs[3].base
+    assert outputs[2].base is outputs[4].base
+    assert outputs[1].base is not outputs[2].base
+    # but the buffers fetched from the last filterbank can be kept
+    fb = Gammatone(Interleave(sound, sound), cf)
+    fb.buffer_init()
+    outputs = [fb.buffer_fetch(i*32, (i+1)*32) for i in range(5)]
+    assert_equal(vstack(outputs), expected[:160])
+    for pipeline in [False, True]:
+        fb = Gammatone(Interleave(sound, sound), cf)
+        outputs = []
+        fb.process(lambda x: outputs.append(x), pipeline=pipeline)
+        assert_equal(vstack(outputs), expected)
+        outputs = fb.process(lambda x, running: (running or [])+[x],
+                             pipeline=pipeline)
+        assert_equal(vstack(outputs), fb.process())
+    # segments larger than the maximum buffer size are split
+    fb = Gammatone(Interleave(sound, sound), cf)
+    fb.maximum_buffer_size = 30
+    fb.buffer_init()
+    assert_equal(fb.buffer_fetch(0, 100), expected[:100])
+
+
+@repeat_with_global_opts([{'useweave': False},
+                          {'useweave': True}])
+def test_control_batch():
+    ''' Test that batched ControlFilterbank updates give the same output '''
+    from brian.hears.filtering import dcgc
+    sound = Sound(randn(500, 1), samplerate=44.1*kHz)
+    cf = array([200*Hz, 1*kHz, 5*kHz])
+    # first order low pass filters, with a cutoff frequency that depends on
+    # the last sample of the previous update interval
+    class Updater(object):
+        def __init__(self, target):
+            self.target = target
+        def coefficients(self, x):
+            g = exp(-2*pi*cf*(1+abs(x))/sound.samplerate)
+            b = zeros(x.shape+(2, 1))
+            a = zeros(x.shape+(2, 1))
+            b[..., 0, 0] = 1-g
+            a[..., 0, 0] = 1
+            a[..., 1, 0] = -g
+            return b, a
+        def __call__(self, input):
+            b, a = self.coefficients(input[-1])
+            self.target.filt_b = array(b, order='F')
+            self.target.filt_a = array(a, order='F')
+    class BatchUpdater(Updater):
+        def batch(self, ends, input):
+            return self.coefficients(input[ends-1])
+    def lowpass(updater_class, update_interval, buffersize):
+        source = RestructureFilterbank(sound, len(cf))
+        target = LinearFilterbank(source, *Updater(None).coefficients(zeros(len(cf))))
+        control = ControlFilterbank(target, source, target,
+                                    updater_class(target), update_interval)
+        assert control.batched==hasattr(updater_class, 'batch')
+        return asarray(control.process(buffersize=buffersize))
+    # the update intervals start again at each buffer in both cases
+    for update_interval in [1, 3, 16]:
+        for buffersize in [7, 32, 100]:
+            assert_equal(lowpass(BatchUpdater, update_interval, buffersize),
+                         lowpass(Updater, update_interval, buffersize))
+    # DCGC, with the batch method of its updater hidden
+    batch = dcgc.AsymCompUpdate.batch
+    del dcgc.AsymCompUpdate.batch
+    try:
+        expected = asarray(DCGC(sound, cf, update_interval=3).process())
+    finally:
+        dcgc.AsymCompUpdate.batch = batch
+    assert_equal(asarray(DCGC(sound, cf, update_interval=3).process()),
+                 expected)
+
+
+def test_pipeline():
+    ''' Test that pipelined processing gives the same results '''
+    sound = whitenoise(20*ms, samplerate=50*kHz)
+    cf = erbspace(100*Hz, 5*kHz, 5)
+    ir = randn(5, 64)
+    def models():
+        gammatone = Gammatone(sound, cf)
+        rectified = FunctionFilterbank(gammatone, lambda x: clip(x, 0, Inf))
+        fir = FIRFilterbank(rectified, ir, minimum_buffer_size=100)
+        yield LowPass(fir, 100*Hz)
+        yield FunctionFilterbank(DRNL(sound, cf), lambda x: x**2)
+        yield DCGC(sound, cf, update_interval=20)
+        gammatone = Gammatone(sound, cf)
+        yield gammatone+2*gammatone
+    for fb, fb_pipeline in zip(models(), models()):
+        source = fb_pipeline.source
+        output = asarray(fb.process(buffersize=32))
+        output_pipeline = asarray(fb_pipeline.process(buffersize=32,
+                                                      pipeline=True))
+        assert_equal(output, output_pipeline)
+        assert fb_pipeline.source is source
+    # errors are raised in the main thread
+    def fail(x):
+        raise ValueError('fail')
+    fb = LowPass(FunctionFilterbank(Gammatone(sound, cf), fail), 100*Hz)
+    assert_raises(ValueError, lambda: fb.process(pipeline=True))
+
+
+def test_processes():
+    ''' Test processing the channels in several processes '''
+    sound = whitenoise(20*ms, samplerate=50*kHz)
+    cf = erbspace(100*Hz, 5*kHz, 5)
+    multichannel_sound = Sound(randn(1000, 5), samplerate=50*kHz)
+    ir = randn(5, 30)
+    models = [lambda: Gammatone(sound, list(cf)),
+              lambda: DRNL(sound, cf),
+              lambda: LowPass(Gammatone(sound, cf), 100*Hz),
+              lambda: FIRFilterbank(multichannel_sound, ir)]
+    for model in models:
+        output = asarray(model().process())
+        assert_equal(asarray(model().process(processes=2)), output)
+        assert_equal(model().process(lambda x, s: s+sum(x, axis=0),
+                                     processes=3),
+                     model().process(lambda x, s: s+sum(x, axis=0)))
+    # only some channels
+    output = asarray(Gammatone(sound, cf).process())
+    fb = Gammatone(sound, cf).select_channels([1, 3])
+    assert_equal(asarray(fb.process()), output[:, [1, 3]])
+    # the upstream filterbanks are restricted too, shared ones only once
+    gfb = Gammatone(sound, cf)
+    fb = (FunctionFilterbank(gfb, abs)+gfb).select_channels([1, 3])
+    assert fb.source[0].source[0] is fb.source[1]
+    assert isinstance(fb.source[1], Gammatone) and fb.source[1].nchannels==2
+    assert_equal(asarray(fb.process()), abs(output[:, [1, 3]])+output[:, [1, 3]])
+    # arguments that are not per channel are kept
+    coeffs = array([1., -2., 0.5, 3., 0.])
+    fb = FunctionFilterbank(Gammatone(sound, cf),
+                            lambda x, coeffs: polyval(coeffs, x),
+                            coeffs=coeffs).select_channels([1, 3])
+    assert_equal(asarray(fb.process()), polyval(coeffs, output[:, [1, 3]]))
+    # a 1D impulse response is shared by all the channels, even when its
+    # length is the number of channels
+    sound8 = Sound(randn(1000, 8), samplerate=50*kHz)
+    ir8 = randn(8)
+    for use_linearfilterbank in [False, True]:
+        model = lambda: FIRFilterbank(sound8, ir8,
+                                      use_linearfilterbank=use_linearfilterbank)
+        output = asarray(model().process())
+        fb = model().select_channels([1, 3])
+        assert abs(asarray(fb.process())-output[:, [1, 3]]).max()<1e-10
+        assert abs(asarray(model().process(processes=2))-output).max()<1e-10
+    # filterbanks which do not declare their per-channel arguments
+    fb = RestructureFilterbank(Gammatone(sound, cf), indexmapping=[0, 0, 4])
+    assert_raises(ValueError, lambda: fb.select_channels([1]))
+    # errors in the processes
+    def fail(x):
+        raise ValueError('fail')
+    fb = FunctionFilterbank(multichannel_sound, fail)
+    assert_raises(RuntimeError, lambda: fb.process(processes=2))
+    # a traceback larger than the buffer of the pipe
+    def fail_long(x):
+        raise ValueError('fail'*100000)
+    fb = FunctionFilterbank(multichannel_sound, fail_long)
+    assert_raises(RuntimeError, lambda: fb.process(processes=2))
+    # processes which exit without reporting
+    import os
+    def crash(x):
+        os._exit(3)
+    fb = FunctionFilterbank(multichannel_sound, crash)
+    assert_raises(RuntimeError, lambda: fb.process(processes=2))
+
+
+def test_hrtfset_index():
+    ''' Test the lookups and interpolation of HRTFSet '''
+    azim, elev = meshgrid(arange(0, 360, 15), arange(-45, 91, 15))
+    azim, elev = azim.flatten(), elev.flatten()
+    coords = make_coordinates(azim=azim, elev=elev)
+    data = randn(2, len(azim), 16)
+    hrtfset = HRTFSet(data, 44.1*kHz, coords, spherical=('azim', 'elev'))
+    assert hrtfset.get_index(azim=30, elev=-15)==((azim==30)&(elev==-15)).nonzero()[0][0]
+    assert_raises(IndexError, hrtfset.get_index, azim=31, elev=-15)
+    assert_raises(IndexError, hrtfset.get_index, azim=30)
+    # nearest neighbours on the sphere
+    points = array([cos(elev*pi/180)*cos(azim*pi/180),
+                    cos(elev*pi/180)*sin(azim*pi/180), sin(elev*pi/180)])
+    for a, e in [(3, 2), (359, -44), (100, 80), (200, 7)]:
+        p = array([cos(e*pi/180)*cos(a*pi/180),
+                   cos(e*pi/180)*sin(a*pi/180), sin(e*pi/180)])
+        distances = sum((points-p[:, newaxis])**2, axis=0)
+        assert hrtfset.nearest(azim=a, elev=e)==argmin(distances)
+        assert_equal(hrtfset.nearest(k=4, azim=a, elev=e),
+                     argsort(distances, kind='mergesort')[:4])
+    assert_raises(ValueError, hrtfset.nearest, azim=10)
+    # interpolation
+    assert hrtfset.interpolate(azim=30, elev=-15) is hrtfset(azim=30, elev=-15)
+    hrtf = hrtfset.interpolate(k=2, azim=37.5, elev=0)
+    expected = 0.5*(data[:, hrtfset.get_index(azim=30, elev=0), :]+
+                    data[:, hrtfset.get_index(azim=45, elev=0), :])
+    assert abs(asarray(hrtf.impulse_response).T-expected).max()<1e-12
+    assert hrtfset.interpolate(k=2, azim=37.5, elev=0) is hrtf
+    # the index of a subset is rebuilt
+    subset = hrtfset.subset(lambda elev: elev==0)
+    assert subset.nearest(azim=3, elev=20)==subset.get_index(azim=0, elev=0)
+    # applying the same HRTF to sounds of the same length reuses its FFT
+    sound = whitenoise(5*ms, samplerate=44.1*kHz)
+    left = asarray(hrtf(sound))[:, 0]
+    assert abs(left-convolve(asarray(sound).flatten(),
+                             asarray(hrtf.left).flatten())[:len(sound)]).max()<1e-10
+    assert_equal(asarray(hrtf(sound))[:, 0], left)
+
+
+def test_ircam_cache():
+    ''' Test the binary cache of IRCAM_LISTEN '''
+    import os, tempfile, shutil
+    from scipy.io import savemat
+    basedir = tempfile.mkdtemp()
+    try:
+        # a database with one subject in the format of the MATLAB files
+        azim = array([0., 15., 30., 0.])
+        elev = array([0., 0., 0., 15.])
+        l, r = randn(4, 64), randn(4, 64)
+        # a smooth impulse response, with a DC gain (sum) of about 7
+        l[3] = exp(-((arange(64)-20)/4.)**2)
+        matdir = os.path.join(basedir, 'IRCAM', 'IRC_1002', 'RAW', 'MAT', 'HRIR')
+        os.makedirs(matdir)
+        matfile = os.path.join(matdir, 'IRC_1002_R_HRIR.mat')
+        savemat(matfile,
+                {'l_hrir_S': {'azim_v': azim[:, newaxis], 'elev_v': elev[:, newaxis],
+                              'content_m': l},
+                 'r_hrir_S': {'azim_v': azim[:, newaxis], 'elev_v': elev[:, newaxis],
+                              'content_m': r}})
+        ircam = os.path.join(basedir, 'IRCAM')
+        cachedir = os.path.join(basedir, 'cache')
+        hrtfset = IRCAM_LISTEN(ircam).load_subject(1002)
+        assert_equal(hrtfset.data[0], l)
+        assert_equal(asarray(hrtfset(azim=15, elev=0).right).flatten(), r[1])
+        cached = IRCAM_LISTEN(ircam, cachedir=cachedir).load_subject(1002)
+        assert_equal(cached.data, hrtfset.data)
+        # the MATLAB files are not used once the subject is in the cache
+        os.remove(matfile)
+        cached = IRCAM_LISTEN(ircam, cachedir=cachedir).load_subject(1002)
+        assert_equal(cached.data, hrtfset.data)
+        assert_equal(cached.coordinates, hrtfset.coordinates)
+        assert float(cached.samplerate)==44100
+        # resampled from the cache, and cached as well
+        db = IRCAM_LISTEN(ircam, samplerate=22.05*kHz, cachedir=cachedir)
+        resampled = db.load_subject(1002)
+        assert resampled.data.shape==(2, 4, 32)
+        # the gain of the filters does not change
+        gain = resampled.data[0, 3].sum()
+        assert abs(gain-l[3].sum())<1e-3*l[3].sum()
+        tone = Sound(ones(200), samplerate=22.05*kHz)
+        output = asarray(resampled(azim=0, elev=15)(tone))[:, 0]
+        assert abs(output[-1]-gain)<1e-10
+        assert float(resampled.samplerate)==22050
+        assert os.path.exists(db.cache_filename('1002', 22.05*kHz, False, 'hrir'))
+        assert_equal(db.load_subject(1002).data, resampled.data)
+        assert_raises(IOError, IRCAM_LISTEN(ircam).load_subject, 1002)
+    finally:
+        shutil.rmtree(basedir)
+
+
 @repeat_with_global_opts([{'useweave': False},
                           {'useweave': True}])
 def test_multichannel_processing():
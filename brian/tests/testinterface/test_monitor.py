@@ -129,6 +129,25 @@ def test_spikemonitor():
     assert(len(M[0]) == len(M.spiketimes[0]) == 2 and 
            len(M[1]) == len(M.spiketimes[1]) == 1)
     assert((M.spiketimes[0] == M[0]).all() and (M.spiketimes[1] == M[1]).all())
+    
+    # test the arrays of indices and times
+    i, t = M.it
+    assert (i.dtype == int32 and t.dtype == float64)
+    assert ((i == [0, 1, 0]).all())
+    assert ((abs(t - array([3, 4, 7]) * 0.001) < 1e-10).all())
+    
+    # spikes recorded in a second run are appended
+    G.reinit()
+    reinit_default_clock()
+    net.run(10 * ms)
+    assert (M.nspikes == 6 and len(M.spikes) == 6)
+    assert ((M.it[0] == [0, 1, 0, 0, 1, 0]).all())
+    assert ((abs(M[0] - array([3, 7, 3, 7]) * 0.001) < 1e-10).all())
+    assert ((abs(M[1] - array([4, 4]) * 0.001) < 1e-10).all())
+
+    # test that the spikes can be set as a list of pairs
+    M.spikes = spikes
+    assert ((M.it[0] == [0, 1, 0]).all() and len(M[0]) == 2)
 
     # test that spiketimes are cleared on reinit
     
@@ -267,7 +286,101 @@ def test_counter():
     assert(len(M[1]) == C[1] == C.count[1] == 0)
     
     reinit_default_clock() # for next test
-    
+
+
+def test_statemonitor_chunks():
+    '''
+    Tests that :class:`StateMonitor` recordings are consistent across runs
+    and with a ``max_memory`` budget, for which values are stored on disk.
+    '''
+    reinit_default_clock()
+    G = NeuronGroup(4, model='dV/dt = 1/second : 1')
+    M = StateMonitor(G, 'V', record=True)
+    Mmem = StateMonitor(G, 'V', record=[1, 3], max_memory=2 * 8 * 7)
+    MM = MultiStateMonitor(G, record=True, timestep=3, max_memory=4 * 8 * 5)
+    net = Network(G, M, Mmem, MM)
+    net.run(5 * ms)
+    # a single run fits in one preallocated chunk
+    assert M.values.shape == (4, 50)
+    assert M.values.T.flags['C_CONTIGUOUS']
+    net.run(3 * ms)
+    t = arange(80) * float(defaultclock.dt)
+    assert (abs(M.times - t) < 1e-12).all()
+    assert (abs(M[2] - t - float(defaultclock.dt)) < 1e-12).all()
+    assert M.values.shape == (4, 80)
+    assert (abs(Mmem.times - t) < 1e-12).all()
+    assert (Mmem.values == M.values[[1, 3]]).all()
+    assert len(Mmem._chunks) == 1 and Mmem._tempdir is not None
+    assert (MM['V'].values == M.values[:, ::3]).all()
+    assert (MM.times == M.times[::3]).all()
+    net.reinit()
+    assert M.values.shape == (4, 0) and len(M.times) == 0
+    assert Mmem._tempdir is None
+    # reading the values during the runs only appends the new recordings to
+    # the merged buffer, which grows geometrically
+    reinit_default_clock()
+    buffers = []
+    @network_operation(when='end')
+    def read_values():
+        assert M.values.shape == (4, len(M.times))
+        assert Mmem.values.shape == (2, len(Mmem.times))
+        if M._merged is not None and (not buffers or
+                                      M._merged[0] is not buffers[-1]):
+            buffers.append(M._merged[0])
+    net = Network(G, M, Mmem, read_values)
+    net.run(5 * ms)
+    net.run(5 * ms)
+    t = arange(100) * float(defaultclock.dt)
+    assert (abs(M.times - t) < 1e-12).all()
+    assert (abs(M[2] - M[2][0] - t) < 1e-12).all()
+    assert (Mmem.values == M.values[[1, 3]]).all()
+    assert (abs(Mmem.times - t) < 1e-12).all()
+    assert len(buffers) <= 8
+    reinit_default_clock() # for next test
+
+
+def test_filestatemonitor():
+    '''
+    Tests that :class:`FileStateMonitor` writes the same values as a
+    :class:`StateMonitor` to a ``.npy`` file.
+    '''
+    import os, tempfile, shutil
+    reinit_default_clock()
+    tmpdir = tempfile.mkdtemp()
+    try:
+        G = NeuronGroup(4, model="""
+                        dV/dt = 1/second : 1
+                        dW/dt = -1/second : 1
+                        """)
+        M = StateMonitor(G, 'V', record=True)
+        # small buffers, so that several blocks are written
+        MF = FileStateMonitor(G, 'V', os.path.join(tmpdir, 'V.npy'),
+                              record=[0, 2], buffersize=2 * 8 * 7)
+        MM = MultiFileStateMonitor(G, os.path.join(tmpdir, 'rec.npy'),
+                                   timestep=2)
+        net = Network(G, M, MF, MM)
+        net.run(3 * ms)
+        assert isinstance(MF.data, memmap)
+        assert (MF.values == M.values[[0, 2]]).all()
+        assert (MF[2] == M[2]).all()
+        net.run(2 * ms)
+        assert (MF.times == M.times).all()
+        assert (MF.values == M.values[[0, 2]]).all()
+        MF.close()
+        MM.close()
+        assert (load(os.path.join(tmpdir, 'V.npy')) == M.values[[0, 2]].T).all()
+        assert (MF.values == M.values[[0, 2]]).all()
+        assert (load(os.path.join(tmpdir, 'rec_V.npy')) == M.values[:, ::2].T).all()
+        assert (MM['W'].values == -M.values[:, ::2]).all()
+        assert (MM.times == M.times[::2]).all()
+        net.reinit()
+        assert MF.values.shape == (2, 0)
+        MF.close()
+        MM.close()
+    finally:
+        shutil.rmtree(tmpdir)
+    reinit_default_clock() # for next test
+
 
 def test_coincidencecounter():
     """
@@ -1,10 +1,11 @@
 import sys
 from StringIO import StringIO
 
-from numpy.testing.utils import assert_raises
+from numpy.testing.utils import assert_raises, assert_equal, assert_allclose
 
 from brian import *
 from brian.utils.progressreporting import ProgressReporter
+from brian.network import FusedGroupUpdate
 
 
 
@@ -170,6 +171,50 @@ def test_network_clocks():
     net = Network(G1, G2)
     assert(not net.same_clocks())
 
+
+def test_network_multiple_clocks():
+    '''
+    Test the order in which operations with several clocks are called
+    '''
+    calls = []
+    clock1 = Clock(dt=3*ms, order=1)
+    clock2 = Clock(dt=5*ms, order=0)
+    clocks = [EventClock(dt=2*ms, order=i + 2) for i in range(10)]
+    
+    @network_operation(clock=clock1)
+    def op1():
+        calls.append((float(clock1.t), 1))
+
+    @network_operation(clock=clock2)
+    def op2():
+        calls.append((float(clock2.t), 2))
+    
+    def make_op(i):
+        def f():
+            calls.append((float(clocks[i].t), 'c%d' % i))
+        return NetworkOperation(f, clock=clocks[i])
+    ops = [make_op(i) for i in range(10)]
+
+    net = Network(op1, op2, ops)
+    net.run(30*ms)
+    # the same sequence sorted by time and order
+    expected = [(i*3*0.001, 1, 1) for i in range(10)] + \
+               [(i*5*0.001, 0, 2) for i in range(6)] + \
+               [(i*2*0.001, j + 2, 'c%d' % j) for i in range(15) for j in range(10)]
+    expected.sort(key=lambda (t, order, name): (round(t, 10), order))
+    assert_equal([name for _, name in calls],
+                 [name for _, _, name in expected])
+    assert_equal([round(t, 10) for t, _ in calls],
+                 [round(t, 10) for t, _, _ in expected])
+    # the current clock after a run is the next one to be updated
+    assert(net.clock is clock2)
+    
+    # continuing the run
+    del calls[:]
+    net.run(2*ms)
+    assert_equal([name for _, name in calls],
+                 [2, 1] + ['c%d' % j for j in range(10)])
+
 def test_network_operation():
     reinit_default_clock()
     G = NeuronGroup(1, model='dv/dt = -v / (1 * ms) : 1')
@@ -195,10 +240,57 @@ def test_network_operation():
     # test that there is some decay
     assert(all(mon[0] < 1.0))
 
+
+
+def test_fused_schedule():
+    '''
+    Test that the fused schedule gives the same results as the standard one
+    '''
+    def simulate(fused):
+        reinit_default_clock()
+        seed(4321)
+        eqs = '''
+        dv/dt = (ge - v + 1.1) / (10 * ms) : 1
+        dge/dt = -ge / (5 * ms) : 1
+        '''
+        groups = [NeuronGroup(n, eqs, threshold=1, reset=0, refractory=2*ms)
+                  for n in [1, 5, 10, 20]]
+        other = NeuronGroup(10, eqs.replace('10 * ms', '20 * ms'),
+                            threshold=1, reset=0)
+        groups.append(other)
+        for G in groups:
+            G.v = rand(len(G))
+        P = PoissonGroup(20, rates=200*Hz)
+        C = [Connection(P, G, 'ge', weight=0.1 * (rand(20, len(G)) < 0.5))
+             for G in groups]
+        spikes = [SpikeMonitor(G) for G in groups]
+        states = [StateMonitor(G, 'v', record=True) for G in groups]
+        net = Network(groups, P, C, spikes, states)
+        if fused:
+            net.set_fused_schedule()
+            net.prepare()
+            # the first four groups are fused together
+            fusedupdates = [f for f in net._update_schedule[id(defaultclock)]
+                            if hasattr(f, 'im_self') and
+                               isinstance(f.im_self, FusedGroupUpdate)]
+            assert_equal(len(fusedupdates), 1)
+            assert(fusedupdates[0].im_self.groups == groups[:4])
+        net.run(100 * ms)
+        return ([[(i, float(t)) for i, t in M.spikes] for M in spikes],
+                [M.values for M in states])
+    
+    spikes_standard, values_standard = simulate(False)
+    spikes_fused, values_fused = simulate(True)
+    assert(spikes_standard == spikes_fused)
+    for v_standard, v_fused in zip(values_standard, values_fused):
+        assert_allclose(v_standard, v_fused)
+
     
 if __name__ == '__main__':
     test_progressreporting()
     test_network_generation()
     test_network_clocks()
+    test_network_multiple_clocks()
     test_network_operation()
+    test_fused_schedule()
     test_reinit()
\ No newline at end of file
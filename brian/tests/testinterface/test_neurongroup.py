@@ -123,7 +123,166 @@ def test_variable_setting():
     assert_raises(ValueError, assign_to_static)
 
 
+def test_threads():
+    ''' Test the threaded update of the state variables '''
+    eqs = '''
+    dv/dt = (-v + w + I) / (10 * ms) : 1
+    dw/dt = (0.1 * v * v - w) / (50 * ms) : 1
+    I : 1
+    '''
+    def make_group(**kwds):
+        reinit_default_clock()
+        G = NeuronGroup(101, eqs, threshold='v>1', reset='v=0', **kwds)
+        G.I = linspace(0, 3, len(G))
+        M = SpikeMonitor(G)
+        return G, M, Network(G, M)
+    G, M, net = make_group()
+    net.run(20 * ms)
+    for kwds, threads in [(dict(threads=3), 1), (dict(compile=True), 4),
+                          (dict(compile=True, freeze=True, threads=4), 2)]:
+        G_t, M_t, net_t = make_group(**kwds)
+        net_t.run(20 * ms, threads=threads)
+        assert (abs(G_t._S - G._S) < 1e-12).all()
+        assert_equal(M_t.spikes, M.spikes)
+        # the threads given to run are only used during the run
+        assert_equal(G_t._threads, kwds.get('threads', 1))
+    assert_equal(len(G_t._shards), 4)
+    # groups which cannot be split are logged once per run, with a warning
+    # only for groups with differential equations
+    import logging
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    logger = logging.getLogger('brian')
+    level = logger.level
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    try:
+        reinit_default_clock()
+        G_t = NeuronGroup(2, 'dv/dt = -v / tau : 1',
+                          vectorize_parameters=dict(tau=[5 * ms, 10 * ms]))
+        net_t = Network(G_t, PoissonGroup(3, 10 * Hz), PoissonGroup(3, 5 * Hz),
+                        SpikeGeneratorGroup(2, [(0, 1 * ms)]))
+        for _ in range(2):
+            records[:] = []
+            net_t.run(1 * ms, threads=2)
+            messages = [(r.levelno, r.getMessage()) for r in records
+                        if r.name == 'brian.network']
+            assert_equal(messages,
+                         [(logging.INFO, '2 PoissonGroup, 1 SpikeGeneratorGroup '
+                                         'updated in a single thread'),
+                          (logging.WARNING, 'The state updaters of 1 NeuronGroup '
+                                            'cannot be split between threads, '
+                                            'using a single thread')])
+            assert not [r for r in records if r.name == 'brian.neurongroup']
+    finally:
+        logger.removeHandler(handler)
+        logger.setLevel(level)
+
+
+def test_linear_update_cache():
+    ''' Test the cache of update matrices of linear equations '''
+    import tempfile, shutil, os
+    from brian.stateupdater import _linear_update_cache
+    reinit_default_clock()
+    clear_linear_update_cache()
+    eqs = '''
+    dv/dt = (ge - v) / (10 * ms) : 1
+    dge/dt = -ge / (5 * ms) : 1
+    '''
+    G1 = NeuronGroup(1, eqs)
+    G2 = NeuronGroup(1, Equations('''
+    dge/dt = -ge / (5 * ms) : 1
+    dv/dt = (ge - v) / (10 * ms) : 1
+    '''))
+    assert_equal(len(_linear_update_cache), 1)
+    assert (G1._state_updater.A == G2._state_updater.A).all()
+    # cached matrices are copied, not modified
+    G1._state_updater.A[:] = 0
+    assert (NeuronGroup(1, eqs)._state_updater.A == G2._state_updater.A).all()
+    # the values of the parameters are part of the key
+    def make_updater(tau):
+        return NeuronGroup(1, 'dv/dt = -v / tau : 1',
+                           unit_checking=False)._state_updater
+    assert make_updater(10 * ms).A[0, 0] != make_updater(20 * ms).A[0, 0]
+    assert_equal(len(_linear_update_cache), 3)
+    # on-disk cache, with a degenerate system
+    directory = tempfile.mkdtemp()
+    eqs_degenerate = 'dv/dt = 1 / (10 * ms) : 1'
+    try:
+        set_global_preferences(linear_diffeq_cache_dir=directory)
+        clear_linear_update_cache()
+        G4 = NeuronGroup(1, eqs)
+        G5 = NeuronGroup(1, eqs_degenerate)
+        assert_equal(len(os.listdir(directory)), 2)
+        clear_linear_update_cache()
+        set_global_preferences(linear_diffeq_cache_size=0)
+        G6 = NeuronGroup(1, eqs)
+        G7 = NeuronGroup(1, eqs_degenerate)
+        assert_equal(len(_linear_update_cache), 0)
+        assert (G6._state_updater.A == G2._state_updater.A).all()
+        assert (G6._state_updater.B == G2._state_updater.B).all()
+        assert (G7._state_updater._C == G5._state_updater._C).all()
+        assert G7._state_updater.B is NotImplemented
+    finally:
+        set_global_preferences(linear_diffeq_cache_dir=None,
+                               linear_diffeq_cache_size=128)
+        shutil.rmtree(directory)
+    # different time step
+    G8 = NeuronGroup(1, eqs, clock=Clock(dt=0.2 * ms))
+    assert_equal(len(_linear_update_cache), 1)
+    assert not (G8._state_updater.A == G2._state_updater.A).all()
+
+def test_vectorize_parameters():
+    ''' Test NeuronGroup with several sets of parameters '''
+    reinit_default_clock()
+    El = -70 * mV
+    eqs = '''
+    dv/dt = (El - v + I) / tau : volt
+    I : volt
+    '''
+    taus = [5 * ms, 10 * ms, 20 * ms]
+    G = NeuronGroup(4, eqs, threshold='v>vt', reset='v=El',
+                    vectorize_parameters=dict(tau=taus, vt=-55 * mV))
+    assert_equal(len(G), 12)
+    assert (G.parameter_set(1).tau == float(taus[1])).all()
+    assert (G.vt == float(-55 * mV)).all()
+    assert_raises(IndexError, G.parameter_set, 3)
+    G.v = El
+    G.I = linspace(20 * mV, 30 * mV, len(G))
+    M = SpikeMonitor(G)
+    S = StateMonitor(G, 'v', record=[0, 5, 7])
+    C = SpikeCounter(G)
+    run(50 * ms)
+    spikes = G.split_parameter_sets(M)
+    counts = G.split_parameter_sets(C)
+    values = G.split_parameter_sets(S)
+    assert_equal([len(x) for x in values], [1, 2, 0])
+    # the linear equations are still integrated exactly
+    assert isinstance(G._state_updater, ParameterSetsLinearStateUpdater)
+    # compare with separate runs, where tau is a constant
+    for k, tau_k in enumerate(taus):
+        reinit_default_clock()
+        H = NeuronGroup(4, Equations(eqs, El=El, tau=tau_k),
+                        threshold='v>-55*mV', reset='v=El')
+        assert isinstance(H._state_updater, LinearStateUpdater)
+        H.v = El
+        H.I = G.parameter_set(k).I
+        M_H = SpikeMonitor(H)
+        S_H = StateMonitor(H, 'v', record=True)
+        net = Network(H, M_H, S_H)
+        net.run(50 * ms)
+        i, t = spikes[k]
+        assert len(i) > 0
+        assert (i == M_H.it[0]).all() and (t == M_H.it[1]).all()
+        assert (counts[k] == bincount(i, minlength=4)).all()
+        rows = [j - 4 * k for j in [0, 5, 7] if j // 4 == k]
+        assert (abs(values[k] - S_H.values[rows]) < 1e-12).all()
+
 if __name__ == '__main__':
     test_poissongroup()
     test_linked_var()
-    test_variable_setting()
\ No newline at end of file
+    test_variable_setting()
+    test_threads()
+    test_linear_update_cache()
+    test_vectorize_parameters()
\ No newline at end of file
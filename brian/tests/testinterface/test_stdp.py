@@ -36,5 +36,116 @@ def test_stdp():
     # Postsynaptic spike came after presynaptic spike: weight should increase
     assert(con.W[0, 0] > 1) 
 
+def test_stdp_vectorised():
+    '''
+    Test that the vectorised updates of ExponentialSTDP with a sparse matrix
+    give exactly the same weights as the updates spike by spike.
+    '''
+    from brian.stdp import STDPUpdater
+    reinit()
+    seed(3)
+    P = PoissonGroup(40, rates=10 * Hz)
+    G = NeuronGroup(30, model='dv/dt=-v/(10*ms):1')
+    for interactions in ['all', 'nearest', 'nearest_pre', 'nearest_post']:
+        for update in ['additive', 'multiplicative', 'mixed']:
+            for source in [P, G]:
+                C = Connection(source, G, 'v', structure='sparse')
+                C.connect_random(source, G, 0.05, weight=0.1)
+                C.compress()
+                C.W.alldata[:] = rand(C.W.nnz) * 0.2
+                stdp = ExponentialSTDP(C, 10 * ms, 10 * ms, 0.05, -0.06,
+                                       interactions=interactions,
+                                       update=update, wmax=0.2)
+                updaters = [obj for obj in stdp.contained_objects
+                            if isinstance(obj, STDPUpdater)]
+                assert all(u._vectorised_code is not None for u in updaters)
+                stdp.A_pre = rand(len(source)) * 0.05
+                stdp.A_post = -rand(len(G)) * 0.06
+                initial = (C.W.alldata.copy(), stdp.A_pre.copy(),
+                           stdp.A_post.copy())
+                spikes = [(sort(permutation(len(source))[:5]),
+                           sort(permutation(len(G))[:4])) for _ in range(20)]
+                results = []
+                for vectorised in [False, True]:
+                    C.W.alldata[:], stdp.A_pre, stdp.A_post = initial
+                    if not vectorised:
+                        codes = [u._vectorised_code for u in updaters]
+                        for u in updaters:
+                            u._vectorised_code = None
+                    for pre_spikes, post_spikes in spikes:
+                        updaters[0].propagate(pre_spikes)
+                        updaters[1].propagate(post_spikes)
+                        stdp.A_pre *= 0.9
+                        stdp.A_post *= 0.9
+                    if not vectorised:
+                        for u, code in zip(updaters, codes):
+                            u._vectorised_code = code
+                    results.append((C.W.alldata.copy(), stdp.A_pre.copy(),
+                                    stdp.A_post.copy()))
+                for x, y in zip(*results):
+                    assert (x == y).all()
+    # code with function calls is executed spike by spike
+    C = Connection(P, G, 'v', structure='sparse')
+    stdp = STDP(C, eqs='dA/dt=-A/(10*ms):1\ndB/dt=-B/(10*ms):1',
+                pre='A+=0.1; w+=exp(B)', post='B+=0.1; w+=A')
+    updaters = [obj for obj in stdp.contained_objects
+                if isinstance(obj, STDPUpdater)]
+    assert updaters[0]._vectorised_code is None
+    assert updaters[1]._vectorised_code is not None
+
+def test_stdp_event_driven():
+    '''
+    Test that event-driven STDP gives the same weights and variables as STDP
+    with variables updated at every time step.
+    '''
+    from brian.stdp import STDPUpdater, EventDrivenGroup
+    reinit()
+    seed(4)
+    clock = defaultclock
+    P = NeuronGroup(40, model='v:1')
+    G = NeuronGroup(30, model='v:1')
+    for structure in ['sparse', 'dense']:
+        for interactions in ['all', 'nearest']:
+            stdps = []
+            for event_driven in [False, True]:
+                C = Connection(P, G, 'v', structure=structure)
+                C.connect_random(P, G, 0.2, weight=0.1, seed=5)
+                C.compress()
+                stdp = ExponentialSTDP(C, 10 * ms, 20 * ms, 0.05, -0.06,
+                                       interactions=interactions, wmax=0.2,
+                                       event_driven=event_driven)
+                updaters = [obj for obj in stdp.contained_objects
+                            if isinstance(obj, STDPUpdater)]
+                stdps.append((C, stdp, updaters))
+            clock.reinit()
+            for _ in range(300):
+                pre_spikes = (rand(len(P)) < 0.02).nonzero()[0]
+                post_spikes = (rand(len(G)) < 0.02).nonzero()[0]
+                for C, stdp, updaters in stdps:
+                    stdp.pre_group.update()
+                    stdp.post_group.update()
+                    updaters[0].propagate(pre_spikes)
+                    updaters[1].propagate(post_spikes)
+                clock.tick()
+            (C1, stdp1, _), (C2, stdp2, _) = stdps
+            assert isinstance(stdp2.pre_group, EventDrivenGroup)
+            assert allclose(asarray(C1.W.todense()), asarray(C2.W.todense()))
+            stdp1.pre_group.update()
+            stdp1.post_group.update()
+            stdp2.pre_group.advance(slice(None))
+            stdp2.post_group.advance(slice(None))
+            assert allclose(stdp1.A_pre, stdp2.A_pre)
+            assert allclose(stdp1.A_post, stdp2.A_post)
+    # only independent linear equations can be event-driven
+    C = Connection(P, G, 'v')
+    for eqs in ['dA/dt=-A**2/(10*ms):1\ndD/dt=-D/(10*ms):1',
+                'dA/dt=(B-A)/(10*ms):1\ndB/dt=-B/(10*ms):1\ndD/dt=-D/(10*ms):1']:
+        try:
+            STDP(C, eqs=eqs, pre='A+=0.1; w+=D', post='D+=0.1; w+=A',
+                 event_driven=True)
+            raise AssertionError('Expected a ValueError')
+        except ValueError:
+            pass
+
 if __name__ == '__main__':
     test_stdp()
\ No newline at end of file
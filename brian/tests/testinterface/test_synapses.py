@@ -12,7 +12,7 @@ import numpy as np
 
 from brian.network import Network
 from brian.clock import defaultclock, reinit_default_clock
-from brian.synapses import Synapses, SynapticEquations
+from brian.synapses import Synapses, SynapticEquations, STPSynapses
 from brian.neurongroup import NeuronGroup
 from brian.directcontrol import SpikeGeneratorGroup
 from brian.monitor import StateMonitor
@@ -451,6 +451,133 @@ def test_max_delay():
     assert (mon[0][mon.times >= 6 * ms] == 2).all()
     assert (mon[0][mon.times < 6 * ms] == 0).all()    
     
+def test_simultaneous_spikes():
+    '''Test the propagation of simultaneous spikes with heterogeneous delays.'''
+    
+    reinit_default_clock()
+    inp = SpikeGeneratorGroup(3, [(0, 1*ms), (1, 1*ms), (2, 1*ms), (1, 2*ms)])
+    G = NeuronGroup(2, model='v:1')
+    mon = StateMonitor(G, 'v', record=True)
+    
+    syn = Synapses(inp, G, model='w:1', pre='v+=w')
+    syn[:, :] = True
+    for (i, j), w, d in zip([(0, 0), (0, 1), (1, 0), (1, 1), (2, 0), (2, 1)],
+                            [1, 2, 4, 8, 16, 32], [0, 1, 1, 1, 2, 0]):
+        syn.w[i, j] = w
+        syn.delay[i, j] = d*ms
+    
+    net = Network(inp, G, syn, mon)
+    net.run(4*ms)
+    
+    for t, v0, v1 in [(0.5*ms, 0, 0), (1.5*ms, 1, 32), (2.5*ms, 5, 42),
+                      (3.5*ms, 25, 50)]:
+        i = int(t / defaultclock.dt)
+        assert mon[0][i] == v0 and mon[1][i] == v1
+    
+
+def test_scatter_code():
+    '''Test that pre codes only incrementing postsynaptic variables, which are
+    vectorised with add.at, give the same results as the general code.'''
+    
+    reinit_default_clock()
+    np.random.seed(3)
+    inp = SpikeGeneratorGroup(10, [(i, t*ms) for i in range(10) for t in [1, 2, 4]] +
+                                  [(i, 3*ms) for i in range(0, 10, 3)])
+    G1 = NeuronGroup(4, model='v:1\nu:1')
+    G2 = NeuronGroup(4, model='v:1\nu:1')
+    S1 = Synapses(inp, G1, model='w:1\nc:1', pre='v+=w; u_post-=2*w; c+=1')
+    S2 = Synapses(inp, G2, model='w:1\nc:1', pre='v=v+w; u_post=u_post-2*w; c+=1')
+    assert 'add.at' in S1.namespaces[0]['_original_code_string']
+    assert 'add.at' not in S2.namespaces[0]['_original_code_string']
+    connections = np.random.rand(10, 4) < 0.7
+    for S in [S1, S2]:
+        # simultaneous presynaptic spikes target the same postsynaptic neurons
+        S[:, :] = 'connections[i, j]'
+        S.w[:] = np.arange(len(S))*0.1
+        S.delay[:] = np.arange(len(S)) % 3 * ms
+    
+    net = Network(inp, G1, G2, S1, S2)
+    net.run(6*ms)
+    
+    assert np.allclose(G1.v, G2.v) and np.allclose(G1.u, G2.u)
+    assert (G1.v > 0).all()
+    assert (S1.c[:] == S2.c[:]).all()
+
+def test_namespace_update():
+    '''Test codes which read and then update a variable of their namespace.'''
+    
+    reinit_default_clock()
+    inp = SpikeGeneratorGroup(2, [(0, 1*ms), (1, 2*ms), (0, 3*ms)])
+    G = NeuronGroup(2, model='v:1')
+    total = 0
+    S = Synapses(inp, G, model='w:1', pre='total = total + 1\nv += total')
+    S[:, :] = 'i == j'
+    
+    net = Network(inp, G, S)
+    net.run(5*ms)
+    
+    assert (G.v == [4, 2]).all()
+    assert S.namespaces[0]['total'] == 3
+
+def test_stp_synapses():
+    '''Test that STPSynapses give the same results as the short-term plasticity
+    written in the presynaptic code.'''
+    
+    reinit_default_clock()
+    np.random.seed(4)
+    spikes = [(i, t*ms) for i in range(5) for t in np.unique(np.random.randint(0, 100, 30))]
+    inp = SpikeGeneratorGroup(5, spikes)
+    connections = np.random.rand(5, 4) < 0.6
+    exp = np.exp # for the presynaptic codes
+    groups, synapses = [], []
+    for taud, tauf, U in [(50*ms, 100*ms, .1), (20*ms, 0*ms, .5)]:
+        if tauf > 0:
+            pre = '''u=U+(u-U)*exp(-(t-lastupdate)/tauf)
+                     x=1+(x-1)*exp(-(t-lastupdate)/taud)
+                     v+=w*u*x
+                     x*=(1-u)
+                     u+=U*(1-u)'''
+        else:
+            pre = '''x=1+(x-1)*exp(-(t-lastupdate)/taud)
+                     v+=w*U*x
+                     x*=(1-U)'''
+        G1 = NeuronGroup(4, model='dv/dt=-v/(10*ms):1')
+        G2 = NeuronGroup(4, model='dv/dt=-v/(10*ms):1')
+        S1 = Synapses(inp, G1, model='w:1\nu:1\nx:1', pre=pre)
+        S2 = STPSynapses(inp, G2, model='w:1', pre='v+=w*u*x',
+                         taud=taud, tauf=tauf, U=U)
+        for S in [S1, S2]:
+            S[:, :] = 'connections[i, j]'
+            S.w[:] = np.arange(len(S))*0.1
+            S.delay[:] = np.arange(len(S)) % 3 * ms
+        assert (S2.u[:] == U).all() and (S2.x[:] == 1).all()
+        S1.u, S1.x = U, 1
+        groups += [G1, G2]
+        synapses += [S1, S2]
+    
+    net = Network(inp, groups, synapses)
+    net.run(105*ms)
+    
+    for G1, G2 in zip(groups[::2], groups[1::2]):
+        assert np.allclose(G1.v, G2.v) and (G1.v > 0).all()
+    S1, S2 = synapses[:2]
+    assert np.allclose(S1.u[:], S2.u[:]) and np.allclose(S1.x[:], S2.x[:])
+
+def test_stp_presynaptic_code():
+    '''Test that the modifications of STPSynapses apply to the values of u and
+    x set by the presynaptic code.'''
+    
+    reinit_default_clock()
+    inp = SpikeGeneratorGroup(1, [(0, 1*ms)])
+    G = NeuronGroup(1, model='v:1')
+    S = STPSynapses(inp, G, model='w:1', pre='u=0.5',
+                    taud=1000*ms, tauf=1000*ms, U=.1)
+    S[:, :] = True
+    
+    net = Network(inp, G, S)
+    net.run(2*ms)
+    
+    assert np.allclose(S.x[:], 0.5) and np.allclose(S.u[:], 0.55)
 
 ################################################################################
 # Low level unit tests, test single helper functions
@@ -461,6 +588,8 @@ from brian.synapses.synapses import slice_to_test as slice_to_t
 slice_to_t.__name__ = 'slice_to_t'
 
 from brian.synapses.synapses import invert_array, smallest_inttype, indent
+from brian.synapses.spikequeue import csr_index, gather_synapses, group_offsets
+from brian.synapses.spikequeue import SpikeQueue
 
 
 def test_slice_to_array():
@@ -536,6 +665,56 @@ def test_smallest_inttype():
         inttype = smallest_inttype(value)
         assert inttype(value) == value
 
+def test_csr_index():
+    '''
+    Tests the csr_index and gather_synapses functions (flat index of synapses
+    of each neuron).
+    '''
+    synapses = [np.array([3, 4, 5]), np.array([], dtype=int),
+                np.array([0, 1]), np.array([2])]
+    indptr, indices = csr_index(synapses)
+    assert (indptr == [0, 3, 3, 5, 6]).all()
+    assert (indices == [3, 4, 5, 0, 1, 2]).all()
+    assert (gather_synapses(indptr, indices, [2, 0, 3, 1]) == [0, 1, 3, 4, 5, 2]).all()
+    assert len(gather_synapses(indptr, indices, [1])) == 0
+    assert len(gather_synapses(indptr, indices, [])) == 0
+
+def test_group_offsets():
+    '''
+    Tests the group_offsets function (offsets of synaptic events with the same
+    delay).
+    '''
+    assert (group_offsets(np.array([7, 5, 7, 3, 7, 5])) == [0, 0, 1, 0, 2, 1]).all()
+    assert len(group_offsets(np.array([], dtype=int))) == 0
+
+def test_spikequeue_events():
+    '''
+    Tests that the spike queue stores the events of simultaneous spikes with
+    heterogeneous delays at the right timesteps, with and without precomputed
+    offsets.
+    '''
+    np.random.seed(5)
+    G = NeuronGroup(6, model='v:1')
+    sizes = [4, 0, 7, 3, 9, 1]
+    synapses = [np.arange(sum(sizes[:i]), sum(sizes[:i+1])) for i in range(6)]
+    delays = np.random.randint(1, 5, sum(sizes))
+    spikes = [[0, 2, 3], [4], [], [5, 4, 0, 2], [1, 3], [0]]
+    expected = [[] for _ in range(len(spikes)+5)]
+    for t, spiking in enumerate(spikes):
+        for i in spiking:
+            for k in synapses[i]:
+                expected[t+delays[k]].append(k)
+    for precompute in [True, False]:
+        queue = SpikeQueue(G, synapses, delays, precompute_offsets=precompute)
+        queue.compress()
+        assert (queue._offsets is not None) == (precompute and
+                                               not queue._useweave)
+        for t in range(len(expected)):
+            if t < len(spikes):
+                queue.propagate(np.array(spikes[t], dtype=int))
+            assert sorted(queue.peek()) == sorted(expected[t])
+            queue.next()
+
 def test_indent():
     '''
     Tests the indent function.
@@ -559,3 +738,11 @@ if __name__ == '__main__':
     test_smallest_inttype()
     test_indent()
     test_max_delay()
+    test_simultaneous_spikes()
+    test_scatter_code()
+    test_namespace_update()
+    test_stp_synapses()
+    test_stp_presynaptic_code()
+    test_csr_index()
+    test_group_offsets()
+    test_spikequeue_events()
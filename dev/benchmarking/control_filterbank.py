@@ -0,0 +1,77 @@
+'''
+Benchmark of ControlFilterbank with batched coefficient updates
+
+Compares ControlFilterbank computing the filter coefficients of a whole
+buffer at once (the ``batch`` method of the updater, with a time-varying
+LinearFilterbank applying them) with the previous mode, which processed the
+buffer in chunks of ``update_interval`` samples and called the updater after
+each chunk. The old mode is obtained by hiding the ``batch`` methods of the
+updaters. The models are DCGC and TanCarney with 100 channels on 50 ms of
+white noise (50 kHz), with buffers of 64 samples.
+
+Results (seconds, old / new; the outputs are identical):
+
+weave:
+     DCGC: interval 1 1.44 / 0.46, interval 4 0.37 / 0.12, interval 16 0.10 / 0.07
+TanCarney: interval 1 1.30 / 1.27, interval 4 0.41 / 0.33, interval 16 0.18 / 0.15
+numpy:
+     DCGC: interval 1 2.31 / 0.71, interval 4 0.84 / 0.38, interval 16 0.44 / 0.38
+TanCarney: interval 1 1.94 / 1.73, interval 4 0.86 / 0.89, interval 16 0.68 / 0.68
+
+The control path of TanCarney feeds back on itself (the control signal
+depends on the filter being updated), so it is still updated one interval at
+a time and dominates the time for short intervals; only its signal path is
+batched.
+
+Usage: python control_filterbank.py
+'''
+from time import time
+from contextlib import contextmanager
+from brian import *
+from brian.hears import *
+from brian.hears.filtering import dcgc, tan_carney
+
+updaters = [dcgc.AsymCompUpdate, tan_carney.Filter_Update]
+
+
+@contextmanager
+def unbatched():
+    '''
+    Hides the batch methods so that ControlFilterbank uses the old mode.
+    '''
+    methods = [cls.batch for cls in updaters]
+    for cls in updaters:
+        del cls.batch
+    try:
+        yield
+    finally:
+        for cls, method in zip(updaters, methods):
+            cls.batch = method
+
+
+def benchmark(model, update_interval, sound, cf):
+    if model == 'DCGC':
+        fb = DCGC(sound, cf, update_interval=update_interval)
+    else:
+        fb = TanCarney(sound, cf, update_interval=update_interval)
+    start = time()
+    output = fb.process(buffersize=64)
+    return time()-start, asarray(output)
+
+if __name__ == '__main__':
+    set_default_samplerate(50*kHz)
+    sound = whitenoise(50*ms).atlevel(60*dB)
+    cf = erbspace(100*Hz, 5*kHz, 100)
+    for useweave in [True, False]:
+        set_global_preferences(useweave=useweave)
+        print 'weave:' if useweave else 'numpy:'
+        for model in ['DCGC', 'TanCarney']:
+            results = []
+            for update_interval in [1, 4, 16]:
+                with unbatched():
+                    t_old, out_old = benchmark(model, update_interval, sound, cf)
+                t_new, out_new = benchmark(model, update_interval, sound, cf)
+                assert (out_old==out_new).all()
+                results.append('interval %d %.2f / %.2f' % (update_interval,
+                                                            t_old, t_new))
+            print '%9s: %s' % (model, ', '.join(results))
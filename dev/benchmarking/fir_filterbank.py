@@ -0,0 +1,111 @@
+'''
+Benchmark of FFTFIRFilterbank
+
+Compares the uniformly partitioned overlap-save implementation of
+FFTFIRFilterbank with the previous implementation, which looped over the
+channels and did one complex FFT of size 2**ceil(log2(ir_length+buffer)) per
+channel and buffer, with a minimum buffer size of 3*ir_length. The sound lasts
+1 second (44.1 kHz) and is processed with buffers of 32 and 1024 samples.
+
+Results (buffer size, channels, impulse response length; old implementation,
+old implementation without the minimum buffer size, partitioned overlap-save):
+
+  32   2  512: 0.02 s, 0.34 s, 0.12 s
+  32 100  512: 0.62 s, 14.57 s, 0.88 s
+  32 200 4096: 1.30 s, 196.96 s, 7.50 s
+1024   2  512: 0.01 s, 0.02 s, 0.02 s
+1024 100  512: 0.51 s, 0.71 s, 0.55 s
+1024 200 4096: 1.58 s, 6.70 s, 2.19 s
+
+The old implementation silently raised the buffer size to 3*ir_length, so that
+its latency was several times the impulse response length. At equal latency
+(the buffer size), the partitioned implementation is 17 to 26 times faster for
+small buffers. With minimum_buffer_size or large buffers (8192 samples), both
+have similar throughput (100 channels, 512 samples: 0.96 s vs 0.64 s; 200
+channels, 4096 samples: 1.66 s vs 2.15 s).
+
+Usage: python fir_filterbank.py
+'''
+from time import time
+from brian import *
+from brian.hears import *
+
+
+class LoopFFTFIRFilterbank(FFTFIRFilterbank):
+    '''
+    The previous implementation, with one FFT per channel.
+    '''
+    def __init__(self, source, impulse_response):
+        FFTFIRFilterbank.__init__(self, source, impulse_response,
+                                  minimum_buffer_size=3*impulse_response.shape[1])
+        self.input_cache = zeros((impulse_response.shape[1], self.nchannels))
+        self.fftcache_nmax = -1
+
+    def buffer_init(self):
+        Filterbank.buffer_init(self)
+        self.input_cache[:] = 0
+
+    def buffer_apply(self, input):
+        output = zeros_like(input)
+        nmax = max(self.input_cache.shape[0]+input.shape[0], self.impulse_response.shape[1])
+        nmax = 2**int(ceil(log2(nmax)))
+        if self.fftcache_nmax!=nmax:
+            self.fftcache = []
+        for i, (previnput, curinput, ir) in enumerate(zip(self.input_cache.T,
+                                                          input.T,
+                                                          self.impulse_response)):
+            fullinput = hstack((previnput, curinput))
+            fullinput = hstack((fullinput, zeros(nmax-len(fullinput))))
+            if self.fftcache_nmax!=nmax:
+                ir = hstack((ir, zeros(nmax-len(ir))))
+                ir_fft = fft(ir, n=nmax)
+                self.fftcache.append(ir_fft)
+            else:
+                ir_fft = self.fftcache[i]
+            fullinput_fft = fft(fullinput, n=nmax)
+            curoutput = ifft(fullinput_fft*ir_fft)
+            curoutput = curoutput[len(previnput):len(previnput)+len(curinput)]
+            output[:, i] = curoutput.real
+        if self.fftcache_nmax!=nmax:
+            self.fftcache_nmax = nmax
+        nic = self.input_cache.shape[0]
+        ni = input.shape[0]
+        if ni>=nic:
+            self.input_cache[:, :] = input[-nic:, :]
+        else:
+            self.input_cache[:-ni, :] = self.input_cache[ni:, :]
+            self.input_cache[-ni:, :] = input
+        return output
+
+
+class LoopFFTFIRFilterbankNoMinimum(LoopFFTFIRFilterbank):
+    '''
+    The previous implementation, without a minimum buffer size, so that the
+    latency is the buffer size.
+    '''
+    def __init__(self, source, impulse_response):
+        LoopFFTFIRFilterbank.__init__(self, source, impulse_response)
+        del self.minimum_buffer_size
+
+
+def benchmark(cls, nchannels, ir_length, buffersize):
+    seed(1)
+    sound = whitenoise(1*second, samplerate=44.1*kHz)
+    ir = randn(nchannels, ir_length)*exp(-arange(ir_length)/100.)
+    fb = cls(sound, ir)
+    start = time()
+    out = fb.process(buffersize=buffersize)
+    return time()-start, asarray(out)
+
+if __name__=='__main__':
+    for buffersize in [32, 1024]:
+        for nchannels, ir_length in [(2, 512), (100, 512), (200, 4096)]:
+            t_loop, out_loop = benchmark(LoopFFTFIRFilterbank, nchannels,
+                                         ir_length, buffersize)
+            t_nomin, out_nomin = benchmark(LoopFFTFIRFilterbankNoMinimum,
+                                           nchannels, ir_length, buffersize)
+            t_upols, out_upols = benchmark(FFTFIRFilterbank, nchannels,
+                                           ir_length, buffersize)
+            print '%4d/%3d/%4d: loop %.2f s, loop (no minimum) %.2f s, partitioned %.2f s (max difference %.1e)'%(
+                    buffersize, nchannels, ir_length, t_loop, t_nomin, t_upols,
+                    abs(out_loop-out_upols).max())
@@ -0,0 +1,65 @@
+'''
+Benchmark of the main loop of Network.run with many clocks
+
+Compares the priority queue based clock scheduler (ClockScheduler) with the
+previous loop, which did a linear scan min(self.clocks) after every tick. Each
+clock has an empty network operation, so that the timings measure the
+scheduling overhead only.
+
+Results (1 second of simulated time, 100 ms for 100 clocks):
+
+  1 clocks: min() scan 0.10 s, ClockScheduler 0.16 s
+ 10 clocks: min() scan 2.82 s, ClockScheduler 1.99 s
+100 clocks: min() scan 26.76 s, ClockScheduler 2.84 s
+
+Usage: python multiple_clocks.py
+'''
+from time import time
+from brian import *
+from brian.network import globally_stopped
+
+
+class MinScanNetwork(Network):
+    '''
+    Network using the old linear scan to find the next clock.
+    '''
+    def run(self, duration):
+        self.stopped = False
+        if not self.prepared:
+            self.prepare()
+        for c in self.clocks:
+            c.set_duration(duration)
+        clk = self.clock = min(self.clocks)
+        while clk.still_running() and not self.stopped and not globally_stopped:
+            self.update()
+            clk.tick()
+            clk = self.clock = min(self.clocks)
+
+
+def make_network(netclass, nclocks):
+    ops = []
+    for i in range(nclocks):
+        clock = EventClock(dt=(0.1 + 0.01 * (i % 7)) * ms, order=i % 3)
+        ops.append(NetworkOperation(lambda: None, clock=clock))
+    # the single clock case would use the same_clocks() fast path otherwise
+    if nclocks == 1:
+        ops.append(NetworkOperation(lambda: None,
+                                    clock=EventClock(dt=1 * second)))
+    return netclass(ops)
+
+
+def benchmark(netclass, nclocks, duration=1 * second):
+    net = make_network(netclass, nclocks)
+    net.prepare()
+    start = time()
+    net.run(duration)
+    return time() - start
+
+if __name__ == '__main__':
+    for nclocks in [1, 10, 100]:
+        duration = 1 * second if nclocks < 100 else 100 * ms
+        t_scan = benchmark(MinScanNetwork, nclocks, duration)
+        t_heap = benchmark(Network, nclocks, duration)
+        print '%3d clocks: min() scan %.2f s, ClockScheduler %.2f s' % (nclocks,
+                                                                      t_scan,
+                                                                      t_heap)
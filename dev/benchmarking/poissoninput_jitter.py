@@ -0,0 +1,74 @@
+'''
+Benchmark of PoissonInput with jitter
+
+Compares the previous jitter of PoissonInput, which stored the delays of the
+copies of the last event of each neuron and compared them with the current
+time for all the copies and neurons at every time step (a matrix of copies x
+neurons), with the current one, which schedules the copies in a circular
+buffer of future time steps when the events occur. Each neuron receives 10
+Poisson inputs at 10 Hz with 10 copies jittered by 5 ms, and the times are
+for the updates of the input during 10^7/N time steps. The times without
+jitter (weight=10*w) are given for reference.
+
+Results (ms per time step, previous / current (without jitter)):
+
+       1000 neurons: 0.19 / 0.16 (0.06)
+      10000 neurons: 1.40 / 0.73 (0.34)
+     100000 neurons: 17.50 / 7.87 (3.35)
+    1000000 neurons: 451.32 / 91.70 (33.63)
+
+The cost of the previous jitter grew with copies x neurons (with 10^6
+neurons, each time step allocated several arrays of 10^7 elements), whereas
+the current one grows with the number of events, and the generation of the
+number of events of each neuron (as without jitter) takes a large part of
+it. The previous jitter also lost the copies of an event when the next event
+of the same neuron occurred before they were all delivered.
+
+Usage: python poissoninput_jitter.py
+'''
+from time import time
+from brian import *
+from numpy.random import exponential, binomial
+
+
+class PreviousPoissonInput(PoissonInput):
+    def reinit(self):
+        self.lastevent = -inf * ones(self.N)
+        self.delays = zeros((self.copies, self.N))
+
+    def propagate(self, spikes):
+        n, f, w, p = self.n, self.rate, self.w, self.copies
+        taujitter = self.jitter
+        state = self.index
+        k = binomial(n=n, p=f * self.clock.dt, size=(self.N))
+        syncneurons = (k > 0)
+        self.lastevent[syncneurons] = self.clock.t
+        self.delays[:, syncneurons] = exponential(scale=taujitter, size=(p, sum(syncneurons)))
+        lastevent = tile(self.lastevent, (p, 1))
+        b = (abs(self.clock.t - (lastevent + self.delays)) <= (self.clock.dt / 2) * ones((p, self.N)))
+        weff = sum(b, axis=0) * w
+        self.target._S[state, :] += weff
+
+
+def benchmark(cls, N, jitter=5*ms, steps=1000):
+    reinit_default_clock()
+    seed(1)
+    G = NeuronGroup(N, model='v : 1')
+    if jitter is None: # same events without jitter
+        input = cls(G, N=10, rate=10*Hz, weight=10., state='v')
+    else:
+        input = cls(G, N=10, rate=10*Hz, weight=1., copies=10, jitter=jitter,
+                    state='v')
+    start = time()
+    for _ in xrange(steps):
+        input.propagate([])
+        G.clock.tick()
+    return (time()-start)/steps
+
+if __name__ == '__main__':
+    for N in [1000, 10000, 100000, 1000000]:
+        steps = 10000000/N
+        times = [benchmark(PreviousPoissonInput, N, steps=steps),
+                 benchmark(PoissonInput, N, steps=steps),
+                 benchmark(PoissonInput, N, jitter=None, steps=steps)]
+        print '%7d neurons: %.2f / %.2f (%.2f)' % ((N,)+tuple(t/ms for t in times))
@@ -0,0 +1,85 @@
+'''
+Benchmark of SpikeGeneratorGroup with arrays of spikes
+
+Compares the previous FastSpikeGeneratorThreshold, which sorted a copy of
+the spikes by time and neuron index and computed the time step with units at
+every time step, with the current one, which keeps arrays of spikes that are
+already sorted (including memory-mapped files) and computes the offsets of
+the time steps block by block (with sort=False, as the spikes of a time step
+are not sorted by neuron index). 10 million spikes of 10000 neurons (100 Hz on
+average) are replayed for 10 s with dt=0.1 ms.
+
+Results:
+
+                 previous   arrays     .npy file (memory-mapped)
+initialisation:  7.52 s     0.18 s     0.34 s
+per time step:   20.9 us    3.3 us     5.6 us
+
+The previous initialisation also used at least 24 bytes per spike in
+addition to the arrays of spikes. The current one only allocates the
+offsets (8 bytes per time step) and blocks of one million spikes, so that
+the number of spikes is only limited by the size of the file.
+
+Usage: python spikegenerator.py
+'''
+import os
+import tempfile
+from time import time
+from brian import *
+from brian.directcontrol import FastSpikeGeneratorThreshold
+import numpy
+
+
+class PreviousThreshold(FastSpikeGeneratorThreshold):
+    def set_offsets(self, I, T, dt=1000, sort=True):
+        T = array(ceil(T/dt), dtype=int)
+        spikes = zeros(len(I), dtype=[('t', int), ('i', int)])
+        spikes['t'] = T
+        spikes['i'] = I
+        spikes.sort(order=('t', 'i'))
+        T = ascontiguousarray(spikes['t'])
+        self.I = ascontiguousarray(spikes['i'])
+        self.offsets = hstack((0, cumsum(bincount(T))))
+
+    def __call__(self, P):
+        t = P.clock.t
+        dt = P.clock.dt
+        t = int(round(t/dt))
+        if t+1>=len(self.offsets):
+            return array([], dtype=int)
+        return self.I[self.offsets[t]:self.offsets[t+1]]
+
+
+def benchmark(make_group, steps=10000):
+    reinit_default_clock()
+    start = time()
+    G = make_group()
+    init = time()-start
+    start = time()
+    for _ in xrange(steps):
+        G._threshold(G)
+        G.clock.tick()
+    return init, (time()-start)/steps
+
+if __name__ == '__main__':
+    n = 10000000
+    seed(1)
+    spikes = zeros(n, dtype=[('i', int32), ('t', float64)])
+    spikes['t'] = numpy.sort(rand(n))*10
+    spikes['i'] = randint(0, 10000, n)
+    fd, filename = tempfile.mkstemp(suffix='.npy')
+    os.close(fd)
+    numpy.save(filename, spikes)
+    indices, times = spikes['i'].copy(), spikes['t'].copy()
+    def previous():
+        G = SpikeGeneratorGroup(10000, [])
+        G._threshold = PreviousThreshold(10000, indices, times, dt=defaultclock.dt)
+        return G
+    try:
+        for name, make_group in [('previous', previous),
+                                 ('arrays', lambda:SpikeGeneratorGroup(10000, (indices, times), sort=False)),
+                                 ('.npy file', lambda:SpikeGeneratorGroup(10000, filename, sort=False))]:
+            init, step = benchmark(make_group)
+            print '%10s: initialisation %.2f s, per time step %.1f us' % (name, init, step/1e-6)
+    finally:
+        os.remove(filename)
@@ -0,0 +1,90 @@
+'''
+Benchmark of SpikeQueue.propagate with many spikes per time step
+
+Compares the propagation using the flat (CSR) index of synapses, which gathers
+and inserts the events of all spikes in a single vectorised operation, with
+the previous code, which concatenated the synapse arrays of all spikes with
+hstack (no precomputed offsets), or inserted the events of each spike in a
+Python loop (precomputed offsets, the default for Synapses). N=10000 neurons
+with 100 synapses each and heterogeneous delays (0.1-5 ms), 100 time steps.
+
+Results (time per time step, without weave):
+
+spikes/step  hstack    loop    CSR
+         10   0.2 ms   0.2 ms   0.1 ms
+        100   1.6 ms   2.8 ms   0.9 ms
+       1000  29.0 ms  28.4 ms  10.0 ms
+      10000 531.6 ms 238.8 ms 114.5 ms
+
+Usage: python spikequeue_propagate.py
+'''
+from time import time
+import numpy as np
+from brian import *
+from brian.synapses.spikequeue import SpikeQueue
+from brian.utils.dynamicarray import DynamicArray1D
+
+set_global_preferences(useweave=False)
+
+
+class OldSpikeQueue(SpikeQueue):
+    '''
+    SpikeQueue using the previous propagation code.
+    '''
+    def precompute_offsets(self):
+        self._offsets = []
+        for i in range(len(self.synapses)):
+            delays = self.delays[self.synapses[i].data]
+            self._offsets.append(self.offsets(delays))
+
+    def propagate(self, spikes):
+        if len(spikes):
+            if self._homogeneous:
+                synaptic_events = np.hstack([self.synapses[i].data for i in spikes])
+                self.insert_homogeneous(self.delays[0], synaptic_events)
+            elif self._offsets is None:
+                synaptic_events = np.hstack([self.synapses[i].data for i in spikes])
+                if len(synaptic_events):
+                    delay = self.delays[synaptic_events]
+                    self.insert(delay, synaptic_events)
+            else:
+                for i in spikes:
+                    synaptic_events = self.synapses[i].data
+                    if len(synaptic_events):
+                        delay = self.delays[synaptic_events]
+                        offsets = self._offsets[i]
+                        self.insert(delay, synaptic_events, offsets)
+
+
+def make_queue(queueclass, N, K, precompute_offsets):
+    source = NeuronGroup(N, 'v:1')
+    synapses = []
+    for i in range(N):
+        targets = DynamicArray1D(K, dtype=np.int32)
+        targets[:] = np.arange(i * K, (i + 1) * K)
+        synapses.append(targets)
+    delays = np.random.randint(1, 51, N * K)
+    queue = queueclass(source, synapses, delays,
+                       precompute_offsets=precompute_offsets)
+    queue.compress()
+    return queue
+
+
+def benchmark(queue, nspikes, nsteps=100):
+    N = len(queue.synapses)
+    spikes = [np.sort(np.random.permutation(N)[:nspikes]) for _ in range(nsteps)]
+    start = time()
+    for s in spikes:
+        queue.propagate(s)
+        queue.next()
+    return (time() - start) / nsteps
+
+if __name__ == '__main__':
+    N, K = 10000, 100
+    queues = [make_queue(OldSpikeQueue, N, K, False),
+              make_queue(OldSpikeQueue, N, K, True),
+              make_queue(SpikeQueue, N, K, True)]
+    print 'spikes/step  hstack    loop    CSR'
+    for nspikes in [10, 100, 1000, 10000]:
+        times = [benchmark(queue, nspikes) * 1000 for queue in queues]
+        print '%11d %5.1f ms %5.1f ms %5.1f ms' % ((nspikes,) + tuple(times))
@@ -0,0 +1,66 @@
+'''
+Benchmark of event-driven STDP as a function of the firing rate
+
+Compares ExponentialSTDP with the variables updated at every time step and
+with event-driven variables (event_driven=True), which are only advanced to
+the current time for the neurons that spiked and the neurons they are
+connected to. The connection has 4000 x 1000 neurons with 5% connectivity
+(200000 synapses, sparse matrix with column access), all the neurons fire
+at the same rate, and the times are for the updates of the STDP groups and
+of the weights during 1 s of simulation (10000 time steps, the spikes are
+generated beforehand).
+
+Results (s per second of simulation, clock-driven / event-driven):
+
+   0.1 Hz: 0.17 / 0.03
+     1 Hz: 0.33 / 0.26
+    10 Hz: 0.75 / 0.95
+    50 Hz: 1.70 / 2.07
+
+The cost of the clock-driven updates of the variables is paid at every time
+step whatever the rate, whereas the cost of the event-driven updates grows
+with the number of spikes and of their synapses. Event-driven STDP is faster
+at low rates, when most time steps have no spikes (below a few Hz here), and
+slower at high rates, where advancing the variables of the synapses of the
+spikes costs more than updating all the variables.
+
+Usage: python stdp_event_driven.py
+'''
+from time import time
+from brian import *
+from brian.stdp import STDPUpdater
+
+
+def benchmark(C, spikes, event_driven):
+    stdp = ExponentialSTDP(C, 20*ms, 20*ms, 0.01, -0.012, wmax=0.2,
+                           event_driven=event_driven)
+    updaters = [obj for obj in stdp.contained_objects
+                if isinstance(obj, STDPUpdater)]
+    clock = stdp.clock
+    clock.reinit()
+    start = time()
+    for pre_spikes, post_spikes in spikes:
+        stdp.pre_group.update()
+        stdp.post_group.update()
+        updaters[0].propagate(pre_spikes)
+        updaters[1].propagate(post_spikes)
+        clock.tick()
+    return time()-start
+
+if __name__ == '__main__':
+    P = NeuronGroup(4000, model='v:1')
+    G = NeuronGroup(1000, model='v:1')
+    C = Connection(P, G, 'v', structure='sparse', column_access=True)
+    C.connect_random(P, G, 0.05, weight=0.1, seed=1)
+    C.compress()
+    W = C.W.alldata.copy()
+    for rate in [0.1*Hz, 1*Hz, 10*Hz, 50*Hz]:
+        seed(2)
+        p = float(rate*defaultclock.dt)
+        spikes = [((rand(len(P))<p).nonzero()[0], (rand(len(G))<p).nonzero()[0])
+                  for _ in range(10000)]
+        times = []
+        for event_driven in [False, True]:
+            C.W.alldata[:] = W
+            times.append(benchmark(C, spikes, event_driven))
+        print '%6s Hz: %.2f / %.2f' % (float(rate), times[0], times[1])
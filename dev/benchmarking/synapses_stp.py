@@ -0,0 +1,70 @@
+'''
+Benchmark of short-term plasticity in Synapses
+
+Compares STPSynapses, which updates the variables u and x of all the
+synapses receiving spikes during a time step at once, with the short-term
+plasticity written in the presynaptic code of Synapses (as in
+examples/synapses/short_term_plasticity.py). 1000 Poisson neurons are
+connected to 1000 neurons with 10% connectivity (100000 synapses), and the
+times are the best time of the updates of the synapses in three runs of 1 s.
+
+Results (s per second of simulation, presynaptic code / STPSynapses):
+
+   5 Hz: 0.41 / 0.36
+  20 Hz: 1.30 / 0.95
+  50 Hz: 2.10 / 1.81
+
+The presynaptic code is already executed for all the synapses of a time step
+at once, STPSynapses saves the repeated indexing of the variables of these
+synapses.
+
+Usage: python synapses_stp.py
+'''
+from time import time
+from brian import *
+
+taud, tauf, U = 50*ms, 100*ms, .1
+
+
+def run_time(rate, stp_synapses, duration=1*second, repeats=3):
+    reinit_default_clock()
+    seed(1)
+    P = PoissonGroup(1000, rates=rate)
+    G = NeuronGroup(1000, model='dv/dt=-v/(10*ms) : 1')
+    if stp_synapses:
+        S = STPSynapses(P, G, model='w : 1', pre='v+=w*u*x',
+                        taud=taud, tauf=tauf, U=U)
+    else:
+        S = Synapses(P, G, model='''w : 1
+                                    u : 1
+                                    x : 1''',
+                     pre='''u=U+(u-U)*exp(-(t-lastupdate)/tauf)
+                            x=1+(x-1)*exp(-(t-lastupdate)/taud)
+                            v+=w*u*x
+                            x*=(1-u)
+                            u+=U*(1-u)''')
+    S[:, :] = 0.1
+    S.w = 0.1
+    S.u = U
+    S.x = 1
+    # only the updates of the synapses are timed
+    update = S.update
+    elapsed = [0.]
+    def timed_update():
+        start = time()
+        update()
+        elapsed[0] += time()-start
+    S.update = timed_update
+    net = Network(P, G, S)
+    net.run(1*ms)
+    times = []
+    for _ in range(repeats):
+        elapsed[0] = 0.
+        net.run(duration)
+        times.append(elapsed[0])
+    return min(times)
+
+if __name__ == '__main__':
+    for rate in [5*Hz, 20*Hz, 50*Hz]:
+        print '%4d Hz: %.2f / %.2f' % (float(rate), run_time(rate, False),
+                                       run_time(rate, True))
@@ -0,0 +1,48 @@
+'''
+Benchmark of the threaded update of NeuronGroup state variables
+
+Runs a large group of nonlinear (quadratic integrate-and-fire) neurons with
+an adaptation variable for 100 ms, with the state update split between 1, 2
+and 4 threads (``NeuronGroup(..., threads=n)``).
+
+Results (N=1000000, on a machine with a single core, so that this only
+measures the overhead of the thread pool):
+
+1 thread: 26.02 s
+2 threads: 26.58 s (speedup 1.0)
+4 threads: 26.15 s (speedup 1.0)
+
+With several cores, the speedup is limited by the parts of the update that
+hold the GIL (the Python code between numpy operations) and by the memory
+bandwidth.
+
+Usage: python threaded_neurongroup.py
+'''
+from time import time
+from brian import *
+
+eqs = '''
+dv/dt = (v * v - w + I) / (10 * ms) : 1
+dw/dt = (0.2 * v - w) / (100 * ms) : 1
+I : 1
+'''
+
+
+def benchmark(N, threads, duration=100 * ms):
+    reinit_default_clock()
+    G = NeuronGroup(N, eqs, threshold='v>1', reset='v=0; w+=0.1',
+                    compile=True, freeze=True, threads=threads)
+    G.I = rand(N) * 0.5
+    net = Network(G)
+    net.run(defaultclock.dt)
+    start = time()
+    net.run(duration)
+    return time() - start
+
+if __name__ == '__main__':
+    N = 1000000
+    t1 = benchmark(N, 1)
+    print '1 thread: %.2f s' % t1
+    for threads in [2, 4]:
+        t = benchmark(N, threads)
+        print '%d threads: %.2f s (speedup %.1f)' % (threads, t, t1 / t)
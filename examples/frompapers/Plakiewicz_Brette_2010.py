@@ -148,7 +148,7 @@ run(duration,report='text')
 
 # Collect spike thresholds and values of h
 threshold,logh=[],[]
-valuesv,valuesh=array(M._values),array(Mh._values)
+valuesv,valuesh=M.values.T,Mh.values.T
 criterion=10*mV/ms # criterion for spike threshold
 for i in range(N):
     v=valuesv[:,i]
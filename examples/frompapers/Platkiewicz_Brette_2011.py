@@ -52,7 +52,7 @@ run(duration,report='text')
 # Linear regression gives depolarization slope before spikes
 tx=M.times[(M.times>0) & (M.times<1.5*tauh)]
 slope,threshold=[],[]
-v=array(M._values)
+v=M.values.T
 for (i,t) in S.spikes:
     ind=(M.times<t) & (M.times>t-tauh)
     mx=v[:,i][ind]